@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+'''
+Benchmarks for the ckanext-dcat RDF processors
+
+They need to be run from an environment where CKAN and ckanext-dcat are
+installed, eg:
+
+    python bin/benchmark.py parse --datasets 10000
+
+    python bin/benchmark.py download --file big_catalog.rdf
+
+    python bin/benchmark.py stream --datasets 20000
+
+Run the script with the `-h` argument to see all available benchmarks and
+options.
+'''
+import os
+import sys
+import time
+import resource
+import argparse
+import tempfile
+import multiprocessing
+
+import rdflib
+from rdflib import URIRef, BNode
+from rdflib.namespace import RDF
+
+from ckanext.dcat.processors import RDFParser, RDFSerializer
+from ckanext.dcat.profiles import DCAT
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'examples')
+DEFAULT_CATALOG = os.path.join(EXAMPLES_DIR, 'catalog.rdf')
+
+
+def scaled_catalog(path, datasets, _format='xml'):
+    '''
+    Returns an rdflib Graph with the datasets of the RDF file in `path`
+    repeated until there are `datasets` of them
+
+    Each copy gets new URIs for the datasets and new blank nodes, all other
+    nodes (catalog, licenses, etc) are shared.
+    '''
+    source = rdflib.Graph()
+    source.parse(path, format=_format)
+
+    dataset_refs = set(source.subjects(RDF.type, DCAT.Dataset))
+    if not dataset_refs:
+        raise ValueError('No datasets found in {0}'.format(path))
+
+    g = rdflib.Graph()
+    for prefix, namespace in source.namespaces():
+        g.bind(prefix, namespace)
+
+    copies = 0
+    while copies * len(dataset_refs) < datasets:
+        bnodes = {}
+
+        def _node(node):
+            if node in dataset_refs:
+                return URIRef(u'{0}/copy/{1}'.format(node, copies))
+            elif isinstance(node, BNode):
+                return bnodes.setdefault(node, BNode())
+            return node
+
+        for s, p, o in source:
+            g.add((_node(s), p, _node(o)))
+        copies += 1
+
+    return g
+
+
+def _best_of(func, repeat):
+    '''
+    Runs `func` `repeat` times and returns the best wall time in seconds
+    '''
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def _report(label, seconds, items, baseline=None):
+    line = '{0:<45} {1:>8.3f}s {2:>10.0f} datasets/s'.format(
+        label, seconds, items / seconds if seconds else 0)
+    if baseline:
+        line += '  ({0:.2f}x)'.format(baseline / seconds)
+    print(line)
+
+
+class _NoSubjectCacheRDFParser(RDFParser):
+    '''
+    Parser that queries the graph on every profile helper call, as versions
+    of ckanext-dcat prior to the subject cache did
+    '''
+    _use_subject_cache = False
+
+
+class _ProfilePerDatasetRDFParser(RDFParser):
+    '''
+    Parser that creates new profile instances for every dataset, as
+    versions of ckanext-dcat prior to profile instance caching did
+
+    `datasets()` is the one of these versions, so the instances don't get
+    any of the caches set by the current parser either.
+    '''
+
+    def datasets(self):
+        for dataset_ref in self._datasets():
+            dataset_dict = {}
+            for profile_class in self._profiles:
+                profile = profile_class(self.g, self.compatibility_mode)
+                profile._settings = self.settings
+                profile.parse_dataset(dataset_dict, dataset_ref)
+
+            yield dataset_dict
+
+
+def benchmark_parse(args):
+    '''
+    Time spent by `RDFParser.datasets()` extracting CKAN dicts from a
+    scaled up catalog graph, with and without profile instance and subject
+    caching
+    '''
+    g = scaled_catalog(args.catalog, args.datasets)
+    total = len(set(g.subjects(RDF.type, DCAT.Dataset)))
+
+    print('Parsing {0} datasets ({1} triples) with profiles: {2}'.format(
+        total, len(g), ', '.join(args.profiles or ['(default)'])))
+
+    results = []
+    for label, parser_class in (
+            ('profile instances per dataset', _ProfilePerDatasetRDFParser),
+            ('cached profile instances', _NoSubjectCacheRDFParser),
+            ('cached profile instances and subjects', RDFParser),
+            ):
+
+        def run():
+            parser = parser_class(profiles=args.profiles)
+            parser.g = g
+            for dataset in parser.datasets():
+                pass
+
+        results.append((label, _best_of(run, args.repeat)))
+
+    baseline = results[0][1]
+    for label, seconds in results:
+        _report(label, seconds, total, baseline)
+
+
+class _FileResponse(object):
+    '''
+    Mimics a streamed `requests` response reading from a local file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.headers = {'content-length': str(os.path.getsize(path))}
+
+    def iter_content(self, chunk_size=1):
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                yield chunk
+
+    def close(self):
+        pass
+
+
+def _concatenate_content(response, chunk_size):
+    '''
+    Download loop used by versions of ckanext-dcat prior to using a buffer
+    '''
+    content = ''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        content = content + chunk
+    return content
+
+
+def benchmark_download(args):
+    '''
+    Time spent by the harvester reading a large response body, with string
+    concatenation and with a buffer
+    '''
+    from ckanext.dcat.harvesters.base import DCATHarvester
+
+    path = args.file
+    if not path:
+        g = scaled_catalog(args.catalog, args.datasets)
+        f = tempfile.NamedTemporaryFile(suffix='.rdf', delete=False)
+        with f:
+            g.serialize(f, format='xml')
+        path = f.name
+
+    size = os.path.getsize(path)
+    print('Reading {0} ({1:.1f} Mb)'.format(path, size / 1024.0 / 1024))
+
+    harvester = DCATHarvester()
+    harvester.MAX_FILE_SIZE = size
+
+    try:
+        for chunk_size in args.chunk_sizes:
+            harvester.CHUNK_SIZE = chunk_size
+
+            def concatenation(response):
+                return _concatenate_content(response, chunk_size)
+
+            def buffer(response):
+                return harvester._read_content(response, None)
+
+            results = []
+            for label, func in (('concatenation', concatenation),
+                                ('buffer', buffer)):
+                response = _FileResponse(path)
+
+                def run():
+                    assert len(func(response)) == size
+
+                results.append((label, _best_of(run, args.repeat)))
+
+            baseline = results[0][1]
+            for label, seconds in results:
+                line = '{0:<45} {1:>8.3f}s'.format(
+                    '{0} ({1} bytes chunks)'.format(label, chunk_size),
+                    seconds)
+                line += '  ({0:.2f}x)'.format(baseline / seconds)
+                print(line)
+    finally:
+        if not args.file:
+            os.remove(path)
+
+
+def _parse_in_subprocess(data, _format, streaming, profiles):
+    '''
+    Parses `data` in a new process, so its peak memory usage can be
+    measured
+
+    Returns a tuple with the time spent, the increase of the peak resident
+    memory in Kb and the number of datasets
+    '''
+    results = multiprocessing.Queue()
+
+    def run():
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        parser = RDFParser(profiles=profiles)
+        parser.parse(data, _format=_format, streaming=streaming)
+        total = sum(1 for dataset in parser.datasets())
+        results.put((time.time() - start,
+                     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss -
+                     max_rss,
+                     total))
+
+    process = multiprocessing.Process(target=run)
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def benchmark_stream(args):
+    '''
+    Time and peak memory used parsing a large catalog into a single graph
+    and in streaming mode
+
+    The catalog is serialized one dataset at a time, as in the files
+    generated by `paster generate_static`.
+    '''
+    parser = RDFParser(profiles=args.profiles)
+    parser.g = scaled_catalog(args.catalog, args.datasets)
+    dataset_dicts = list(parser.datasets())
+    del parser
+
+    # Resources without URI get one based on their ids
+    for i, dataset_dict in enumerate(dataset_dicts):
+        dataset_dict['id'] = 'dataset-{0}'.format(i)
+        for j, resource_dict in enumerate(dataset_dict['resources']):
+            resource_dict['package_id'] = dataset_dict['id']
+            resource_dict['id'] = 'resource-{0}'.format(j)
+
+    for _format in args.formats:
+        data = ''.join(RDFSerializer(profiles=args.profiles)
+                       .serialize_catalog_iter({}, dataset_dicts,
+                                               _format=_format))
+        print('Parsing {0} ({1:.1f} Mb)'.format(
+            _format, len(data) / 1024.0 / 1024))
+
+        baseline = None
+        for label, streaming in (('graph', False), ('streaming', True)):
+            seconds, max_rss, total = _parse_in_subprocess(
+                data, _format, streaming, args.profiles)
+            line = '{0:<45} {1:>8.3f}s {2:>10.1f} Mb more memory'.format(
+                '{0} ({1} datasets)'.format(label, total), seconds,
+                max_rss / 1024.0)
+            if baseline:
+                line += '  ({0:.2f}x)'.format(baseline / float(max_rss))
+            else:
+                baseline = max_rss
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='ckanext-dcat benchmarks')
+    subparsers = parser.add_subparsers()
+
+    parse_parser = subparsers.add_parser(
+        'parse', help=benchmark_parse.__doc__.strip().split('\n')[0])
+    parse_parser.add_argument('-c', '--catalog', default=DEFAULT_CATALOG,
+                              help='RDF/XML catalog to scale up. Defaults '
+                                   'to examples/catalog.rdf')
+    parse_parser.add_argument('-n', '--datasets', type=int, default=10000,
+                              help='Number of datasets to parse. '
+                                   'Defaults to 10000')
+    parse_parser.add_argument('-r', '--repeat', type=int, default=3,
+                              help='Number of runs, the best one is '
+                                   'reported. Defaults to 3')
+    parse_parser.add_argument('-p', '--profiles', nargs='*',
+                              help='RDF Profiles to use, defaults to '
+                                   'euro_dcat_ap')
+    parse_parser.set_defaults(func=benchmark_parse)
+
+    download_parser = subparsers.add_parser(
+        'download', help=benchmark_download.__doc__.strip().split('\n')[0])
+    download_parser.add_argument('-f', '--file',
+                                 help='Local RDF file to read. By default '
+                                      'a scaled up catalog is generated')
+    download_parser.add_argument('-c', '--catalog', default=DEFAULT_CATALOG,
+                                 help='RDF/XML catalog to scale up. Defaults '
+                                      'to examples/catalog.rdf')
+    download_parser.add_argument('-n', '--datasets', type=int, default=20000,
+                                 help='Number of datasets in the generated '
+                                      'file. Defaults to 20000')
+    download_parser.add_argument('-s', '--chunk-sizes', type=int, nargs='*',
+                                 default=[1024, 1024 * 64],
+                                 help='Chunk sizes to read, in bytes. '
+                                      'Defaults to 1024 and 65536')
+    download_parser.add_argument('-r', '--repeat', type=int, default=3,
+                                 help='Number of runs, the best one is '
+                                      'reported. Defaults to 3')
+    download_parser.set_defaults(func=benchmark_download)
+
+    stream_parser = subparsers.add_parser(
+        'stream', help=benchmark_stream.__doc__.strip().split('\n')[0])
+    stream_parser.add_argument('-c', '--catalog', default=DEFAULT_CATALOG,
+                               help='RDF/XML catalog to scale up. Defaults '
+                                    'to examples/catalog.rdf')
+    stream_parser.add_argument('-n', '--datasets', type=int, default=10000,
+                               help='Number of datasets in the parsed '
+                                    'document. Defaults to 10000')
+    stream_parser.add_argument('-f', '--formats', nargs='*',
+                               default=['nt', 'xml'],
+                               help='Formats to parse. Defaults to nt '
+                                    'and xml')
+    stream_parser.add_argument('-p', '--profiles', nargs='*',
+                               help='RDF Profiles to use, defaults to '
+                                    'euro_dcat_ap')
+    stream_parser.set_defaults(func=benchmark_stream)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from ckantoolkit import config
+
+
+log = logging.getLogger(__name__)
+
+DATASET_CACHE_MAX_ITEMS_CONFIG = 'ckanext.dcat.dataset_cache.max_items'
+DATASET_CACHE_MAX_BYTES_CONFIG = 'ckanext.dcat.dataset_cache.max_bytes'
+
+CATALOG_CACHE_TTL_CONFIG = 'ckanext.dcat.catalog_cache.ttl'
+
+DEFAULT_DATASET_CACHE_MAX_ITEMS = 0  # Disabled
+DEFAULT_DATASET_CACHE_MAX_BYTES = 1024 * 1024 * 50  # 50 Mb
+
+DEFAULT_CATALOG_CACHE_TTL = 60  # Seconds
+
+
+class LRUCache(object):
+    '''
+    A thread-safe, size bounded, least recently used cache
+
+    Entries are evicted (least recently used first) when there are more
+    than `max_items` entries or when the combined length of all values is
+    bigger than `max_bytes`. Values are expected to be strings. If
+    `max_items` is 0 the cache is disabled, and nothing will be stored.
+
+    Entries can be optionally assigned to a group, so all entries in the
+    same group (eg all serializations of a particular dataset) can be
+    removed at once with `invalidate()`.
+
+    Hit and miss counters are kept to help sizing the cache, see `stats()`.
+    '''
+
+    def __init__(self, max_items, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_items > 0
+
+    def get(self, key, default=None):
+        '''
+        Returns the value stored for `key`, or `default` if not found
+        '''
+        with self._lock:
+            try:
+                value, group = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Move it to the most recently used end
+            self._entries[key] = (value, group)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, group=None):
+        '''
+        Stores `value` under `key`, evicting old entries if needed
+
+        Values bigger than `max_bytes` are not stored.
+        '''
+        if not self.enabled:
+            return
+        size = len(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, group)
+            self._bytes += size
+            if group is not None:
+                self._groups.setdefault(group, set()).add(key)
+
+            while (len(self._entries) > self.max_items or
+                   (self.max_bytes and self._bytes > self.max_bytes)):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, group):
+        '''
+        Removes all entries assigned to `group`
+        '''
+        with self._lock:
+            for key in self._groups.get(group, set()).copy():
+                self._remove(key)
+
+    def clear(self):
+        '''
+        Removes all entries and resets the counters
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        '''
+        Returns a dict with the current size and usage counters of the cache
+        '''
+        with self._lock:
+            return {
+                'items': len(self._entries),
+                'bytes': self._bytes,
+                'max_items': self.max_items,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key):
+        # Must be called with the lock acquired
+        value, group = self._entries.pop(key)
+        self._bytes -= len(value)
+        if group is not None:
+            keys = self._groups.get(group)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._groups[group]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+class ExpiringCache(object):
+    '''
+    A thread-safe cache whose entries expire `ttl` seconds after being set
+
+    It is meant for a small number of values that are expensive to compute
+    and can be slightly out of date. If `ttl` is 0 the cache is disabled,
+    and nothing will be stored.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key, default=None):
+        '''
+        Returns the value stored for `key`, or `default` if not found or
+        expired
+        '''
+        with self._lock:
+            try:
+                value, expires = self._entries[key]
+            except KeyError:
+                return default
+            if expires <= time.time():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        '''
+        Stores `value` under `key`
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+
+    def clear(self):
+        '''
+        Removes all entries
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_dataset_cache = None
+
+
+def dataset_cache():
+    '''
+    Returns the process-wide cache of dataset serializations
+
+    It is created on first use, with the limits defined in the
+    `ckanext.dcat.dataset_cache.max_items` (0, ie disabled, by default) and
+    `ckanext.dcat.dataset_cache.max_bytes` (50 Mb by default) config
+    options.
+    '''
+    global _dataset_cache
+    if _dataset_cache is None:
+        _dataset_cache = LRUCache(
+            int(config.get(DATASET_CACHE_MAX_ITEMS_CONFIG,
+                           DEFAULT_DATASET_CACHE_MAX_ITEMS)),
+            int(config.get(DATASET_CACHE_MAX_BYTES_CONFIG,
+                           DEFAULT_DATASET_CACHE_MAX_BYTES)))
+        if _dataset_cache.enabled:
+            log.debug('Caching up to %s dataset serializations (%s bytes)',
+                      _dataset_cache.max_items, _dataset_cache.max_bytes)
+    return _dataset_cache
+
+
+def reset_dataset_cache():
+    '''
+    Discards the current dataset cache, so it is created again (with the
+    current config options) the next time it is used
+    '''
+    global _dataset_cache
+    _dataset_cache = None
+
+
+_catalog_cache = None
+
+
+def catalog_cache():
+    '''
+    Returns the process-wide cache of catalog level values, like the catalog
+    modification date
+
+    It is created on first use, with entries expiring after the number of
+    seconds defined in the `ckanext.dcat.catalog_cache.ttl` config option
+    (60 by default, 0 disables the cache). It is cleared when a dataset is
+    created, updated or deleted in this process.
+    '''
+    global _catalog_cache
+    if _catalog_cache is None:
+        _catalog_cache = ExpiringCache(
+            int(config.get(CATALOG_CACHE_TTL_CONFIG,
+                           DEFAULT_CATALOG_CACHE_TTL)))
+    return _catalog_cache
+
+
+def reset_catalog_cache():
+    '''
+    Discards the current catalog cache, so it is created again (with the
+    current config options) the next time it is used
+    '''
+    global _catalog_cache
+    _catalog_cache = None
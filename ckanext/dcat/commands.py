@@ -1,18 +1,53 @@
+import os
+import gzip
 import json
 import logging
+import hashlib
+import tempfile
+import datetime
+import itertools
 
 from pylons import config
 from ckan import plugins as p
 
+from ckanext.dcat import converters
+from ckanext.dcat.logic import _search_ckan_datasets
+from ckanext.dcat.processors import RDFSerializer, FRAGMENT_SEPARATORS
+from ckanext.dcat.utils import CONTENT_TYPES, url_to_rdflib_format
+
+
+# Formats that can be generated, besides `json`
+RDF_FORMATS = ('xml', 'ttl', 'nt', 'jsonld')
+
+MANIFEST_SUFFIX = '.manifest.json'
+INDEX_SUFFIX = '.index.json'
+
 
 class GenerateStaticDCATCommand(p.toolkit.CkanCommand):
     """
-    Generates static JSON files containing all datasets.
+    Generates static files containing all datasets.
 
     The generate command will generate a static file containing all of the
-    datasets in the catalog in JSON format.
+    public datasets in the catalog, in one of the following formats:
+
+        json    DCAT JSON (same as the /dcat.json endpoint)
+        xml     RDF/XML
+        ttl     Turtle
+        nt      N-Triples
+        jsonld  JSON-LD
+
+    paster generate_static <FORMAT> <OUTPUT_FILE> [--gzip] [--incremental]
+        -c <PATH_TO_CONFIG>
 
-    paster generate_static json <OUTPUT_FILE> -c <PATH_TO_CONFIG>
+    Datasets are read and written one page at a time. The file is written
+    to a temporary location and moved to <OUTPUT_FILE> once finished, along
+    with a <OUTPUT_FILE>.manifest.json file containing the number of
+    datasets, the SHA-256 checksum of the file and the generation time.
+
+    The position of each dataset in the file is stored in
+    <OUTPUT_FILE>.index.json. With --incremental, only the datasets modified
+    since the last run are serialized again, the rest are copied from the
+    previous file. Deleted (or private) datasets are removed.
     """
     summary = __doc__.split('\n')[0]
     usage = __doc__
@@ -21,6 +56,13 @@ class GenerateStaticDCATCommand(p.toolkit.CkanCommand):
 
     def __init__(self, name):
         super(GenerateStaticDCATCommand, self).__init__(name)
+        self.parser.add_option('-z', '--gzip', dest='gzip',
+                               action='store_true', default=False,
+                               help='Compress the output file with gzip')
+        self.parser.add_option('-i', '--incremental', dest='incremental',
+                               action='store_true', default=False,
+                               help='Only serialize the datasets modified '
+                                    'since the previous run')
 
     def command(self):
         self._load_config()
@@ -32,35 +74,353 @@ class GenerateStaticDCATCommand(p.toolkit.CkanCommand):
 
         cmd, output = self.args
 
-        if cmd == 'json':
-            self.generate(output)
+        if cmd == 'json' or cmd in RDF_FORMATS:
+            self.generate(cmd, output)
         else:
             self.log.error("Unknown command {0}".format(cmd))
 
-    def generate(self, output):
+    def generate(self, _format, output):
+        """
+        Writes all datasets to the output file, its index and its manifest
+
+        The output is written to a temporary file in the same directory,
+        which is then renamed, so the previous version of the file is
+        available until the new one is complete. The index and the manifest
+        are written to temporary files as well before that, and renamed
+        right after the output file.
+        """
+        output = os.path.abspath(output)
+        generated = datetime.datetime.utcnow()
+
+        index = {
+            'format': _format,
+            'gzip': self.options.gzip,
+            'profiles': self.profiles(_format),
+            'generated': generated.isoformat(),
+        }
+
+        previous = None
+        if self.options.incremental:
+            previous = self.load_index(output, index)
+            if not previous:
+                self.log.info('No valid index found for {0}, generating '
+                              'all datasets'.format(output))
+
+        tmp = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(output),
+            prefix='.{0}.'.format(os.path.basename(output)),
+            delete=False)
+        tmp_names = [tmp.name]
+        done = False
+        try:
+            if self.options.gzip:
+                f = gzip.GzipFile(filename=os.path.basename(output),
+                                  fileobj=tmp, mode='wb')
+            else:
+                f = tmp
+
+            index['datasets'] = self.write(f, _format, output, previous)
+
+            if self.options.gzip:
+                f.close()
+            tmp.close()
+
+            # Temporary files are only readable by their owner
+            os.chmod(tmp.name, 0644)
+
+            index['size'] = os.path.getsize(tmp.name)
+            manifest = {
+                'file': os.path.basename(output),
+                'format': _format,
+                'content_type': CONTENT_TYPES.get(_format, 'application/json'),
+                'gzip': self.options.gzip,
+                'datasets': len(index['datasets']),
+                'size': index['size'],
+                'sha256': _sha256(tmp.name),
+                'generated': generated.isoformat(),
+            }
+
+            tmp_index = _write_temporary(output + INDEX_SUFFIX,
+                                         json.dumps(index))
+            tmp_names.append(tmp_index)
+            tmp_manifest = _write_temporary(output + MANIFEST_SUFFIX,
+                                            json.dumps(manifest, indent=2))
+            tmp_names.append(tmp_manifest)
+
+            os.rename(tmp.name, output)
+            os.rename(tmp_index, output + INDEX_SUFFIX)
+            os.rename(tmp_manifest, output + MANIFEST_SUFFIX)
+            done = True
+        finally:
+            if not done:
+                tmp.close()
+                for name in tmp_names:
+                    if os.path.exists(name):
+                        os.remove(name)
+
+        self.log.info('Wrote {0} datasets to {1}'.format(
+            len(index['datasets']), output))
+
+    def profiles(self, _format):
         """
-        Keep reading and converting datasets until we get an empty list back
-        from dcat_datasets_list
+        Returns the serializer settings that affect the output, so files
+        generated with different ones are not mixed
         """
-        data_dict = {'page': 0}
+        if _format == 'json':
+            return None
+        serializer = RDFSerializer()
+        return [profile.name for profile in serializer._profiles] + [
+            serializer.compatibility_mode]
+
+    def load_index(self, output, index):
+        """
+        Returns the index of the previous run, if it can be used to update
+        the current output file
+
+        The previous run must have used the same options, and the output file
+        must not have been changed since.
+        """
+        path = output + INDEX_SUFFIX
+        if not os.path.exists(path) or not os.path.exists(output):
+            return None
+
+        with open(path, 'r') as f:
+            previous = json.load(f)
+
+        for key in ('format', 'gzip', 'profiles'):
+            if previous.get(key) != index[key]:
+                return None
+        if previous.get('size') != os.path.getsize(output):
+            return None
+
+        return previous
+
+    def write(self, f, _format, output, previous=None):
+        """
+        Writes the catalog to `f`, reusing the dataset fragments in the
+        previous output file when its index is provided
+
+        Returns a list of index entries, one per dataset, with the dataset
+        id, its `metadata_modified` value and the offset and length of its
+        fragment in the (uncompressed) output.
+        """
+        if previous:
+            modified_since = previous['generated']
+            current_ids = self.dataset_ids()
+            modified_ids = self.dataset_ids(modified_since=modified_since)
+            previous_ids = set(entry[0] for entry in previous['datasets'])
+
+            refresh_ids = current_ids & (modified_ids |
+                                         (current_ids - previous_ids))
+            kept = [entry for entry in previous['datasets']
+                    if entry[0] in current_ids and entry[0] not in refresh_ids]
+
+            self.log.info(
+                '{0} datasets unchanged, {1} to update, {2} to remove'.format(
+                    len(kept), len(refresh_ids),
+                    len(previous_ids - current_ids)))
+
+            datasets = self.refreshed_datasets(refresh_ids, modified_since)
+        else:
+            kept = []
+            datasets = self.datasets()
+
+        if _format == 'json':
+            start, end, separator = '[', ']', ','
+            catalog_fragment = None
+            fragments = ((dataset, json.dumps(converters.ckan_to_dcat(dataset)))
+                         for dataset in datasets)
+        else:
+            serializer = RDFSerializer()
+            fragments = serializer.serialize_catalog_fragments(
+                {}, datasets, _format=_format, self_contained=True)
+            # The catalog is always serialized again, as its modification
+            # date changes
+            catalog_fragment = next(fragments)[1]
+            start = serializer.catalog_fragments_start(_format)
+            end = serializer.catalog_fragments_end(_format)
+            separator = FRAGMENT_SEPARATORS.get(
+                url_to_rdflib_format(_format), '')
+
+        out = _OffsetWriter(f)
+        out.write(start)
+        if catalog_fragment:
+            out.write(catalog_fragment)
+
+        entries = []
+        for dataset_id, metadata_modified, fragment in itertools.chain(
+                self.previous_fragments(output, kept),
+                ((dataset['id'], dataset['metadata_modified'], fragment)
+                 for dataset, fragment in fragments)):
+            if not fragment:
+                continue
+            if entries or catalog_fragment:
+                out.write(separator)
+            entries.append(
+                [dataset_id, metadata_modified, out.offset, len(fragment)])
+            out.write(fragment)
+
+        out.write(end)
+
+        return entries
+
+    def previous_fragments(self, output, entries):
+        """
+        Reads the fragments for the provided index entries from the previous
+        output file
+        """
+        if not entries:
+            return
+        _open = gzip.open if self.options.gzip else open
+        with _open(output, 'rb') as f:
+            for dataset_id, metadata_modified, offset, length in sorted(
+                    entries, key=lambda entry: entry[2]):
+                f.seek(offset)
+                yield dataset_id, metadata_modified, f.read(length)
+
+    def datasets(self, modified_since=None, ids=None, seen=None):
+        """
+        Keep reading datasets until we get an empty page back from the search
+
+        Only one page of datasets is kept in memory. As pages are sorted by
+        modification date, datasets updated while the command is running
+        can appear twice, so datasets already returned are skipped.
+
+        If `ids` is provided, only datasets with these ids are returned.
+        """
+        if seen is None:
+            seen = set()
+        data_dict = {'page': 0, 'modified_since': modified_since}
+        while True:
+            data_dict['page'] = data_dict['page'] + 1
+            try:
+                datasets = _search_ckan_datasets({}, data_dict)['results']
+            except p.toolkit.ValidationError, e:
+                self.log.exception(e)
+                break
+
+            if not datasets:
+                break
+
+            for dataset in datasets:
+                if dataset['id'] in seen:
+                    continue
+                if ids is not None and dataset['id'] not in ids:
+                    continue
+                seen.add(dataset['id'])
+                yield dataset
+
+    def dataset_ids(self, modified_since=None):
+        """
+        Returns a set with the ids of all datasets, or of the ones modified
+        since the provided date
+
+        Only the id field is requested from the search index.
+        """
+        ids = set()
+        data_dict = {'page': 0, 'modified_since': modified_since, 'fl': 'id'}
+        while True:
+            data_dict['page'] = data_dict['page'] + 1
+            results = _search_ckan_datasets({}, data_dict)['results']
+            if not results:
+                break
+            ids.update(result['id'] for result in results)
+        return ids
+
+    def refreshed_datasets(self, ids, modified_since):
+        """
+        Returns the datasets with the provided ids
+
+        Most of them will be returned by the search for datasets modified
+        since the last run. Ones that were not in the previous output but
+        have not been modified (eg if they were made public) are requested
+        individually.
+        """
+        seen = set()
+        for dataset in self.datasets(modified_since=modified_since, ids=ids,
+                                     seen=seen):
+            yield dataset
+
+        for dataset_id in ids - seen:
+            try:
+                yield p.toolkit.get_action('package_show')(
+                    {}, {'id': dataset_id})
+            except (p.toolkit.ObjectNotFound, p.toolkit.NotAuthorized):
+                self.log.warning(
+                    'Dataset {0} could not be found'.format(dataset_id))
+
+
+class DCATHarvestGuidsCommand(p.toolkit.CkanCommand):
+    """
+    Manages the guid registry of the DCAT harvesters.
+
+    The DCAT harvesters keep the guid, harvest source and id of the
+    datasets they import on their own indexed table, to avoid looking for
+    guids on the package extras.
+
+    paster dcat_harvest_guids backfill [<SOURCE_ID>] -c <PATH_TO_CONFIG>
+
+    The backfill command registers the guids of the datasets already
+    harvested (from their guid extra), for all sources or only for the
+    provided one. Once run for all sources, guids not found on the registry
+    are not looked for on the dataset extras anymore.
+    """
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 2
+    min_args = 1
+
+    def command(self):
+        self._load_config()
+        self.log = logging.getLogger(__name__)
+
+        cmd = self.args[0]
+        if cmd == 'backfill':
+            self.backfill(self.args[1] if len(self.args) > 1 else None)
+        else:
+            self.log.error("Unknown command {0}".format(cmd))
+
+    def backfill(self, harvest_source_id=None):
+        # Requires ckanext-harvest
+        from ckanext.dcat.harvesters.guids import backfill
+
+        count = backfill(harvest_source_id)
+
+        self.log.info('Registered {0} guids'.format(count))
+
+
+class _OffsetWriter(object):
+    '''
+    Wraps a file object keeping track of the number of bytes written
+    '''
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
 
-        with open(output, 'w') as f:
-            f.write(u"[")
+    def write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
 
-            while True:
-                try:
-                    data_dict['page'] = data_dict['page'] + 1
-                    datasets = \
-                        p.toolkit.get_action('dcat_datasets_list')({},
-                                                                   data_dict)
-                except p.toolkit.ValidationError, e:
-                    self.log.exception(e)
-                    break
 
-                if not datasets:
-                    break
+def _sha256(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 64), ''):
+            checksum.update(block)
+    return checksum.hexdigest()
 
-                for dataset in datasets:
-                    f.write(json.dumps(dataset))
 
-            f.write(u"]")
+def _write_temporary(path, content):
+    '''
+    Writes `content` to a temporary file in the same directory as `path`,
+    to be renamed to it later, and returns the name of the temporary file
+    '''
+    tmp = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path),
+        prefix='.{0}.'.format(os.path.basename(path)),
+        delete=False)
+    with tmp:
+        tmp.write(content)
+    os.chmod(tmp.name, 0644)
+    return tmp.name
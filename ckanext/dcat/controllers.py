@@ -1,5 +1,8 @@
 import json
+import calendar
+from email.utils import formatdate, parsedate_tz, mktime_tz
 
+from ckan import model
 from ckan.plugins import toolkit
 
 if toolkit.check_ckan_version(min_version='2.1'):
@@ -10,6 +13,10 @@ from ckan.controllers.package import PackageController
 from ckan.controllers.home import HomeController
 
 from ckanext.dcat.utils import CONTENT_TYPES, parse_accept_header
+from ckanext.dcat.settings import dcat_settings
+from ckanext.dcat.logic import (catalog_page,
+                                dataset_modification_info,
+                                catalog_modification_info)
 
 
 def check_access_header():
@@ -22,6 +29,69 @@ def check_access_header():
     return _format
 
 
+def is_conditional_request():
+    '''
+    Returns True if the request has an If-None-Match or If-Modified-Since
+    header
+    '''
+    headers = toolkit.request.headers
+    return bool(headers.get('If-None-Match') or
+                headers.get('If-Modified-Since'))
+
+
+def set_validators(etag, last_modified=None):
+    '''
+    Sets the ETag and Last-Modified headers on the response
+
+    `last_modified` is a naive datetime in UTC (or None).
+
+    Returns the Last-Modified value as a timestamp (or None)
+    '''
+    timestamp = None
+    if last_modified:
+        timestamp = calendar.timegm(last_modified.utctimetuple())
+
+    toolkit.response.headers['ETag'] = etag
+    if timestamp is not None:
+        toolkit.response.headers['Last-Modified'] = formatdate(timestamp,
+                                                               usegmt=True)
+    return timestamp
+
+
+def check_not_modified(etag, last_modified=None):
+    '''
+    Sets the ETag and Last-Modified headers on the response and checks them
+    against the request conditional headers
+
+    `last_modified` is a naive datetime in UTC (or None).
+
+    As defined in RFC 7232, If-Modified-Since is ignored if If-None-Match is
+    present.
+
+    Returns True if the client copy is still valid, ie a 304 Not Modified
+    response can be sent.
+    '''
+    timestamp = set_validators(etag, last_modified)
+
+    if_none_match = toolkit.request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = [e.strip() for e in if_none_match.split(',')]
+        return '*' in etags or etag in etags or 'W/' + etag in etags
+
+    if_modified_since = toolkit.request.headers.get('If-Modified-Since')
+    if if_modified_since and timestamp is not None:
+        parsed = parsedate_tz(if_modified_since)
+        if parsed:
+            return timestamp <= mktime_tz(parsed)
+
+    return False
+
+
+def _context():
+    return {'model': model, 'session': model.Session,
+            'user': toolkit.c.user}
+
+
 class DCATController(BaseController):
 
     def read_catalog(self, _format=None):
@@ -46,7 +116,23 @@ class DCATController(BaseController):
         toolkit.response.headers.update(
             {'Content-type': CONTENT_TYPES[_format]})
         try:
-            return toolkit.get_action('dcat_catalog_show')({}, data_dict)
+            # The up to date ETag needs extra queries, only done to answer
+            # conditional requests
+            conditional = is_conditional_request()
+            if conditional:
+                etag, last_modified = catalog_modification_info(_context(),
+                                                                data_dict)
+                if check_not_modified(etag, last_modified):
+                    toolkit.response.status_int = 304
+                    return ''
+
+            # If streamed, returned as a WSGI iterator, datasets are
+            # serialized as the response is sent
+            output, etag, last_modified = catalog_page(
+                _context(), data_dict, stream=dcat_settings().stream_catalog)
+            if not conditional:
+                set_validators(etag, last_modified)
+            return output
         except toolkit.ValidationError, e:
             toolkit.abort(409, str(e))
 
@@ -65,9 +151,16 @@ class DCATController(BaseController):
         toolkit.response.headers.update(
             {'Content-type': CONTENT_TYPES[_format]})
 
+        data_dict = {'id': _id, 'format': _format, 'profiles': _profiles}
+
         try:
-            result = toolkit.get_action('dcat_dataset_show')({}, {'id': _id,
-                'format': _format, 'profiles': _profiles})
+            etag, last_modified = dataset_modification_info(_context(),
+                                                            data_dict)
+            if check_not_modified(etag, last_modified):
+                toolkit.response.status_int = 304
+                return ''
+
+            result = toolkit.get_action('dcat_dataset_show')({}, data_dict)
         except toolkit.ObjectNotFound:
             toolkit.abort(404)
 
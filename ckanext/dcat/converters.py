@@ -1,9 +1,9 @@
 import logging
-import mimetypes
 import re
 
+from ckanext.dcat.utils import resource_format_index
+
 log = logging.getLogger(__name__)
-mimetypes.init()
 
 
 def dcat_to_ckan(dcat_dict):
@@ -43,9 +43,10 @@ def dcat_to_ckan(dcat_dict):
         if distribution.get('format'):
             format = distribution.get('format')
         elif distribution.get('mediaType'):
-            ext = mimetypes.guess_extension(distribution.get('mediaType'))
+            ext = resource_format_index().extension(
+                distribution.get('mediaType'))
             if ext:
-                format = ext[1:]
+                format = ext
         resource = {
             'name': distribution.get('title',dcat_dict.get('title')),
             'description': distribution.get('description'),
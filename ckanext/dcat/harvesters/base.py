@@ -1,9 +1,11 @@
 import os
 import uuid
 import logging
+import urlparse
 
 import requests
 import rdflib
+from ckantoolkit import config
 
 from ckan import plugins as p
 from ckan import logic
@@ -11,20 +13,38 @@ from ckan import model
 
 from ckan.logic import ValidationError, NotFound, get_action
 from ckan.lib.helpers import json
+from ckan.lib.search.common import SearchIndexError
 
 from ckanext.harvest.harvesters import HarvesterBase
 from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 
 from ckanext.dcat.interfaces import IDCATRDFHarvester
+from ckanext.dcat.harvesters.guids import register_guid, unregister_package
+from ckanext.dcat.harvesters.deletion import (mark_not_current,
+                                              pending_package_ids,
+                                              delete_packages,
+                                              delete_chunk_size)
 
 
 log = logging.getLogger(__name__)
 
+POOL_CONNECTIONS_CONFIG = 'ckanext.dcat.harvest.pool_connections'
+POOL_MAXSIZE_CONFIG = 'ckanext.dcat.harvest.pool_maxsize'
+
+CHUNK_SIZE_CONFIG = 'ckanext.dcat.harvest.chunk_size'
+
+BULK_DELETE_CONFIG = 'ckanext.dcat.harvest.bulk_delete'
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+DEFAULT_GATHER_BATCH_SIZE = 100
+
 
 class DCATHarvester(HarvesterBase):
 
     MAX_FILE_SIZE = 1024 * 1024 * 50  # 50 Mb
-    CHUNK_SIZE = 1024
+    CHUNK_SIZE = 1024 * 64
 
     force_import = False
 
@@ -32,6 +52,185 @@ class DCATHarvester(HarvesterBase):
 
     config = None
 
+    _session = None
+    _session_job_id = None
+
+    # Tuple with the harvest job id and the owner organization of its source
+    _source_owner_org = None
+
+    # Tuple with the harvest job id and the ids of the datasets deleted on it
+    _deleted_packages = None
+
+    def _get_session(self, harvest_job):
+        '''
+        Returns the `requests` session used for all requests of a harvest
+        job
+
+        The session is created on the first request of each job, so
+        connections are kept alive and reused between pages. Its connection
+        pool can be sized with the `ckanext.dcat.harvest.pool_connections`
+        (number of hosts) and `ckanext.dcat.harvest.pool_maxsize`
+        (connections per host) config options, or the `pool_connections`
+        and `pool_maxsize` options of the source configuration. The
+        `update_session` method of IDCATRDFHarvester plugins is only called
+        once per session.
+        '''
+        job_id = getattr(harvest_job, 'id', None)
+        if self._session is not None and self._session_job_id == job_id:
+            return self._session
+
+        if self._session is not None:
+            self._session.close()
+
+        source_config = {}
+        source = getattr(harvest_job, 'source', None)
+        if source and source.config:
+            source_config = json.loads(source.config)
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=int(source_config.get(
+                'pool_connections',
+                config.get(POOL_CONNECTIONS_CONFIG, DEFAULT_POOL_CONNECTIONS))),
+            pool_maxsize=int(source_config.get(
+                'pool_maxsize',
+                config.get(POOL_MAXSIZE_CONFIG, DEFAULT_POOL_MAXSIZE))))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        for harvester in p.PluginImplementations(IDCATRDFHarvester):
+            session = harvester.update_session(session)
+
+        self._session = session
+        self._session_job_id = job_id
+        self._skip_head_request = p.toolkit.asbool(
+            source_config.get('skip_head_request', False))
+        # Hosts that sent a Content-Length header on a GET response
+        self._content_length_hosts = set()
+
+        return session
+
+    def _get_source_owner_org(self, harvest_job):
+        '''
+        Returns the owner organization of the harvest source dataset (None
+        if it has none)
+
+        It is only looked up once per harvest job.
+        '''
+        job_id = getattr(harvest_job, 'id', None)
+        if self._source_owner_org is None or self._source_owner_org[0] != job_id:
+            source_dataset = model.Package.get(harvest_job.source.id)
+            self._source_owner_org = (job_id, source_dataset.owner_org)
+        return self._source_owner_org[1]
+
+    def _save_harvest_objects(self, objects, harvest_job):
+        '''
+        Saves new harvest objects (and their extras) in a single transaction
+
+        Instead of committing each object, they are sent to the database in
+        batches of `gather_batch_size` objects (a harvest source config
+        option, 100 by default) and committed at the end.
+
+        Returns a list with the ids of the objects, in the same order
+        '''
+        source_config = {}
+        if harvest_job.source.config:
+            source_config = json.loads(harvest_job.source.config)
+        batch_size = int(source_config.get('gather_batch_size',
+                                           DEFAULT_GATHER_BATCH_SIZE))
+
+        ids = []
+        for start in xrange(0, len(objects), batch_size):
+            batch = objects[start:start + batch_size]
+            model.Session.add_all(batch)
+            model.Session.flush()
+            ids.extend(obj.id for obj in batch)
+        model.Session.commit()
+
+        return ids
+
+    def _create_deletion_objects(self, harvest_job, guids_to_delete,
+                                 guid_to_package_id):
+        '''
+        Creates a harvest object flagged for deletion for each of the
+        provided guids
+
+        The previous objects of all these guids are flagged as not current
+        with a statement per chunk of guids, rather than one per guid.
+
+        Returns a list with the ids of the new objects.
+        '''
+        mark_not_current(guids_to_delete)
+
+        objects = []
+        for guid in guids_to_delete:
+            objects.append(
+                HarvestObject(guid=guid, job=harvest_job,
+                              package_id=guid_to_package_id[guid],
+                              extras=[HarvestObjectExtra(key='status',
+                                                         value='delete')]))
+
+        return self._save_harvest_objects(objects, harvest_job)
+
+    def _delete_package(self, harvest_object, context):
+        '''
+        Deletes the dataset of a harvest object flagged for deletion
+
+        The dataset is deleted on its own with `package_delete`, unless
+        `ckanext.dcat.harvest.bulk_delete` is true. In that case the
+        datasets of other objects of the same job flagged for deletion are
+        deleted along with it, in chunks of up to
+        `ckanext.dcat.harvest.delete_chunk_size` datasets (500 by default),
+        with a single commit and search index update per chunk (see
+        `ckanext.dcat.harvesters.deletion`), and objects whose dataset has
+        already been deleted this way return straight away. If the chunk
+        can not be removed from the search index, only the dataset of the
+        object is deleted, with `package_delete`.
+        '''
+        package_id = harvest_object.package_id
+
+        if not p.toolkit.asbool(config.get(BULK_DELETE_CONFIG, False)):
+            self._delete_single_package(harvest_object, context)
+            return
+
+        job_id = harvest_object.harvest_job_id
+        if self._deleted_packages is None or self._deleted_packages[0] != job_id:
+            self._deleted_packages = (job_id, set())
+        deleted = self._deleted_packages[1]
+
+        if package_id in deleted:
+            log.debug('Package {0} with guid {1} already deleted'.format(
+                package_id, harvest_object.guid))
+            return
+
+        package_ids = pending_package_ids(job_id, delete_chunk_size())
+        if package_id and package_id not in package_ids:
+            package_ids.append(package_id)
+        if not package_ids:
+            return
+
+        try:
+            delete_packages(package_ids)
+        except SearchIndexError, e:
+            log.warning('Could not delete {0} packages at once, deleting '
+                        'package {1} on its own: {2}'.format(
+                            len(package_ids), package_id, e))
+            if package_id:
+                self._delete_single_package(harvest_object, context)
+            return
+        deleted.update(package_ids)
+
+        log.info('Deleted {0} packages, including {1} with guid {2}'.format(
+            len(package_ids), package_id, harvest_object.guid))
+
+    def _delete_single_package(self, harvest_object, context):
+        package_id = harvest_object.package_id
+        p.toolkit.get_action('package_delete')(context, {'id': package_id})
+        unregister_package(package_id)
+        model.Session.commit()
+        log.info('Deleted package {0} with guid {1}'.format(
+            package_id, harvest_object.guid))
+
     def _get_content_and_type(self, url, harvest_job, page=1, content_type=None):
         '''
         Gets the content and type of the given url.
@@ -61,18 +260,22 @@ class DCATHarvester(HarvesterBase):
 
 
             log.debug('Getting file %s', url)
-            
-            # get the `requests` session object
-            session = requests.Session()
-            for harvester in p.PluginImplementations(IDCATRDFHarvester):
-                session = harvester.update_session(session)
 
-            # first we try a HEAD request which may not be supported
+            # get the `requests` session object, shared by the whole job
+            session = self._get_session(harvest_job)
+            host = urlparse.urlparse(url).netloc
+
             did_get = False
-            r = session.head(url)
-            if r.status_code == 405 or r.status_code == 400:
+            if self._skip_head_request and host in self._content_length_hosts:
+                # The size can be checked with the GET response headers
                 r = session.get(url, stream=True)
                 did_get = True
+            else:
+                # first we try a HEAD request which may not be supported
+                r = session.head(url)
+                if r.status_code == 405 or r.status_code == 400:
+                    r = session.get(url, stream=True)
+                    did_get = True
             r.raise_for_status()
 
             cl = r.headers.get('content-length')
@@ -81,20 +284,18 @@ class DCATHarvester(HarvesterBase):
                     file size: {allowed}, Content-Length: {actual}.'''.format(
                     allowed=self.MAX_FILE_SIZE, actual=cl)
                 self._save_gather_error(msg, harvest_job)
+                r.close()
                 return None, None
 
             if not did_get:
                 r = session.get(url, stream=True)
 
-            length = 0
-            content = ''
-            for chunk in r.iter_content(chunk_size=self.CHUNK_SIZE):
-                content = content + chunk
-                length += len(chunk)
+            if r.headers.get('content-length'):
+                self._content_length_hosts.add(host)
 
-                if length >= self.MAX_FILE_SIZE:
-                    self._save_gather_error('Remote file is too big.', harvest_job)
-                    return None, None
+            content = self._read_content(r, harvest_job)
+            if content is None:
+                return None, None
 
             if content_type is None and r.headers.get('content-type'):
                 content_type = r.headers.get('content-type').split(";", 1)[0]
@@ -120,6 +321,28 @@ class DCATHarvester(HarvesterBase):
             self._save_gather_error(msg, harvest_job)
             return None, None
 
+    def _read_content(self, response, harvest_job):
+        '''
+        Reads the body of a streamed response
+
+        The body is read in chunks of `ckanext.dcat.harvest.chunk_size` bytes
+        (`CHUNK_SIZE` by default) into a growing buffer, so the time spent
+        copying stays linear with the size of the body.
+
+        Returns a string, or None if the body is bigger than `MAX_FILE_SIZE`
+        '''
+        chunk_size = int(config.get(CHUNK_SIZE_CONFIG, self.CHUNK_SIZE))
+
+        content = bytearray()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if len(content) + len(chunk) > self.MAX_FILE_SIZE:
+                self._save_gather_error('Remote file is too big.', harvest_job)
+                response.close()
+                return None
+            content.extend(chunk)
+
+        return str(content)
+
     def _get_user_name(self):
         if self._user_name:
             return self._user_name
@@ -141,6 +364,17 @@ class DCATHarvester(HarvesterBase):
                 return extra.value
         return None
 
+    def _set_object_extra(self, harvest_object, key, value):
+        '''
+        Helper function for setting the value of a harvest object extra,
+        adding it if the object does not have it yet
+        '''
+        for extra in harvest_object.extras:
+            if extra.key == key:
+                extra.value = value
+                return
+        harvest_object.extras.append(HarvestObjectExtra(key=key, value=value))
+
     def _get_package_name(self, harvest_object, title):
 
         package = harvest_object.package
@@ -259,11 +493,31 @@ class DCATHarvester(HarvesterBase):
                 if not isinstance(config_obj['default_extras'], dict):
                     raise ValueError('default_extras must be a dictionary')
 
+            if 'gather_batch_size' in config_obj:
+                gather_batch_size = config_obj['gather_batch_size']
+                if not isinstance(gather_batch_size, int) or gather_batch_size < 1:
+                    raise ValueError('gather_batch_size must be a positive integer')
+
+            self._validate_session_config(config_obj)
+
         except ValueError, e:
             raise e
 
         return config
 
+    def _validate_session_config(self, config_obj):
+        '''
+        Checks the source configuration options used by `_get_session`
+        '''
+        for key in ('pool_connections', 'pool_maxsize'):
+            if key in config_obj:
+                if not isinstance(config_obj[key], int) or config_obj[key] < 1:
+                    raise ValueError('{0} must be a positive integer'.format(key))
+
+        if 'skip_head_request' in config_obj:
+            if not isinstance(config_obj['skip_head_request'], bool):
+                raise ValueError('skip_head_request must be true or false')
+
     ## End hooks
 
     def gather_stage(self,harvest_job):
@@ -317,6 +571,7 @@ class DCATHarvester(HarvesterBase):
             try:
 
                 batch_guids = []
+                batch_objects = []
                 for guid, as_string in self._get_guids_and_datasets(content):
 
                     log.debug('Got identifier: {0}'.format(guid.encode('utf8')))
@@ -335,8 +590,9 @@ class DCATHarvester(HarvesterBase):
                             obj = HarvestObject(guid=guid, job=harvest_job,
                                             content=as_string,
                                             extras=[HarvestObjectExtra(key='status', value='new')])
-                        obj.save()
-                        ids.append(obj.id)
+                        batch_objects.append(obj)
+
+                ids.extend(self._save_harvest_objects(batch_objects, harvest_job))
 
                 if len(batch_guids) > 0:
                     guids_in_source.extend(set(batch_guids) - set(previous_guids))
@@ -362,15 +618,8 @@ class DCATHarvester(HarvesterBase):
 
         # Check datasets that need to be deleted
         guids_to_delete = set(guids_in_db) - set(guids_in_source)
-        for guid in guids_to_delete:
-            obj = HarvestObject(guid=guid, job=harvest_job,
-                                package_id=guid_to_package_id[guid],
-                                extras=[HarvestObjectExtra(key='status', value='delete')])
-            model.Session.query(HarvestObject).\
-                  filter_by(guid=guid).\
-                  update({'current': False}, False)
-            obj.save()
-            ids.append(obj.id)
+        ids.extend(self._create_deletion_objects(harvest_job, guids_to_delete,
+                                                 guid_to_package_id))
 
 
         return ids
@@ -393,8 +642,7 @@ class DCATHarvester(HarvesterBase):
             # Delete package
             context = {'model': model, 'session': model.Session, 'user': self._get_user_name()}
 
-            p.toolkit.get_action('package_delete')(context, {'id': harvest_object.package_id})
-            log.info('Deleted package {0} with guid {1}'.format(harvest_object.package_id, harvest_object.guid))
+            self._delete_package(harvest_object, context)
 
             return True
 
@@ -472,6 +720,9 @@ class DCATHarvester(HarvesterBase):
             package_id = p.toolkit.get_action('package_update')(context, package_dict)
             log.info('Updated dataset with id %s', package_id)
 
+        register_guid(harvest_object.guid, harvest_object.harvest_source_id,
+                      package_dict['id'])
+
         model.Session.commit()
 
         return True
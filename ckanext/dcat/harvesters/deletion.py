@@ -0,0 +1,128 @@
+'''
+Bulk deletion of the datasets that are no longer on a harvest source
+
+Deleting datasets one by one with `package_delete` means one commit and one
+update of the search index for each of them, which is very slow when a
+remote catalog drops thousands of datasets at once. The functions here flag
+their harvest objects as not current and delete the datasets in chunks,
+with one statement per chunk on the database and one request to the search
+index.
+'''
+import datetime
+import logging
+
+from ckantoolkit import config
+from ckan import model
+from ckan.plugins import toolkit
+from ckan.lib.search.common import make_connection, SearchIndexError
+
+from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
+
+from ckanext.dcat.cache import dataset_cache, catalog_cache
+from ckanext.dcat.harvesters.guids import unregister_packages
+
+
+log = logging.getLogger(__name__)
+
+DELETE_CHUNK_SIZE_CONFIG = 'ckanext.dcat.harvest.delete_chunk_size'
+
+DEFAULT_DELETE_CHUNK_SIZE = 500
+
+
+def delete_chunk_size():
+    '''
+    Returns the maximum number of datasets deleted (or guids flagged) at a
+    time
+    '''
+    return int(config.get(DELETE_CHUNK_SIZE_CONFIG, DEFAULT_DELETE_CHUNK_SIZE))
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in xrange(0, len(values), size):
+        yield values[start:start + size]
+
+
+def mark_not_current(guids):
+    '''
+    Flags the current harvest objects with the provided guids as not
+    current anymore, with one statement per chunk of guids
+    '''
+    for chunk in _chunks(guids, delete_chunk_size()):
+        model.Session.query(HarvestObject) \
+            .filter(HarvestObject.guid.in_(chunk)) \
+            .filter(HarvestObject.current == True) \
+            .update({'current': False}, synchronize_session=False)
+
+
+def pending_package_ids(harvest_job_id, limit):
+    '''
+    Returns the ids of the active datasets of the harvest objects of a job
+    flagged for deletion (up to `limit` of them)
+    '''
+    query = model.Session.query(HarvestObject.package_id) \
+        .join(HarvestObjectExtra,
+              HarvestObjectExtra.harvest_object_id == HarvestObject.id) \
+        .join(model.Package, model.Package.id == HarvestObject.package_id) \
+        .filter(HarvestObject.harvest_job_id == harvest_job_id) \
+        .filter(HarvestObjectExtra.key == 'status') \
+        .filter(HarvestObjectExtra.value == 'delete') \
+        .filter(model.Package.state == model.State.ACTIVE) \
+        .limit(limit)
+    return [row[0] for row in query]
+
+
+def delete_packages(package_ids):
+    '''
+    Deletes several datasets at once
+
+    The datasets and their memberships are flagged as deleted and their
+    guids unregistered with one statement each, and they are removed from
+    the search index with a single request before committing. If that
+    fails, the changes are rolled back and `SearchIndexError` is raised.
+
+    Unlike `package_delete`, no revisions or activities are created and the
+    `IPackageController` plugins are not called, so the cached serializations
+    of the datasets and the catalog are removed here instead.
+    '''
+    if not package_ids:
+        return
+
+    model.Session.query(model.Package) \
+        .filter(model.Package.id.in_(package_ids)) \
+        .update({'state': model.State.DELETED,
+                 'metadata_modified': datetime.datetime.utcnow()},
+                synchronize_session='fetch')
+    model.Session.query(model.Member) \
+        .filter(model.Member.table_name == 'package') \
+        .filter(model.Member.table_id.in_(package_ids)) \
+        .update({'state': model.State.DELETED}, synchronize_session=False)
+    unregister_packages(package_ids)
+
+    try:
+        _remove_from_index(package_ids)
+    except SearchIndexError:
+        model.Session.rollback()
+        raise
+
+    model.Session.commit()
+
+    cache = dataset_cache()
+    if cache.enabled:
+        for package_id in package_ids:
+            cache.invalidate(package_id)
+    catalog_cache().clear()
+
+
+def _remove_from_index(package_ids):
+    query = '+entity_type:package +site_id:"{0}" +id:({1})'.format(
+        config.get('ckan.site_id'),
+        ' OR '.join('"{0}"'.format(package_id) for package_id in package_ids))
+
+    conn = make_connection()
+    try:
+        commit = toolkit.asbool(config.get('ckan.search.solr_commit', 'true'))
+        conn.delete(q=query, commit=commit)
+    except Exception, e:
+        log.exception(e)
+        raise SearchIndexError(e)
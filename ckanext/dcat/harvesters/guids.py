@@ -0,0 +1,200 @@
+'''
+Registry of the guids of harvested datasets
+
+Finding a dataset by the value of its `guid` extra means scanning the
+`package_extra` table, as its `value` column is not indexed. The DCAT
+harvesters keep their own table instead, with the guid, harvest source and
+dataset id of each harvested dataset, indexed by guid and source.
+
+The table is created the first time it is needed. Rows are added or
+updated when datasets are imported and removed when they are deleted by
+the harvesters. Existing harvested datasets can be added with
+`backfill()` (or the `dcat_harvest_guids backfill` paster command), which
+records that it ran for all sources on the CKAN system info (see
+`is_backfilled()`).
+'''
+import datetime
+import logging
+
+from sqlalchemy import types, Table, Column, select, and_
+from sqlalchemy.exc import IntegrityError
+
+from ckan import model
+from ckan.model.meta import metadata
+
+from ckanext.harvest.model import HarvestObject
+
+
+log = logging.getLogger(__name__)
+
+# Number of rows inserted at a time by `backfill()`
+BACKFILL_CHUNK_SIZE = 1000
+
+# System info key set once the guids of all sources have been backfilled
+BACKFILL_SYSTEM_INFO_KEY = 'ckanext.dcat.harvest.guids_backfilled'
+
+
+guid_table = Table(
+    'dcat_harvest_guid', metadata,
+    Column('guid', types.UnicodeText, primary_key=True),
+    Column('harvest_source_id', types.UnicodeText, primary_key=True),
+    Column('package_id', types.UnicodeText, nullable=False, index=True),
+)
+
+
+_table_checked = False
+
+_backfilled = False
+
+
+def setup():
+    '''
+    Creates the guid table if it does not exist yet
+    '''
+    global _table_checked
+    if _table_checked:
+        return
+    if not guid_table.exists():
+        guid_table.create()
+        log.debug('DCAT harvest guid table created')
+    _table_checked = True
+
+
+def register_guid(guid, harvest_source_id, package_id):
+    '''
+    Records the dataset of a guid harvested from a source, replacing the
+    previous one (if any)
+
+    The row is updated if it exists. Otherwise it is inserted on a
+    savepoint, and updated if another process inserted it in the meantime.
+    '''
+    setup()
+    update = guid_table.update().where(and_(
+        guid_table.c.guid == guid,
+        guid_table.c.harvest_source_id == harvest_source_id)) \
+        .values(package_id=package_id)
+    if model.Session.execute(update).rowcount:
+        return
+
+    savepoint = model.Session.begin_nested()
+    try:
+        model.Session.execute(guid_table.insert().values(
+            guid=guid, harvest_source_id=harvest_source_id,
+            package_id=package_id))
+        savepoint.commit()
+    except IntegrityError:
+        savepoint.rollback()
+        model.Session.execute(update)
+
+
+def unregister_package(package_id):
+    '''
+    Removes the guids of a dataset (eg once it has been deleted)
+    '''
+    unregister_packages([package_id])
+
+
+def unregister_packages(package_ids):
+    '''
+    Removes the guids of several datasets in one statement
+    '''
+    if not package_ids:
+        return
+    setup()
+    model.Session.execute(guid_table.delete().where(
+        guid_table.c.package_id.in_(package_ids)))
+
+
+def guid_package_ids(guid):
+    '''
+    Returns the ids of the active datasets with the provided guid, from
+    any source
+    '''
+    setup()
+    query = select([guid_table.c.package_id]) \
+        .select_from(guid_table.join(
+            model.package_table,
+            model.package_table.c.id == guid_table.c.package_id)) \
+        .where(and_(guid_table.c.guid == guid,
+                    model.package_table.c.state == 'active'))
+    return [row[0] for row in model.Session.execute(query)]
+
+
+def registered_guids(harvest_source_id):
+    '''
+    Returns a dict with the guids registered for a harvest source and the
+    ids of their datasets
+    '''
+    setup()
+    query = select([guid_table.c.guid, guid_table.c.package_id]).where(
+        guid_table.c.harvest_source_id == harvest_source_id)
+    return dict((guid, package_id)
+                for guid, package_id in model.Session.execute(query))
+
+
+def backfill(harvest_source_id=None):
+    '''
+    Registers the guids of the datasets already harvested, from their
+    `guid` extra
+
+    Only the active datasets linked to a current harvest object are
+    registered, for all sources or only for the provided one. The
+    registered guids of these sources are replaced. If it was run for all
+    sources, this is recorded (see `is_backfilled()`).
+
+    Returns the number of guids registered.
+    '''
+    setup()
+
+    query = model.Session.query(HarvestObject.harvest_source_id,
+                                model.PackageExtra.value,
+                                model.Package.id) \
+        .select_from(HarvestObject) \
+        .join(model.Package, model.Package.id == HarvestObject.package_id) \
+        .join(model.PackageExtra,
+              model.PackageExtra.package_id == model.Package.id) \
+        .filter(HarvestObject.current == True) \
+        .filter(model.PackageExtra.key == 'guid') \
+        .filter(model.Package.state == 'active')
+
+    delete = guid_table.delete()
+    if harvest_source_id:
+        query = query.filter(
+            HarvestObject.harvest_source_id == harvest_source_id)
+        delete = delete.where(
+            guid_table.c.harvest_source_id == harvest_source_id)
+
+    rows = {}
+    for source_id, guid, package_id in query:
+        if (guid, source_id) in rows:
+            log.warning('Found more than one dataset with the same guid: '
+                        '{0}'.format(guid))
+        rows[(guid, source_id)] = package_id
+
+    model.Session.execute(delete)
+
+    rows = [{'guid': guid, 'harvest_source_id': source_id,
+             'package_id': package_id}
+            for (guid, source_id), package_id in rows.iteritems()]
+    for start in xrange(0, len(rows), BACKFILL_CHUNK_SIZE):
+        model.Session.execute(guid_table.insert(),
+                              rows[start:start + BACKFILL_CHUNK_SIZE])
+
+    model.Session.commit()
+
+    if not harvest_source_id:
+        model.set_system_info(BACKFILL_SYSTEM_INFO_KEY,
+                              datetime.datetime.utcnow().isoformat())
+
+    return len(rows)
+
+
+def is_backfilled():
+    '''
+    Returns True if `backfill()` has been run for all sources, so all
+    harvested datasets are on the registry
+    '''
+    global _backfilled
+    if not _backfilled:
+        _backfilled = bool(model.get_system_info(BACKFILL_SYSTEM_INFO_KEY))
+    return _backfilled
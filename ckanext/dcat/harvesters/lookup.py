@@ -0,0 +1,213 @@
+'''
+Lookup of the datasets already harvested by a source
+
+The import stage needs the id, name and resources of the existing dataset
+for every harvest object. Instead of querying them (and calling
+`package_show`) for each object, `ExistingDatasets` loads them for the
+whole source with a few queries the first time it is used.
+'''
+import json
+import hashlib
+import logging
+from collections import namedtuple
+
+from sqlalchemy import and_
+
+from ckan import model
+
+from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
+
+from ckanext.dcat.harvesters.guids import registered_guids
+
+
+log = logging.getLogger(__name__)
+
+# Keys of the harvested dataset dicts left out of their fingerprints, as
+# they are generated on each gather stage
+FINGERPRINT_IGNORED_KEYS = ('name',)
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return dict((key, _canonical(item)) for key, item in value.iteritems())
+    elif isinstance(value, list):
+        items = [_canonical(item) for item in value]
+        if all(isinstance(item, dict) for item in items):
+            items.sort(key=lambda item: json.dumps(item, sort_keys=True))
+        return items
+    return value
+
+
+def dataset_fingerprint(dataset_dict):
+    '''
+    Returns a fingerprint (a SHA1 hex digest) of a harvested dataset dict
+
+    Keys are sorted, and so are lists of dicts like resources, tags or
+    extras, so the fingerprint does not depend on the order in which the
+    parser found them.
+    '''
+    dataset_dict = dict((key, value) for key, value in dataset_dict.iteritems()
+                        if key not in FINGERPRINT_IGNORED_KEYS)
+    as_string = json.dumps(_canonical(dataset_dict), sort_keys=True,
+                           separators=(',', ':'))
+    return hashlib.sha1(as_string).hexdigest()
+
+
+class ExistingDataset(namedtuple('ExistingDataset',
+                                 ('id', 'name', 'resources',
+                                  'previous_object_id', 'fingerprint'))):
+    '''
+    Details of a dataset already harvested
+
+    `resources` maps the URIs of the dataset resources to their ids,
+    `previous_object_id` is the id of the current harvest object for the
+    dataset guid and `fingerprint` the fingerprint of the dataset dict
+    imported from it (both None if unknown, eg for datasets not harvested
+    by the source).
+    '''
+    __slots__ = ()
+
+
+class ExistingDatasets(object):
+    '''
+    Datasets harvested by a source, by guid
+
+    The datasets are loaded the first time `get` is called, with one query
+    for the current harvest objects of the source (and their fingerprints,
+    see `dataset_fingerprint`), one for their active datasets and one for
+    the resources of these. Only what the import stage needs is kept.
+
+    Datasets not linked to the current harvest objects of the source (eg
+    harvested by another source with the same guid) are not found, so
+    callers should fall back to looking for them one by one.
+
+    The guids of the source on the guid registry (see
+    `ckanext.dcat.harvesters.guids`) are loaded too, so they are only
+    registered again if their dataset changes.
+    '''
+
+    def __init__(self, source_id):
+        self.source_id = source_id
+        self._datasets = None
+        self._previous_objects = None
+        self._registered = None
+
+    def _current_objects(self, *columns):
+        return model.Session.query(*columns) \
+            .select_from(HarvestObject) \
+            .filter(HarvestObject.current == True) \
+            .filter(HarvestObject.harvest_source_id == self.source_id)
+
+    def _load(self):
+        previous_objects = {}
+        query = self._current_objects(HarvestObject.guid,
+                                      HarvestObject.id,
+                                      HarvestObjectExtra.value) \
+            .outerjoin(HarvestObjectExtra, and_(
+                HarvestObjectExtra.harvest_object_id == HarvestObject.id,
+                HarvestObjectExtra.key == 'fingerprint'))
+        for guid, object_id, fingerprint in query:
+            previous_objects[guid] = (object_id, fingerprint)
+
+        packages = {}
+        ambiguous = set()
+        query = self._current_objects(model.PackageExtra.value,
+                                      model.Package.id,
+                                      model.Package.name) \
+            .join(model.Package,
+                  model.Package.id == HarvestObject.package_id) \
+            .join(model.PackageExtra,
+                  model.PackageExtra.package_id == model.Package.id) \
+            .filter(model.PackageExtra.key == 'guid') \
+            .filter(model.Package.state == 'active')
+        for guid, package_id, name in query:
+            if packages.get(guid, (package_id,))[0] != package_id:
+                ambiguous.add(guid)
+            packages[guid] = (package_id, name)
+
+        resources = {}
+        query = self._current_objects(model.Resource.package_id,
+                                      model.Resource.id,
+                                      model.Resource.extras) \
+            .join(model.Resource,
+                  model.Resource.package_id == HarvestObject.package_id) \
+            .filter(model.Resource.state == 'active')
+        for package_id, resource_id, extras in query:
+            uri = (extras or {}).get('uri')
+            if uri:
+                resources.setdefault(package_id, {})[uri] = resource_id
+
+        datasets = {}
+        for guid, (package_id, name) in packages.iteritems():
+            # Leave them for the single lookups, which report duplicates
+            if guid in ambiguous:
+                continue
+            previous_object_id, fingerprint = previous_objects.get(
+                guid, (None, None))
+            datasets[guid] = ExistingDataset(
+                package_id, name, resources.get(package_id, {}),
+                previous_object_id, fingerprint)
+
+        log.debug('Loaded {0} existing datasets for harvest source {1}'
+                  .format(len(datasets), self.source_id))
+
+        self._datasets = datasets
+        self._previous_objects = previous_objects
+        self._registered = registered_guids(self.source_id)
+
+    def get(self, guid):
+        '''
+        Returns the `ExistingDataset` with the provided guid, or None if it
+        was not found
+        '''
+        if self._datasets is None:
+            self._load()
+        return self._datasets.get(guid)
+
+    def previous_object_id(self, guid):
+        '''
+        Returns the id of the current harvest object of the source with the
+        provided guid (even if its dataset was not found), or None if there
+        is none
+        '''
+        if self._datasets is None:
+            self._load()
+        return self._previous_objects.get(guid, (None, None))[0]
+
+    def set_current_object(self, guid, object_id):
+        '''
+        Records that the harvest object with the provided id is now the
+        current one for the guid
+        '''
+        if self._previous_objects is not None:
+            self._previous_objects[guid] = (object_id, None)
+
+    def discard(self, guid):
+        '''
+        Removes a dataset from the lookup (eg once it has been updated, as
+        its resources may have changed)
+        '''
+        if self._datasets is not None:
+            self._datasets.pop(guid, None)
+
+    def is_registered(self, guid, package_id):
+        '''
+        Returns True if the guid is already registered for the source with
+        the provided dataset id
+        '''
+        if self._datasets is None:
+            self._load()
+        return self._registered.get(guid) == package_id
+
+    def set_registered(self, guid, package_id):
+        '''
+        Records that the guid has been registered for the source with the
+        provided dataset id
+        '''
+        if self._registered is not None:
+            self._registered[guid] = package_id
+
+    def __len__(self):
+        if self._datasets is None:
+            self._load()
+        return len(self._datasets)
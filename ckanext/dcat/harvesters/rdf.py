@@ -1,18 +1,26 @@
 import json
 import uuid
+import Queue
 import logging
 import hashlib
 import traceback
+import collections
+import multiprocessing
 
 import ckan.plugins as p
 import ckan.model as model
 import ckan.logic as logic
 
 import ckan.lib.plugins as lib_plugins
+from ckantoolkit import config
 
-from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
+from ckanext.harvest.model import HarvestObject
 
 from ckanext.dcat.harvesters.base import DCATHarvester
+from ckanext.dcat.harvesters.lookup import (ExistingDataset, ExistingDatasets,
+                                            dataset_fingerprint)
+from ckanext.dcat.harvesters.guids import (guid_package_ids, register_guid,
+                                           is_backfilled)
 
 from ckanext.dcat.processors import RDFParserException, RDFParser
 
@@ -21,9 +29,75 @@ from ckanext.dcat.interfaces import IDCATRDFHarvester
 
 log = logging.getLogger(__name__)
 
+DEFAULT_GATHER_QUEUE_DEPTH = 2
+
+GUID_FALLBACK_CONFIG = 'ckanext.dcat.harvest.guid_fallback'
+
+
+def _parse_page(content, rdf_format, next_pages, streaming=False):
+    '''
+    Parses a page of the remote catalog and extracts its datasets
+
+    This can run on a worker process, so it must not access the database.
+    The URL of the next page (or None) is put on the `next_pages` queue as
+    soon as the graph has been parsed, before extracting the datasets.
+
+    If `streaming` is True, the page is parsed in the parser streaming mode
+    when its format allows it (see `RDFParser.parse`).
+
+    Returns a tuple with the list of dataset dicts (sorted by URI) and an
+    error message (one of them will be None)
+    '''
+    next_page_sent = False
+    try:
+        # TODO: profiles conf
+        parser = RDFParser()
+
+        try:
+            parser.parse(content, _format=rdf_format, streaming=streaming)
+        except RDFParserException, e:
+            return None, 'Error parsing the RDF file: {0}'.format(e)
+
+        next_pages.put(parser.next_page())
+        next_page_sent = True
+
+        try:
+            # Graph iteration order is arbitrary, sort the datasets by URI so
+            # harvest objects are always created in the same order
+            return sorted(parser.datasets(), key=_dataset_uri), None
+        except Exception, e:
+            return None, 'Error when processsing dataset: %r / %s' % (
+                e, traceback.format_exc())
+    finally:
+        if not next_page_sent:
+            next_pages.put(None)
+
+
+def _dataset_uri(dataset_dict):
+    for extra in dataset_dict.get('extras', []):
+        if extra['key'] == 'uri':
+            return extra['value']
+    return ''
+
+
+class _SyncResult(object):
+    '''
+    Same interface as multiprocessing's AsyncResult, for pages parsed on
+    the current process
+    '''
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
 
 class DCATRDFHarvester(DCATHarvester):
 
+    _existing_datasets = None
+    _existing_datasets_job_id = None
+
     def info(self):
         return {
             'name': 'dcat_rdf',
@@ -68,24 +142,99 @@ class DCATRDFHarvester(DCATHarvester):
 
     def _get_existing_dataset(self, guid):
         '''
-        Checks if a dataset with a certain guid extra already exists
+        Checks if a dataset with a certain guid already exists
+
+        Datasets are looked up on the guid registry (see
+        `ckanext.dcat.harvesters.guids`). If not found there, the guid
+        extras of all datasets are checked too, until the registry has been
+        backfilled for all sources, or as set by the
+        `ckanext.dcat.harvest.guid_fallback` config option.
 
         Returns a dict as the ones returned by package_show
         '''
 
-        datasets = model.Session.query(model.Package.id) \
-                                .join(model.PackageExtra) \
-                                .filter(model.PackageExtra.key=='guid') \
-                                .filter(model.PackageExtra.value==guid) \
-                                .filter(model.Package.state=='active') \
-                                .all()
+        datasets = guid_package_ids(guid)
+
+        fallback = config.get(GUID_FALLBACK_CONFIG)
+        if fallback is None:
+            fallback = not is_backfilled()
+
+        if not datasets and p.toolkit.asbool(fallback):
+            datasets = [row[0] for row in
+                        model.Session.query(model.Package.id)
+                                     .join(model.PackageExtra)
+                                     .filter(model.PackageExtra.key=='guid')
+                                     .filter(model.PackageExtra.value==guid)
+                                     .filter(model.Package.state=='active')
+                                     .all()]
 
         if not datasets:
             return None
         elif len(datasets) > 1:
             log.error('Found more than one dataset with the same guid: {0}'.format(guid))
 
-        return p.toolkit.get_action('package_show')({}, {'id': datasets[0][0]})
+        return p.toolkit.get_action('package_show')({}, {'id': datasets[0]})
+
+    def _register_guid(self, harvest_object, package_id):
+        '''
+        Adds the guid of a harvest object and its dataset to the guid
+        registry, unless already there
+        '''
+        existing_datasets = self._get_existing_datasets(harvest_object)
+        if not existing_datasets.is_registered(harvest_object.guid,
+                                               package_id):
+            register_guid(harvest_object.guid,
+                          harvest_object.harvest_source_id, package_id)
+            existing_datasets.set_registered(harvest_object.guid, package_id)
+
+    def _get_existing_datasets(self, harvest_object):
+        '''
+        Returns the `ExistingDatasets` lookup of the source of a harvest
+        object
+
+        The lookup is created for the first object imported of each job, so
+        the datasets of the source are only loaded once per job.
+        '''
+        job_id = harvest_object.harvest_job_id
+        if (self._existing_datasets is None or
+                self._existing_datasets_job_id != job_id):
+            self._existing_datasets = ExistingDatasets(
+                harvest_object.harvest_source_id)
+            self._existing_datasets_job_id = job_id
+        return self._existing_datasets
+
+    def _find_existing_dataset(self, harvest_object):
+        '''
+        Returns an `ExistingDataset` for the dataset with the same guid as
+        the harvest object, or None if there is none
+
+        Datasets are looked up on the job lookup (see
+        `_get_existing_datasets`), and only if not found there with
+        `_get_existing_dataset`.
+        '''
+        existing = self._get_existing_datasets(harvest_object).get(
+            harvest_object.guid)
+        if existing:
+            return existing
+
+        dataset = self._get_existing_dataset(harvest_object.guid)
+        if not dataset:
+            return None
+        return ExistingDataset(
+            dataset['id'], dataset['name'],
+            dict((r.get('uri'), r.get('id'))
+                 for r in dataset.get('resources', []) if r.get('uri')),
+            None, None)
+
+    def _force_update(self, harvest_object):
+        '''
+        Returns True if the source of a harvest object is configured to
+        update its datasets even if they have not changed
+        '''
+        source_config = harvest_object.source.config
+        if not source_config:
+            return False
+        return json.loads(source_config).get('force_update', False)
 
     def _mark_datasets_for_deletion(self, guids_in_source, harvest_job):
         '''
@@ -101,8 +250,6 @@ class DCATRDFHarvester(DCATHarvester):
         Returns a list with the ids of the Harvest Objects to delete.
         '''
 
-        object_ids = []
-
         # Get all previous current guids and dataset ids for this source
         query = model.Session.query(HarvestObject.guid, HarvestObject.package_id) \
                              .filter(HarvestObject.current==True) \
@@ -117,21 +264,10 @@ class DCATRDFHarvester(DCATHarvester):
         # Get objects/datasets to delete (ie in the DB but not in the source)
         guids_to_delete = set(guids_in_db) - set(guids_in_source)
 
-        # Create a harvest object for each of them, flagged for deletion
-        for guid in guids_to_delete:
-            obj = HarvestObject(guid=guid, job=harvest_job,
-                                package_id=guid_to_package_id[guid],
-                                extras=[HarvestObjectExtra(key='status',
-                                                           value='delete')])
-
-            # Mark the rest of objects for this guid as not current
-            model.Session.query(HarvestObject) \
-                         .filter_by(guid=guid) \
-                         .update({'current': False}, False)
-            obj.save()
-            object_ids.append(obj.id)
-
-        return object_ids
+        # Create a harvest object for each of them, flagged for deletion, and
+        # mark the rest of objects for these guids as not current
+        return self._create_deletion_objects(harvest_job, guids_to_delete,
+                                             guid_to_package_id)
 
     def validate_config(self, source_config):
         if not source_config:
@@ -146,15 +282,63 @@ class DCATRDFHarvester(DCATHarvester):
             if rdf_format not in supported_formats:
                 raise ValueError('rdf_format should be one of: ' + ", ".join(supported_formats))
 
+        if 'gather_workers' in source_config_obj:
+            gather_workers = source_config_obj['gather_workers']
+            if not isinstance(gather_workers, int) or gather_workers < 0:
+                raise ValueError('gather_workers must be 0 or a positive integer')
+        if 'gather_queue_depth' in source_config_obj:
+            gather_queue_depth = source_config_obj['gather_queue_depth']
+            if not isinstance(gather_queue_depth, int) or gather_queue_depth < 1:
+                raise ValueError('gather_queue_depth must be a positive integer')
+
+        if 'streaming_parser' in source_config_obj:
+            if not isinstance(source_config_obj['streaming_parser'], bool):
+                raise ValueError('streaming_parser must be true or false')
+
+        if 'gather_batch_size' in source_config_obj:
+            gather_batch_size = source_config_obj['gather_batch_size']
+            if not isinstance(gather_batch_size, int) or gather_batch_size < 1:
+                raise ValueError('gather_batch_size must be a positive integer')
+
+        if 'force_update' in source_config_obj:
+            if not isinstance(source_config_obj['force_update'], bool):
+                raise ValueError('force_update must be true or false')
+
+        self._validate_session_config(source_config_obj)
+
         return source_config
 
     def gather_stage(self, harvest_job):
 
         log.debug('In DCATRDFHarvester gather_stage')
 
-        rdf_format = None
+        source_config = {}
         if harvest_job.source.config:
-            rdf_format = json.loads(harvest_job.source.config).get("rdf_format")
+            source_config = json.loads(harvest_job.source.config)
+
+        rdf_format = source_config.get('rdf_format')
+        streaming = p.toolkit.asbool(
+            source_config.get('streaming_parser', False))
+
+        # Pages are parsed in a pool of worker processes if configured, while
+        # the next pages are downloaded and the harvest objects of previous
+        # ones created. Otherwise everything is done in this process.
+        workers = int(source_config.get('gather_workers', 0))
+        if workers > 0:
+            queue_depth = int(source_config.get('gather_queue_depth',
+                                                DEFAULT_GATHER_QUEUE_DEPTH))
+            # The worker processes are forked from this one and would
+            # inherit its database connections, so release them first
+            # (they are opened again the next time they are needed)
+            model.Session.commit()
+            model.meta.engine.dispose()
+            manager = multiprocessing.Manager()
+            pool = multiprocessing.Pool(workers)
+            next_pages = manager.Queue()
+        else:
+            queue_depth = 1
+            manager = pool = None
+            next_pages = Queue.Queue()
 
         # Get file contents of first page
         next_page_url = harvest_job.source.url
@@ -163,83 +347,107 @@ class DCATRDFHarvester(DCATHarvester):
         object_ids = []
         last_content_hash = None
 
-        while next_page_url:
-            for harvester in p.PluginImplementations(IDCATRDFHarvester):
-                next_page_url, before_download_errors = harvester.before_download(next_page_url, harvest_job)
-
-                for error_msg in before_download_errors:
-                    self._save_gather_error(error_msg, harvest_job)
-
-                if not next_page_url:
-                    return []
-
-            content, rdf_format = self._get_content_and_type(next_page_url, harvest_job, 1, content_type=rdf_format)
-
-            content_hash = hashlib.md5()
-            if content:
-                content_hash.update(content)
+        # Pages sent to the parser that haven't been processed yet, in order
+        pending = collections.deque()
 
-            if last_content_hash:
-                if content_hash.digest() == last_content_hash.digest():
-                    log.warning('Remote content was the same even when using a paginated URL, skipping')
-                    break
-            else:
-                last_content_hash = content_hash
-
-            # TODO: store content?
-            for harvester in p.PluginImplementations(IDCATRDFHarvester):
-                content, after_download_errors = harvester.after_download(content, harvest_job)
+        try:
+            while next_page_url or pending:
 
-                for error_msg in after_download_errors:
-                    self._save_gather_error(error_msg, harvest_job)
+                if next_page_url and len(pending) < queue_depth:
 
-            if not content:
-                return []
+                    for harvester in p.PluginImplementations(IDCATRDFHarvester):
+                        next_page_url, before_download_errors = harvester.before_download(next_page_url, harvest_job)
 
-            # TODO: profiles conf
-            parser = RDFParser()
+                        for error_msg in before_download_errors:
+                            self._save_gather_error(error_msg, harvest_job)
 
-            try:
-                parser.parse(content, _format=rdf_format)
-            except RDFParserException, e:
-                self._save_gather_error('Error parsing the RDF file: {0}'.format(e), harvest_job)
-                return []
+                        if not next_page_url:
+                            return []
 
-            try:
-                for dataset in parser.datasets():
-                    if not dataset.get('name'):
-                        dataset['name'] = self._gen_new_name(dataset['title'])
+                    content, rdf_format = self._get_content_and_type(next_page_url, harvest_job, 1, content_type=rdf_format)
 
-                    # Unless already set by the parser, get the owner organization (if any)
-                    # from the harvest source dataset
-                    if not dataset.get('owner_org'):
-                        source_dataset = model.Package.get(harvest_job.source.id)
-                        if source_dataset.owner_org:
-                            dataset['owner_org'] = source_dataset.owner_org
+                    content_hash = hashlib.md5()
+                    if content:
+                        content_hash.update(content)
 
-                    # Try to get a unique identifier for the harvested dataset
-                    guid = self._get_guid(dataset)
+                    if last_content_hash:
+                        if content_hash.digest() == last_content_hash.digest():
+                            log.warning('Remote content was the same even when using a paginated URL, skipping')
+                            next_page_url = None
+                            continue
+                    else:
+                        last_content_hash = content_hash
 
-                    if not guid:
-                        self._save_gather_error('Could not get a unique identifier for dataset: {0}'.format(dataset),
-                                                harvest_job)
-                        continue
+                    # TODO: store content?
+                    for harvester in p.PluginImplementations(IDCATRDFHarvester):
+                        content, after_download_errors = harvester.after_download(content, harvest_job)
 
-                    dataset['extras'].append({'key': 'guid', 'value': guid})
-                    guids_in_source.append(guid)
+                        for error_msg in after_download_errors:
+                            self._save_gather_error(error_msg, harvest_job)
 
-                    obj = HarvestObject(guid=guid, job=harvest_job,
-                                        content=json.dumps(dataset))
+                    if not content:
+                        return []
 
-                    obj.save()
-                    object_ids.append(obj.id)
-            except Exception, e:
-                self._save_gather_error('Error when processsing dataset: %r / %s' % (e, traceback.format_exc()),
-                                        harvest_job)
-                return []
+                    if pool:
+                        pending.append(pool.apply_async(
+                            _parse_page,
+                            (content, rdf_format, next_pages, streaming)))
+                    else:
+                        pending.append(_SyncResult(
+                            _parse_page(content, rdf_format, next_pages,
+                                        streaming)))
+
+                    # Only wait for the graph to be parsed, so the next page
+                    # can be downloaded while the datasets are extracted
+                    next_page_url = next_pages.get()
+                    continue
+
+                # Process the oldest page
+                datasets, error = pending.popleft().get()
+                if error:
+                    self._save_gather_error(error, harvest_job)
+                    return []
 
-            # get the next page
-            next_page_url = parser.next_page()
+                try:
+                    page_objects = []
+                    for dataset in datasets:
+                        if not dataset.get('name'):
+                            dataset['name'] = self._gen_new_name(dataset['title'])
+
+                        # Unless already set by the parser, get the owner organization (if any)
+                        # from the harvest source dataset
+                        if not dataset.get('owner_org'):
+                            owner_org = self._get_source_owner_org(harvest_job)
+                            if owner_org:
+                                dataset['owner_org'] = owner_org
+
+                        # Try to get a unique identifier for the harvested dataset
+                        guid = self._get_guid(dataset)
+
+                        if not guid:
+                            self._save_gather_error('Could not get a unique identifier for dataset: {0}'.format(dataset),
+                                                    harvest_job)
+                            continue
+
+                        dataset['extras'].append({'key': 'guid', 'value': guid})
+                        guids_in_source.append(guid)
+
+                        page_objects.append(
+                            HarvestObject(guid=guid, job=harvest_job,
+                                          content=json.dumps(dataset)))
+
+                    # All objects of the page are saved in one transaction
+                    object_ids.extend(
+                        self._save_harvest_objects(page_objects, harvest_job))
+                except Exception, e:
+                    self._save_gather_error('Error when processsing dataset: %r / %s' % (e, traceback.format_exc()),
+                                            harvest_job)
+                    return []
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+                manager.shutdown()
 
         # Check if some datasets need to be deleted
         object_ids_to_delete = self._mark_datasets_for_deletion(guids_in_source, harvest_job)
@@ -262,9 +470,7 @@ class DCATRDFHarvester(DCATHarvester):
             context = {'model': model, 'session': model.Session,
                        'user': self._get_user_name(), 'ignore_auth': True}
 
-            p.toolkit.get_action('package_delete')(context, {'id': harvest_object.package_id})
-            log.info('Deleted package {0} with guid {1}'.format(harvest_object.package_id,
-                                                                harvest_object.guid))
+            self._delete_package(harvest_object, context)
             return True
 
         if harvest_object.content is None:
@@ -279,20 +485,26 @@ class DCATRDFHarvester(DCATHarvester):
                                     harvest_object, 'Import')
             return False
 
-        # Get the last harvested object (if any)
-        previous_object = model.Session.query(HarvestObject) \
-                                       .filter(HarvestObject.guid==harvest_object.guid) \
-                                       .filter(HarvestObject.current==True) \
-                                       .first()
+        fingerprint = dataset_fingerprint(dataset)
+
+        # Check if a dataset with the same guid exists (before flagging the
+        # previous object, so it can be found on the job lookup)
+        existing_dataset = self._find_existing_dataset(harvest_object)
 
-        # Flag previous object as not current anymore
-        if previous_object:
-            previous_object.current = False
-            previous_object.add()
+        # Flag the last harvested object (if any) as not current anymore
+        existing_datasets = self._get_existing_datasets(harvest_object)
+        previous_object_id = existing_datasets.previous_object_id(
+            harvest_object.guid)
+        if previous_object_id and previous_object_id != harvest_object.id:
+            model.Session.query(HarvestObject) \
+                         .filter(HarvestObject.id==previous_object_id) \
+                         .update({'current': False}, False)
 
         # Flag this object as the current one
         harvest_object.current = True
         harvest_object.add()
+        existing_datasets.set_current_object(harvest_object.guid,
+                                             harvest_object.id)
 
         context = {
             'user': self._get_user_name(),
@@ -302,20 +514,35 @@ class DCATRDFHarvester(DCATHarvester):
 
         dataset = self.modify_package_dict(dataset, {}, harvest_object)
 
-        # Check if a dataset with the same guid exists
-        existing_dataset = self._get_existing_dataset(harvest_object.guid)
-
         try:
-            if existing_dataset:
+            # The fingerprint is only compared with the one of a previous
+            # object (objects imported again, eg with `paster harvester
+            # import`, are the current ones)
+            if (existing_dataset and
+                    existing_dataset.previous_object_id != harvest_object.id and
+                    existing_dataset.fingerprint == fingerprint and
+                    not self._force_update(harvest_object)):
+                # Same content as last time, leave the dataset as it is
+                harvest_object.package_id = existing_dataset.id
+                self._set_object_extra(harvest_object, 'fingerprint',
+                                       fingerprint)
+                harvest_object.add()
+                # Its guid may not be registered yet (eg if harvested before
+                # the registry existed)
+                self._register_guid(harvest_object, existing_dataset.id)
+
+                log.info('Dataset %s has not changed' % existing_dataset.name)
+                return 'unchanged'
+
+            elif existing_dataset:
                 # Don't change the dataset name even if the title has
-                dataset['name'] = existing_dataset['name']
-                dataset['id'] = existing_dataset['id']
+                dataset['name'] = existing_dataset.name
+                dataset['id'] = existing_dataset.id
 
                 harvester_tmp_dict = {}
 
                 # check if resources already exist based on their URI
-                existing_resources =  existing_dataset.get('resources')
-                resource_mapping = {r.get('uri'): r.get('id') for r in existing_resources if r.get('uri')}
+                resource_mapping = existing_dataset.resources
                 for resource in dataset.get('resources'):
                     res_uri = resource.get('uri')
                     if res_uri and res_uri in resource_mapping:
@@ -331,8 +558,13 @@ class DCATRDFHarvester(DCATHarvester):
                         harvest_object.add()
 
                         p.toolkit.get_action('package_update')(context, dataset)
+                        self._register_guid(harvest_object, dataset['id'])
+
+                        # Its resources may have changed
+                        self._get_existing_datasets(harvest_object).discard(
+                            harvest_object.guid)
                     else:
-                        log.info('Ignoring dataset %s' % existing_dataset['name'])
+                        log.info('Ignoring dataset %s' % existing_dataset.name)
                         return 'unchanged'
                 except p.toolkit.ValidationError, e:
                     self._save_object_error('Update validation Error: %s' % str(e.error_summary), harvest_object, 'Import')
@@ -345,6 +577,9 @@ class DCATRDFHarvester(DCATHarvester):
                         self._save_object_error('RDFHarvester plugin error: %s' % err, harvest_object, 'Import')
                         return False
 
+                self._set_object_extra(harvest_object, 'fingerprint',
+                                       fingerprint)
+
                 log.info('Updated dataset %s' % dataset['name'])
 
             else:
@@ -376,6 +611,7 @@ class DCATRDFHarvester(DCATHarvester):
                         model.Session.flush()
 
                         p.toolkit.get_action('package_create')(context, dataset)
+                        self._register_guid(harvest_object, dataset['id'])
                     else:
                         log.info('Ignoring dataset %s' % name)
                         return 'unchanged'
@@ -390,6 +626,9 @@ class DCATRDFHarvester(DCATHarvester):
                         self._save_object_error('RDFHarvester plugin error: %s' % err, harvest_object, 'Import')
                         return False
 
+                self._set_object_extra(harvest_object, 'fingerprint',
+                                       fingerprint)
+
                 log.info('Created dataset %s' % dataset['name'])
 
         except Exception, e:
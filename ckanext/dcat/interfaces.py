@@ -166,3 +166,29 @@ class IDCATRDFHarvester(Interface):
         :rtype: string
         '''
         return None
+
+
+class IDCATURIFactory(Interface):
+
+    def get_uri_factory(self, base_uri):
+        '''
+        Called once on startup to get the object used to mint the URIs of
+        the catalog, datasets, resources and publishers that do not define
+        their own
+
+        The first plugin that returns a factory is used. If none does, the
+        default ``ckanext.dcat.utils.URIFactory`` is used.
+
+        This extension point can be useful for sites with a custom URI
+        scheme, eg using the dataset name instead of its id.
+
+        :param base_uri: The catalog URI defined in the config (see
+                         ``ckanext.dcat.utils.catalog_uri``)
+        :type base_uri: string
+
+        :returns: An object with the same methods as
+                  ``ckanext.dcat.utils.URIFactory`` (usually an instance of
+                  a subclass of it), or None to use the default one
+        :rtype: object
+        '''
+        return None
@@ -1,18 +1,24 @@
 from __future__ import division
 import math
+import hashlib
+import itertools
 
 from pylons import config
 from dateutil.parser import parse as dateutil_parse
 
+from ckan import model
 from ckan.plugins import toolkit
 
 import ckanext.dcat.converters as converters
 
+from ckanext.dcat.cache import dataset_cache
 from ckanext.dcat.processors import RDFSerializer
+from ckanext.dcat.settings import dcat_settings
+# Used to be defined here, kept for backwards compatibility
+from ckanext.dcat.settings import DATASETS_PER_PAGE  # noqa
+from ckanext.dcat.utils import url_to_rdflib_format, last_catalog_modification
 
 
-DATASETS_PER_PAGE = 100
-
 wrong_page_exception = toolkit.ValidationError(
     'Page param must be a positive integer starting in 1')
 
@@ -21,16 +27,170 @@ def dcat_dataset_show(context, data_dict):
 
     toolkit.check_access('dcat_dataset_show', context, data_dict)
 
-    dataset_dict = toolkit.get_action('package_show')(context, data_dict)
-
     serializer = RDFSerializer(profiles=data_dict.get('profiles'))
 
+    cache = dataset_cache()
+    if cache.enabled:
+        # Check if there is a serialization for the current version of the
+        # dataset, without going through package_show
+        dataset = _get_dataset_object(context, data_dict)
+        output = cache.get(_dataset_cache_key(dataset.id,
+                                              dataset.metadata_modified,
+                                              serializer, data_dict))
+        if output is not None:
+            return output
+
+    dataset_dict = toolkit.get_action('package_show')(context, data_dict)
+
     output = serializer.serialize_dataset(dataset_dict,
                                           _format=data_dict.get('format'))
 
+    if cache.enabled:
+        cache.set(_dataset_cache_key(dataset_dict['id'],
+                                     dataset_dict['metadata_modified'],
+                                     serializer, data_dict),
+                  output, group=dataset_dict['id'])
+
     return output
 
 
+def _get_dataset_object(context, data_dict):
+    '''
+    Returns the dataset domain object, after checking that the user is
+    allowed to see it
+
+    Raises ObjectNotFound if the dataset does not exist
+    '''
+    _model = context.get('model', model)
+    dataset = _model.Package.get(data_dict.get('id'))
+    if not dataset:
+        raise toolkit.ObjectNotFound
+
+    toolkit.check_access('package_show', context, {'id': dataset.id})
+
+    return dataset
+
+
+def _dataset_cache_key(dataset_id, metadata_modified, serializer, data_dict):
+    '''
+    Returns the key used to store a dataset serialization in the cache
+
+    `metadata_modified` can be a datetime object or an ISO string, as in the
+    output of package_show.
+    '''
+    if not isinstance(metadata_modified, basestring):
+        metadata_modified = metadata_modified.isoformat()
+
+    return (
+        dataset_id,
+        metadata_modified,
+        tuple(profile.name for profile in serializer._profiles),
+        url_to_rdflib_format(data_dict.get('format') or 'xml'),
+        serializer.compatibility_mode,
+    )
+
+
+def dataset_modification_info(context, data_dict):
+    '''
+    Returns the ETag and last modification date of a dataset serialization
+
+    Both are computed from the dataset `metadata_modified` value (plus the
+    requested format and profiles) without rendering the dataset, so
+    conditional requests can be answered before any serialization happens.
+
+    Raises ObjectNotFound if the dataset does not exist.
+
+    Returns a tuple with the ETag value (quoted) and a datetime object
+    '''
+    toolkit.check_access('dcat_dataset_show', context, data_dict)
+
+    dataset = _get_dataset_object(context, data_dict)
+
+    serializer = RDFSerializer(profiles=data_dict.get('profiles'))
+
+    key = _dataset_cache_key(dataset.id, dataset.metadata_modified,
+                             serializer, data_dict)
+
+    return _etag(key), dataset.metadata_modified
+
+
+def catalog_modification_info(context, data_dict):
+    '''
+    Returns the ETag and last modification date of a catalog page
+
+    The ETag is computed from the request parameters, the id and
+    `metadata_modified` value of the datasets in the page, the total number
+    of datasets and the catalog modification date (ie the most recent
+    `metadata_modified` value of all datasets). Only these fields are
+    requested from the search index, so it is much cheaper than rendering
+    the page.
+
+    The modification date is the catalog one, as it is included in the
+    serialization. It is always read from the search index rather than
+    from the catalog cache, as a value out of date would make clients
+    keep old copies (see `last_catalog_modification`).
+
+    This is only needed to answer conditional requests. Otherwise the
+    values returned by `catalog_page` can be used, which need no extra
+    queries.
+
+    Returns a tuple with the ETag value (quoted) and a datetime object (or
+    None if there are no datasets)
+    '''
+    toolkit.check_access('dcat_catalog_show', context, data_dict)
+
+    search_dict = dict(data_dict, fl='id,metadata_modified')
+    query = _search_ckan_datasets(context, search_dict)
+
+    serializer = RDFSerializer(profiles=data_dict.get('profiles'))
+
+    return _catalog_validators(data_dict, serializer, query,
+                               last_catalog_modification(refresh=True))
+
+
+def _catalog_validators(data_dict, serializer, query, modified):
+    '''
+    Returns the ETag and last modification date of a catalog page, given
+    the results of the page search and the catalog modification date
+    '''
+    key = (
+        toolkit.request.path,
+        sorted(toolkit.request.params.items()),
+        url_to_rdflib_format(data_dict.get('format') or 'xml'),
+        tuple(profile.name for profile in serializer._profiles),
+        serializer.compatibility_mode,
+        query['count'],
+        # Results are sorted by metadata_modified
+        [(d['id'], d['metadata_modified']) for d in query['results']],
+        modified,
+    )
+
+    if modified:
+        modified = dateutil_parse(modified)
+        if modified.tzinfo:
+            modified = (modified - modified.utcoffset()).replace(tzinfo=None)
+
+    return _etag(key), modified
+
+
+def _etag(key):
+    '''
+    Returns a strong ETag value (quoted) for a cache key
+    '''
+    return '"{0}"'.format(hashlib.sha1(repr(key)).hexdigest())
+
+
+@toolkit.side_effect_free
+def dcat_dataset_cache_stats(context, data_dict):
+    '''
+    Returns the size and hit / miss counters of the dataset serializations
+    cache for the current process
+    '''
+    toolkit.check_access('dcat_dataset_cache_stats', context, data_dict)
+
+    return dataset_cache().stats()
+
+
 @toolkit.side_effect_free
 def dcat_catalog_show(context, data_dict):
 
@@ -49,6 +209,82 @@ def dcat_catalog_show(context, data_dict):
     return output
 
 
+def catalog_page(context, data_dict, stream=False):
+    '''
+    Returns the serialized catalog page, along with its ETag and last
+    modification date (as returned by `catalog_modification_info`)
+
+    The ETag is computed from the datasets returned by the page search and
+    the catalog modification date is the one on the catalog cache, the same
+    one included in the serialization, so no other queries are needed.
+
+    If `stream` is True the output is an iterator, as the one returned by
+    `dcat_catalog_stream`.
+
+    Returns a tuple with the output, the ETag value (quoted) and a datetime
+    object (or None if there are no datasets)
+    '''
+    output, query, serializer = _render_catalog_page(context, data_dict,
+                                                     stream)
+
+    etag, modified = _catalog_validators(data_dict, serializer, query,
+                                         last_catalog_modification())
+
+    return output, etag, modified
+
+
+def _render_catalog_page(context, data_dict, stream):
+
+    toolkit.check_access('dcat_catalog_show', context, data_dict)
+
+    query = _search_ckan_datasets(context, data_dict)
+    dataset_dicts = query['results']
+    pagination_info = _pagination_info(query, data_dict)
+
+    serializer = RDFSerializer(profiles=data_dict.get('profiles'))
+
+    if stream:
+        fragments = serializer.serialize_catalog_iter(
+            {}, dataset_dicts, _format=data_dict.get('format'),
+            pagination_info=pagination_info)
+
+        # Render the catalog (or the whole output for formats that can not
+        # be streamed) while the request is still around
+        first_fragment = next(fragments)
+
+        output = itertools.chain([first_fragment], fragments)
+    else:
+        output = serializer.serialize_catalog(
+            {}, dataset_dicts, _format=data_dict.get('format'),
+            pagination_info=pagination_info)
+
+    return output, query, serializer
+
+
+def dcat_catalog_stream(context, data_dict):
+    '''
+    Returns an iterator over the serialized catalog page
+
+    Same parameters and output as `dcat_catalog_show`, but the datasets are
+    serialized one at a time as the iterator is consumed (see
+    `RDFSerializer.serialize_catalog_iter`), so it can be returned directly
+    as a WSGI iterator.
+
+    This is not registered as an action as its output can not be returned
+    by the action API. Access checks and the dataset search are performed
+    straight away, so validation errors are raised before any output is
+    generated.
+
+    The iterator is consumed once the controller has returned, when the
+    request objects (`toolkit.c`, `toolkit.request`) and the database
+    session may be gone. Everything that needs them (the search results,
+    the pagination links and the catalog triples, which include the
+    catalog modification date) is generated before returning, so only the
+    serialization of the dataset dicts is left for later.
+    '''
+    return _render_catalog_page(context, data_dict, stream=True)[0]
+
+
 @toolkit.side_effect_free
 def dcat_catalog_search(context, data_dict):
 
@@ -81,7 +317,7 @@ def dcat_datasets_list(context, data_dict):
 
 def _search_ckan_datasets(context, data_dict):
 
-    n = int(config.get('ckanext.dcat.datasets_per_page', DATASETS_PER_PAGE))
+    n = dcat_settings().datasets_per_page
     page = data_dict.get('page', 1) or 1
 
     try:
@@ -109,6 +345,10 @@ def _search_ckan_datasets(context, data_dict):
     search_data_dict['fq'] = data_dict.get('fq')
     search_data_dict['fq_list'] = []
 
+    # Only return these fields instead of the full dataset dicts
+    if data_dict.get('fl'):
+        search_data_dict['fl'] = data_dict['fl']
+
     # Exclude certain dataset types
     search_data_dict['fq_list'].append('-dataset_type:harvest')
     search_data_dict['fq_list'].append('-dataset_type:showcase')
@@ -175,8 +415,7 @@ def _pagination_info(query, data_dict):
     if query['count'] == 0:
         return {}
 
-    items_per_page = int(config.get('ckanext.dcat.datasets_per_page',
-                                    DATASETS_PER_PAGE))
+    items_per_page = dcat_settings().datasets_per_page
     pagination_info = {
         'count': query['count'],
         'items_per_page': items_per_page,
@@ -209,3 +448,10 @@ def dcat_auth(context, data_dict):
     All users can access DCAT endpoints by default
     '''
     return {'success': True}
+
+
+def dcat_sysadmin_auth(context, data_dict):
+    '''
+    Only sysadmins can access these functions
+    '''
+    return {'success': False}
@@ -1,5 +1,4 @@
-from pylons import config
-
+from ckan import model
 from ckan import plugins as p
 try:
     from ckan.lib.plugins import DefaultTranslation
@@ -12,15 +11,13 @@ from ckanext.dcat.logic import (dcat_dataset_show,
                                 dcat_catalog_show,
                                 dcat_catalog_search,
                                 dcat_datasets_list,
+                                dcat_dataset_cache_stats,
                                 dcat_auth,
+                                dcat_sysadmin_auth,
                                 )
 from ckanext.dcat import utils
-
-DEFAULT_CATALOG_ENDPOINT = '/catalog.{_format}'
-CUSTOM_ENDPOINT_CONFIG = 'ckanext.dcat.catalog_endpoint'
-ENABLE_RDF_ENDPOINTS_CONFIG = 'ckanext.dcat.enable_rdf_endpoints'
-ENABLE_CONTENT_NEGOTIATION_CONFIG = 'ckanext.dcat.enable_content_negotiation'
-TRANSLATE_KEYS_CONFIG = 'ckanext.dcat.translate_keys'
+from ckanext.dcat.cache import dataset_cache, catalog_cache
+from ckanext.dcat.settings import dcat_settings, reload_dcat_settings
 
 
 class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
@@ -38,20 +35,13 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
     def update_config(self, config):
         p.toolkit.add_template_directory(config, 'templates')
 
-        # Check catalog URI on startup to emit a warning if necessary
-        utils.catalog_uri()
-
-        # Check custom catalog endpoint
-        custom_endpoint = config.get(CUSTOM_ENDPOINT_CONFIG)
-        if custom_endpoint:
-            if not custom_endpoint[:1] == '/':
-                raise Exception(
-                    '"{0}" should start with a backslash (/)'.format(
-                        CUSTOM_ENDPOINT_CONFIG))
-            if '{_format}' not in custom_endpoint:
-                raise Exception(
-                    '"{0}" should contain {{_format}}'.format(
-                        CUSTOM_ENDPOINT_CONFIG))
+        # Create the URI factory on startup (this also emits a warning if
+        # the catalog URI is not set)
+        utils.reset_uri_factory()
+
+        # Parse the settings on startup, so invalid values (eg a custom
+        # catalog endpoint without the {_format} placeholder) are reported
+        reload_dcat_settings()
 
     # ITemplateHelpers
     def get_helpers(self):
@@ -64,19 +54,20 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
 
         controller = 'ckanext.dcat.controllers:DCATController'
 
-        if p.toolkit.asbool(config.get(ENABLE_RDF_ENDPOINTS_CONFIG, True)):
+        settings = dcat_settings()
+
+        if settings.enable_rdf_endpoints:
 
             _map.connect('dcat_catalog',
-                         config.get('ckanext.dcat.catalog_endpoint',
-                                    DEFAULT_CATALOG_ENDPOINT),
+                         settings.catalog_endpoint,
                          controller=controller, action='read_catalog',
-                         requirements={'_format': 'xml|rdf|n3|ttl|jsonld'})
+                         requirements={'_format': 'xml|rdf|n3|ttl|nt|jsonld'})
 
             _map.connect('dcat_dataset', '/dataset/{_id}.{_format}',
                          controller=controller, action='read_dataset',
-                         requirements={'_format': 'xml|rdf|n3|ttl|jsonld'})
+                         requirements={'_format': 'xml|rdf|n3|ttl|nt|jsonld'})
 
-        if p.toolkit.asbool(config.get(ENABLE_CONTENT_NEGOTIATION_CONFIG)):
+        if settings.enable_content_negotiation:
 
             _map.connect('home', '/', controller=controller,
                          action='read_catalog')
@@ -94,6 +85,7 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
             'dcat_dataset_show': dcat_dataset_show,
             'dcat_catalog_show': dcat_catalog_show,
             'dcat_catalog_search': dcat_catalog_search,
+            'dcat_dataset_cache_stats': dcat_dataset_cache_stats,
         }
 
     # IAuthFunctions
@@ -102,13 +94,43 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
             'dcat_dataset_show': dcat_auth,
             'dcat_catalog_show': dcat_auth,
             'dcat_catalog_search': dcat_auth,
+            'dcat_dataset_cache_stats': dcat_sysadmin_auth,
         }
 
     # IPackageController
+    def after_create(self, context, data_dict):
+        catalog_cache().clear()
+
+    def after_update(self, context, data_dict):
+        self._invalidate_dataset(context, data_dict)
+        catalog_cache().clear()
+
+    def after_delete(self, context, data_dict):
+        self._invalidate_dataset(context, data_dict)
+        catalog_cache().clear()
+
+    def _invalidate_dataset(self, context, data_dict):
+        '''
+        Removes the cached serializations of a dataset
+
+        Actions can be called with the dataset name as `id`, but entries are
+        grouped by dataset id, so the actual id is looked up first.
+        '''
+        cache = dataset_cache()
+        if not cache.enabled:
+            return
+
+        id_or_name = data_dict.get('id') or data_dict.get('name')
+        dataset = context.get('package')
+        if dataset is None or id_or_name not in (dataset.id, dataset.name):
+            dataset = model.Package.get(id_or_name) if id_or_name else None
+
+        cache.invalidate(dataset.id if dataset else id_or_name)
+
     def after_show(self, context, data_dict):
 
         # check if config is enabled to translate keys (default: True)
-        if not p.toolkit.asbool(config.get(TRANSLATE_KEYS_CONFIG, True)):
+        if not dcat_settings().translate_keys:
             return data_dict
 
         if context.get('for_view'):
@@ -143,7 +165,7 @@ class DCATJSONInterface(p.SingletonPlugin):
     def after_map(self, map):
 
         controller = 'ckanext.dcat.controllers:DCATController'
-        route = config.get('ckanext.dcat.json_endpoint', '/dcat.json')
+        route = dcat_settings().json_endpoint
         map.connect(route, controller=controller, action='dcat_json')
 
         return map
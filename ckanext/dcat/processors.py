@@ -2,29 +2,42 @@ import sys
 import argparse
 import xml
 import json
+import hashlib
+import logging
+from xml.sax.saxutils import escape, quoteattr
 from pkg_resources import iter_entry_points
 
-from pylons import config
-
 import rdflib
 import rdflib.parser
+from rdflib.exceptions import ParserError
+from rdflib.plugins.parsers.ntriples import ParseError
 from rdflib import URIRef, BNode, Literal
-from rdflib.namespace import Namespace, RDF
-
-import ckan.plugins as p
+from rdflib.namespace import Namespace, RDF, split_uri
 
-from ckanext.dcat.utils import catalog_uri, dataset_uri, url_to_rdflib_format, DCAT_EXPOSE_SUBCATALOGS
+from ckanext.dcat.utils import catalog_uri, dataset_uri, url_to_rdflib_format, ExtrasIndex
 from ckanext.dcat.profiles import DCAT, DCT, FOAF
+from ckanext.dcat.settings import dcat_settings
+# Used to be defined here, kept for backwards compatibility
+from ckanext.dcat.settings import (RDF_PROFILES_CONFIG_OPTION,  # noqa
+                                   COMPAT_MODE_CONFIG_OPTION,  # noqa
+                                   DEFAULT_RDF_PROFILES)  # noqa
+from ckanext.dcat.streaming import (DatasetSubgraphs,
+                                    STREAMING_PARSER_FORMATS,
+                                    STREAMING_PARSER_MEDIA_TYPES)
 
 
+log = logging.getLogger(__name__)
+
 HYDRA = Namespace('http://www.w3.org/ns/hydra/core#')
 DCAT = Namespace("http://www.w3.org/ns/dcat#")
 
 RDF_PROFILES_ENTRY_POINT_GROUP = 'ckan.rdf.profiles'
-RDF_PROFILES_CONFIG_OPTION = 'ckanext.dcat.rdf.profiles'
-COMPAT_MODE_CONFIG_OPTION = 'ckanext.dcat.compatibility_mode'
 
-DEFAULT_RDF_PROFILES = ['euro_dcat_ap']
+# rdflib formats that can be written incrementally, one dataset at a time
+STREAMING_FORMATS = ('nt', 'turtle', 'json-ld', 'xml', 'pretty-xml')
+
+# Strings used to join dataset fragments, for formats that need them
+FRAGMENT_SEPARATORS = {'json-ld': ','}
 
 
 class RDFParserException(Exception):
@@ -37,7 +50,8 @@ class RDFProfileException(Exception):
 
 class RDFProcessor(object):
 
-    def __init__(self, profiles=None, compatibility_mode=False):
+    def __init__(self, profiles=None, compatibility_mode=False,
+                 settings=None):
         '''
         Creates a parser or serializer instance
 
@@ -48,25 +62,31 @@ class RDFProcessor(object):
         (eg adding the `dcat_` prefix or storing comma separated lists instead
         of JSON dumps).
 
+        `settings` is a `DCATSettings` object, by default the ones shared by
+        the whole process. They are also used by the profiles.
+
         '''
+        if settings is None:
+            settings = dcat_settings()
+        self.settings = settings
+
         if not profiles:
-            profiles = config.get(RDF_PROFILES_CONFIG_OPTION, None)
-            if profiles:
-                profiles = profiles.split(' ')
-            else:
-                profiles = DEFAULT_RDF_PROFILES
+            profiles = list(settings.profiles)
         self._profiles = self._load_profiles(profiles)
         if not self._profiles:
             raise RDFProfileException(
                 'No suitable RDF profiles could be loaded')
 
         if not compatibility_mode:
-            compatibility_mode = p.toolkit.asbool(
-                config.get(COMPAT_MODE_CONFIG_OPTION, False))
+            compatibility_mode = settings.compatibility_mode
         self.compatibility_mode = compatibility_mode
 
         self.g = rdflib.Graph()
 
+        self._profile_instances = None
+
+        self._extras_index = None
+
     def _load_profiles(self, profile_names):
         '''
         Loads the specified RDF parser profiles
@@ -96,6 +116,33 @@ class RDFProcessor(object):
 
         return profiles
 
+    def _get_profile_instances(self):
+        '''
+        Returns instances of the loaded profiles, bound to the current graph
+
+        Profile instances are created once and reused for all the datasets
+        handled by this processor, so state that is valid for all of them
+        (eg the license register lookup cache) is kept. Before each dataset
+        is processed, their `reset_dataset_state` method is called to clear
+        any per-dataset state.
+
+        If the graph has been replaced (eg `processor.g = another_graph`),
+        the instances are pointed to the new one.
+        '''
+        instances = self._profile_instances
+        if (instances is None or
+                [type(profile) for profile in instances] != self._profiles):
+            instances = [profile_class(self.g, self.compatibility_mode)
+                         for profile_class in self._profiles]
+            self._profile_instances = instances
+
+        for profile in instances:
+            if profile.g is not self.g:
+                profile.g = self.g
+            profile._settings = self.settings
+
+        return instances
+
 
 class RDFParser(RDFProcessor):
     '''
@@ -105,6 +152,12 @@ class RDFParser(RDFProcessor):
     CKAN dicts from the RDF graph.
     '''
 
+    # Set when parsing in streaming mode, see `parse`
+    _subgraphs = None
+
+    # Cache the predicates and objects of subjects, see `datasets`
+    _use_subject_cache = True
+
     def _datasets(self):
         '''
         Generator that returns all DCAT datasets on the graph
@@ -119,13 +172,16 @@ class RDFParser(RDFProcessor):
         '''
         Returns the URL of the next page or None if there is no next page
         '''
+        if self._subgraphs is not None:
+            return self._subgraphs.next_page
+
         for pagination_node in self.g.subjects(RDF.type, HYDRA.PagedCollection):
             for o in self.g.objects(pagination_node, HYDRA.nextPage):
                 return unicode(o)
         return None
 
 
-    def parse(self, data, _format=None):
+    def parse(self, data, _format=None, streaming=False):
         '''
         Parses and RDF graph serialization and into the class graph
 
@@ -135,6 +191,14 @@ class RDFParser(RDFProcessor):
         ... ). By default RF/XML is expected. The optional parameter _format
         can be used to tell rdflib otherwise.
 
+        If `streaming` is True and the format (or media type) is RDF/XML,
+        N-Triples or N-Quads, the class graph is not built. The document is scanned
+        straight away (so syntax errors are raised here), and `datasets()`
+        parses it again, extracting each dataset from a small graph with
+        only its own triples and the catalog ones (see
+        `ckanext.dcat.streaming.DatasetSubgraphs`). Other formats are
+        parsed as usual.
+
         It raises a ``RDFParserException`` if there was some error during
         the parsing.
 
@@ -145,6 +209,15 @@ class RDFParser(RDFProcessor):
         if not _format or _format == 'pretty-xml':
             _format = 'xml'
 
+        if streaming:
+            _format = STREAMING_PARSER_MEDIA_TYPES.get(_format, _format)
+        if streaming and _format in STREAMING_PARSER_FORMATS:
+            try:
+                self._subgraphs = DatasetSubgraphs(data, _format)
+            except (xml.sax.SAXParseException, ParseError, ParserError), e:
+                raise RDFParserException(e)
+            return
+
         try:
             self.g.parse(data=data, format=_format)
         # Apparently there is no single way of catching exceptions from all
@@ -171,16 +244,48 @@ class RDFParser(RDFProcessor):
         Each dataset is passed to all the loaded profiles before being
         yielded, so it can be further modified by each one of them.
 
+        In streaming mode, the class graph is replaced by the graph of each
+        dataset before passing it to the profiles.
+
+        While the datasets are extracted, the profile helpers share a cache
+        with the predicates and objects of each subject queried (see
+        `RDFProfile._objects`), so the graph should not be modified. Each
+        profile also gets a cache for values that are the same for all
+        datasets (eg the catalog each dataset belongs to, see
+        `RDFProfile._get_source_catalog`).
+
         Returns a dataset dict that can be passed to eg `package_create`
         or `package_update`
         '''
-        for dataset_ref in self._datasets():
-            dataset_dict = {}
-            for profile_class in self._profiles:
-                profile = profile_class(self.g, self.compatibility_mode)
-                profile.parse_dataset(dataset_dict, dataset_ref)
+        if self._subgraphs is not None:
+            subgraphs = iter(self._subgraphs)
+        else:
+            subgraphs = ((dataset_ref, self.g)
+                         for dataset_ref in self._datasets())
+
+        cache = cache_graph = None
+        parse_caches = {}
+        try:
+            for dataset_ref, graph in subgraphs:
+                self.g = graph
+                profiles = self._get_profile_instances()
+
+                if self._use_subject_cache and graph is not cache_graph:
+                    cache, cache_graph = {}, graph
 
-            yield dataset_dict
+                dataset_dict = {}
+                for profile in profiles:
+                    profile._subject_cache = cache
+                    profile._parse_cache = parse_caches.setdefault(
+                        id(profile), {})
+                    profile.reset_dataset_state()
+                    profile.parse_dataset(dataset_dict, dataset_ref)
+
+                yield dataset_dict
+        finally:
+            for profile in self._profile_instances or []:
+                profile._subject_cache = None
+                profile._parse_cache = None
 
 
 class RDFSerializer(RDFProcessor):
@@ -190,6 +295,11 @@ class RDFSerializer(RDFProcessor):
     Supports different profiles which are the ones that will generate
     the RDF graph.
     '''
+
+    # Entities emitted by each profile on the catalog being serialized, see
+    # `graph_from_dataset`
+    _emitted_entities = None
+
     def _add_pagination_triples(self, paging_info):
         '''
         Adds pagination triples to the graph using the paging info provided
@@ -237,20 +347,33 @@ class RDFSerializer(RDFProcessor):
         by the loaded profiles.
 
         Returns the reference to the dataset, which will be an rdflib URIRef.
+
+        The dataset extras are indexed once, and the index is shared by all
+        profiles (see `RDFProfile._extras`).
+
+        When serializing a catalog, entities shared by many datasets (eg
+        publishers) are only described once (see
+        `RDFProfile._emitted_node`).
         '''
 
-        uri_value = dataset_dict.get('uri')
-        if not uri_value:
-            for extra in dataset_dict.get('extras', []):
-                if extra['key'] == 'uri':
-                    uri_value = extra['value']
-                    break
+        extras = self._extras_index = ExtrasIndex(dataset_dict)
 
-        dataset_ref = URIRef(dataset_uri(dataset_dict))
+        dataset_ref = URIRef(dataset_uri(dataset_dict, extras))
 
-        for profile_class in self._profiles:
-            profile = profile_class(self.g, self.compatibility_mode)
-            profile.graph_from_dataset(dataset_dict, dataset_ref)
+        emitted = self._emitted_entities
+        profiles = self._get_profile_instances()
+        try:
+            for profile in profiles:
+                profile.reset_dataset_state()
+                profile._extras_index = extras
+                if emitted is not None:
+                    profile._emitted_entities = emitted.setdefault(
+                        id(profile), {})
+                profile.graph_from_dataset(dataset_dict, dataset_ref)
+        finally:
+            for profile in profiles:
+                profile._extras_index = None
+                profile._emitted_entities = None
 
         return dataset_ref
 
@@ -266,8 +389,7 @@ class RDFSerializer(RDFProcessor):
 
         catalog_ref = URIRef(catalog_uri())
 
-        for profile_class in self._profiles:
-            profile = profile_class(self.g, self.compatibility_mode)
+        for profile in self._get_profile_instances():
             profile.graph_from_catalog(catalog_dict, catalog_ref)
 
         return catalog_ref
@@ -320,12 +442,16 @@ class RDFSerializer(RDFProcessor):
 
         catalog_ref = self.graph_from_catalog(catalog_dict)
         if dataset_dicts:
-            for dataset_dict in dataset_dicts:
-                dataset_ref = self.graph_from_dataset(dataset_dict)
+            self._emitted_entities = {}
+            try:
+                for dataset_dict in dataset_dicts:
+                    dataset_ref = self.graph_from_dataset(dataset_dict)
 
-                cat_ref = self._add_source_catalog(catalog_ref, dataset_dict, dataset_ref)
-                if not cat_ref:
-                    self.g.add((catalog_ref, DCAT.dataset, dataset_ref))
+                    cat_ref = self._add_source_catalog(catalog_ref, dataset_dict, dataset_ref)
+                    if not cat_ref:
+                        self.g.add((catalog_ref, DCAT.dataset, dataset_ref))
+            finally:
+                self._emitted_entities = None
 
         if pagination_info:
             self._add_pagination_triples(pagination_info)
@@ -337,24 +463,307 @@ class RDFSerializer(RDFProcessor):
 
         return output
 
-    def _add_source_catalog(self, root_catalog_ref, dataset_dict, dataset_ref):
-        if not p.toolkit.asbool(config.get(DCAT_EXPOSE_SUBCATALOGS, False)):
+    def serialize_catalog_iter(self, catalog_dict=None, dataset_dicts=None,
+                               _format='xml', pagination_info=None):
+        '''
+        Generator version of `serialize_catalog`
+
+        For the formats in `STREAMING_FORMATS` (N-Triples, Turtle, JSON-LD
+        and RDF/XML), the catalog and pagination triples are serialized
+        first, and then each dataset is rendered by the profiles into its own
+        graph, yielded straight away and discarded (see
+        `serialize_catalog_fragments`). This keeps memory usage flat
+        regardless of the number of datasets, and allows the output to be
+        returned as a WSGI iterator.
+
+        Other formats (eg N3) need the whole graph to be built before
+        serializing, so the full output of `serialize_catalog` is yielded
+        in one go.
+
+        Yields strings with fragments of the serialized catalog
+        '''
+        if not _format:
+            _format = 'xml'
+        _format = url_to_rdflib_format(_format)
+
+        if _format not in STREAMING_FORMATS:
+            yield self.serialize_catalog(catalog_dict, dataset_dicts,
+                                         _format=_format,
+                                         pagination_info=pagination_info)
+            return
+
+        fragments = self.serialize_catalog_fragments(
+            catalog_dict, dataset_dicts, _format=_format,
+            pagination_info=pagination_info)
+        separator = FRAGMENT_SEPARATORS.get(_format, '')
+
+        # The start of the document depends on the catalog graph
+        dataset_dict, catalog_fragment = next(fragments)
+        yield self.catalog_fragments_start(_format)
+        yield catalog_fragment
+
+        for dataset_dict, fragment in fragments:
+            if fragment:
+                yield separator + fragment
+
+        yield self.catalog_fragments_end(_format)
+
+    def serialize_catalog_fragments(self, catalog_dict=None,
+                                    dataset_dicts=None, _format='xml',
+                                    pagination_info=None,
+                                    self_contained=False):
+        '''
+        Serializes the catalog and each of the datasets separately
+
+        Only the formats in `STREAMING_FORMATS` are supported. Each dataset
+        is rendered by the profiles into its own graph, which is serialized
+        and discarded before moving to the next one.
+
+        A full document is made of the output of `catalog_fragments_start`,
+        the catalog fragment, the dataset fragments joined with the format
+        separator (see `FRAGMENT_SEPARATORS`) and the output of
+        `catalog_fragments_end`.
+
+        Subcatalogs and entities with a URI shared by many datasets (eg
+        publishers, see `RDFProfile._emitted_node`) are only described the
+        first time they are referenced, unless `self_contained` is True. In
+        this case dataset fragments don't depend on each other, so they can
+        be stored and reassembled later (eg to update a static dump).
+
+        Yields tuples with the dataset dict (None for the catalog, which
+        comes first) and its serialization
+        '''
+        if not _format:
+            _format = 'xml'
+        _format = url_to_rdflib_format(_format)
+
+        if _format not in STREAMING_FORMATS:
+            raise ValueError(
+                'Format {0} can not be serialized in fragments'.format(
+                    _format))
+
+        source_catalogs = None if self_contained else set()
+
+        catalog_ref = self.graph_from_catalog(catalog_dict)
+        if pagination_info:
+            self._add_pagination_triples(pagination_info)
+
+        self._fragment_namespaces = None
+        self._fragment_bindings = None
+        self._fragment_prefixes = set()
+        if _format in ('xml', 'pretty-xml'):
+            # All prefixes need to be declared upfront on the root element
+            self._fragment_namespaces = dict(
+                (prefix, unicode(namespace))
+                for prefix, namespace in self.g.namespaces()
+                if prefix != 'xml')
+            self._fragment_namespaces['rdf'] = unicode(RDF)
+
+        fragment = self._serialize_fragment(_format)
+        if _format == 'turtle':
+            self._fragment_bindings = list(self.g.namespaces())
+            self._fragment_prefixes = set(
+                line for line in fragment.splitlines(True)
+                if line.startswith('@prefix'))
+        yield None, fragment
+
+        emitted = {}
+        try:
+            for dataset_dict in dataset_dicts or []:
+                self.g = rdflib.Graph()
+
+                self._emitted_entities = {} if self_contained else emitted
+                dataset_ref = self.graph_from_dataset(dataset_dict)
+
+                cat_ref = self._add_source_catalog(
+                    catalog_ref, dataset_dict, dataset_ref,
+                    source_catalogs=source_catalogs)
+                if not cat_ref:
+                    self.g.add((catalog_ref, DCAT.dataset, dataset_ref))
+
+                self._emitted_entities = None
+                yield dataset_dict, self._serialize_fragment(_format)
+        finally:
+            self._emitted_entities = None
+
+    def catalog_fragments_start(self, _format):
+        '''
+        Returns the string that goes before the catalog fragment in a
+        document assembled from `serialize_catalog_fragments` output
+        '''
+        _format = url_to_rdflib_format(_format)
+        if _format in ('xml', 'pretty-xml'):
+            return self._rdfxml_header(self._fragment_namespaces)
+        elif _format == 'json-ld':
+            return '['
+        return ''
+
+    def catalog_fragments_end(self, _format):
+        '''
+        Returns the string that goes after the last fragment in a document
+        assembled from `serialize_catalog_fragments` output
+        '''
+        _format = url_to_rdflib_format(_format)
+        if _format in ('xml', 'pretty-xml'):
+            return '</rdf:RDF>\n'
+        elif _format == 'json-ld':
+            return ']'
+        return ''
+
+    def _serialize_fragment(self, _format):
+        '''
+        Serializes the current graph so it can be concatenated with others
+
+        Turtle prefix declarations already present in the catalog fragment
+        are removed (see `_bind_fragment_namespaces`), and JSON-LD node
+        lists are stripped of their enclosing brackets. RDF/XML is written
+        without the enclosing `rdf:RDF` element, using the prefixes declared
+        on it (see `_rdfxml_description`), with subjects sorted so the same
+        graph always gives the same output.
+
+        Returns a string
+        '''
+        if _format in ('xml', 'pretty-xml'):
+            return ''.join(
+                self._rdfxml_description(subject, self._fragment_namespaces)
+                for subject in sorted(set(self.g.subjects())))
+
+        if _format == 'turtle':
+            self._bind_fragment_namespaces()
+
+        output = self.g.serialize(format=_format)
+
+        if _format == 'turtle':
+            output = ''.join(line for line in output.splitlines(True)
+                             if line not in self._fragment_prefixes)
+        elif _format == 'json-ld':
+            output = output.strip()[1:-1].strip()
+
+        return output
+
+    def _bind_fragment_namespaces(self):
+        '''
+        Binds prefixes on the current graph before serializing it as a
+        Turtle fragment
+
+        The prefixes of the catalog graph are bound to the same namespaces.
+        rdflib would generate a prefix (`ns1`, `ns2`...) for any other
+        namespace used by a predicate, which could be bound to different
+        namespaces on different fragments, so they get a prefix derived
+        from the namespace itself instead.
+        '''
+        for prefix, namespace in self._fragment_bindings or []:
+            self.g.bind(prefix, namespace, override=True)
+
+        bound = set(unicode(namespace)
+                    for prefix, namespace in self.g.namespaces())
+        for predicate in set(self.g.predicates()):
+            try:
+                namespace = split_uri(predicate)[0]
+            except Exception:
+                continue
+            if namespace not in bound:
+                self.g.bind('ns' + hashlib.sha1(
+                    namespace.encode('utf-8')).hexdigest()[:8], namespace)
+                bound.add(namespace)
+
+    def _rdfxml_header(self, namespaces):
+        '''
+        Returns the XML declaration and the opening `rdf:RDF` tag, with all
+        prefixes in the `namespaces` dict declared
+        '''
+        declarations = ''.join(
+            u'\n  xmlns:{0}={1}'.format(prefix, quoteattr(namespace))
+            for prefix, namespace in sorted(namespaces.items()) if prefix)
+        return (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                u'<rdf:RDF{0}\n>\n'.format(declarations)).encode('utf-8')
+
+    def _rdfxml_description(self, subject, namespaces):
+        '''
+        Returns an `rdf:Description` element with all the triples of
+        `subject` in the current graph
+
+        Predicates in one of the `namespaces` declared on the root element
+        use its prefix, other ones declare their namespace as the default
+        one on the property element itself, so no new prefixes are needed.
+
+        Predicates that can not be split into a namespace and a local name
+        (eg ending with a slash or with a local name starting with a digit)
+        can not be written as RDF/XML elements. rdflib's own serializers
+        raise an exception in this case, here the triple is left out and a
+        warning logged, so the rest of the document can still be generated.
+
+        Triples are written sorted by predicate and object.
+        '''
+        prefixes = dict((namespace, prefix)
+                        for prefix, namespace in namespaces.iteritems())
+
+        def _node_attr(node, uri_attr):
+            if isinstance(node, BNode):
+                return u'rdf:nodeID={0}'.format(quoteattr(node))
+            return u'{0}={1}'.format(uri_attr, quoteattr(node))
+
+        lines = [u'  <rdf:Description {0}>'.format(
+            _node_attr(subject, 'rdf:about'))]
+
+        for predicate, obj in sorted(self.g.predicate_objects(subject)):
+            try:
+                namespace, local_name = split_uri(predicate)
+            except Exception:
+                # rdflib raises a plain Exception (ValueError on newer
+                # versions)
+                log.warning('Predicate %s can not be serialized as '
+                            'RDF/XML, skipping it', predicate)
+                continue
+            prefix = prefixes.get(namespace)
+            if prefix:
+                tag = u'{0}:{1}'.format(prefix, local_name)
+                attrs = u''
+            else:
+                tag = local_name
+                attrs = u' xmlns={0}'.format(quoteattr(namespace))
+
+            if isinstance(obj, Literal):
+                if obj.language:
+                    attrs += u' xml:lang={0}'.format(quoteattr(obj.language))
+                elif obj.datatype:
+                    attrs += u' rdf:datatype={0}'.format(
+                        quoteattr(obj.datatype))
+                lines.append(u'    <{0}{1}>{2}</{0}>'.format(
+                    tag, attrs, escape(obj)))
+            else:
+                lines.append(u'    <{0}{1} {2}/>'.format(
+                    tag, attrs, _node_attr(obj, 'rdf:resource')))
+
+        lines.append(u'  </rdf:Description>\n')
+
+        return u'\n'.join(lines).encode('utf-8')
+
+    def _add_source_catalog(self, root_catalog_ref, dataset_dict, dataset_ref,
+                            source_catalogs=None):
+        if not self.settings.expose_subcatalogs:
             return
 
-        def _get_from_extra(key):
-            for ex in dataset_dict.get('extras', []):
-                if ex['key'] == key:
-                    return ex['value']
+        extras = self._extras_index
+        if extras is None or extras.source_dict is not dataset_dict:
+            extras = ExtrasIndex(dataset_dict)
 
-        source_uri = _get_from_extra('source_catalog_homepage')
+        source_uri = extras.get('source_catalog_homepage')
         if not source_uri:
             return
         
         g = self.g
         catalog_ref = URIRef(source_uri)
 
-        # we may have multiple subcatalogs, let's check if this one has been already added
-        if (root_catalog_ref, DCT.hasPart, catalog_ref) not in g:
+        # we may have multiple subcatalogs, let's check if this one has been
+        # already added (on this graph or, when streaming, on a previous one)
+        if source_catalogs is not None:
+            already_added = catalog_ref in source_catalogs
+            source_catalogs.add(catalog_ref)
+        else:
+            already_added = (root_catalog_ref, DCT.hasPart, catalog_ref) in g
+
+        if not already_added:
 
             g.add((root_catalog_ref, DCT.hasPart, catalog_ref))
             g.add((catalog_ref, RDF.type, DCAT.Catalog))
@@ -369,7 +778,7 @@ class RDFSerializer(RDFProcessor):
             # base catalog struct
             for item in sources:
                 key, predicate, _type = item
-                value = _get_from_extra(key)
+                value = extras.get(key)
                 if value:
                     g.add((catalog_ref, predicate, _type(value)))
 
@@ -379,7 +788,7 @@ class RDFSerializer(RDFProcessor):
                                  ('url', URIRef, FOAF.homepage,False,),
                                  ('type', Literal, DCT.type, False,))
 
-            _pub = _get_from_extra('source_catalog_publisher')
+            _pub = extras.get('source_catalog_publisher')
             if _pub:
                 pub = json.loads(_pub)
 
@@ -435,18 +844,20 @@ Operation mode.
 
     contents = args.file.read()
 
-    config.update({DCAT_EXPOSE_SUBCATALOGS: args.subcatalogs})
+    settings = dcat_settings()._replace(expose_subcatalogs=args.subcatalogs)
 
     if args.mode == 'produce':
         serializer = RDFSerializer(profiles=args.profile,
-                                   compatibility_mode=args.compat_mode)
+                                   compatibility_mode=args.compat_mode,
+                                   settings=settings)
 
         dataset = json.loads(contents)
         out = serializer.serialize_dataset(dataset, _format=args.format)
         print out
     else:
         parser = RDFParser(profiles=args.profile,
-                           compatibility_mode=args.compat_mode)
+                           compatibility_mode=args.compat_mode,
+                           settings=settings)
 
         parser.parse(contents, _format=args.format)
 
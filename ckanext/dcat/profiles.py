@@ -1,8 +1,5 @@
-import datetime
 import json
 
-from dateutil.parser import parse as parse_date
-
 from ckantoolkit import config
 
 import rdflib
@@ -12,10 +9,12 @@ from rdflib.namespace import Namespace, RDF, XSD, SKOS, RDFS
 from geomet import wkt, InvalidGeoJSONException
 
 from ckan.model.license import LicenseRegister
-from ckan.plugins import toolkit
 from ckan.lib.munge import munge_tag
 
-from ckanext.dcat.utils import resource_uri, publisher_uri_from_dataset_dict, DCAT_EXPOSE_SUBCATALOGS, DCAT_CLEAN_TAGS
+from ckanext.dcat.utils import resource_uri, publisher_uri_from_dataset_dict, ExtrasIndex, resource_format_index
+from ckanext.dcat.utils import isoformat_date, last_catalog_modification
+from ckanext.dcat.cache import catalog_cache
+from ckanext.dcat.settings import dcat_settings
 
 DCT = Namespace("http://purl.org/dc/terms/")
 DCAT = Namespace("http://www.w3.org/ns/dcat#")
@@ -31,6 +30,12 @@ SPDX = Namespace('http://spdx.org/rdf/terms#')
 
 GEOJSON_IMT = 'https://www.iana.org/assignments/media-types/application/vnd.geo+json'
 
+# Maximum number of subjects kept in the parsing cache, see `RDFProfile._objects`
+SUBJECT_CACHE_MAX_ITEMS = 10000
+
+# Maximum number of entities kept in the parsing cache, see `RDFProfile._entity`
+ENTITY_CACHE_MAX_ITEMS = 10000
+
 namespaces = {
     'dct': DCT,
     'dcat': DCAT,
@@ -53,6 +58,25 @@ class RDFProfile(object):
        custom profiles
     '''
 
+    # Predicates and objects of the subjects queried so far, set by the
+    # parser while extracting datasets. See _objects().
+    _subject_cache = None
+
+    # Index of the extras of the dataset being serialized, set by the
+    # serializer. See _extras().
+    _extras_index = None
+
+    # Settings of the processor using the profile. See settings.
+    _settings = None
+
+    # Values computed once per parse (eg the catalog of each dataset), set
+    # by the parser while extracting datasets. See _catalog_index().
+    _parse_cache = None
+
+    # Entities (eg publishers) already added to the catalog being
+    # serialized, set by the serializer. See _emitted_node().
+    _emitted_entities = None
+
     def __init__(self, graph, compatibility_mode=False):
         '''Class constructor
 
@@ -69,9 +93,17 @@ class RDFProfile(object):
         self.compatibility_mode = compatibility_mode
 
         # Cache for mappings of licenses URL/title to ID built when needed in
-        # _license().
+        # _license_id().
         self._licenceregister_cache = None
 
+    @property
+    def settings(self):
+        '''
+        The `DCATSettings` to use, which are the ones of the processor using
+        the profile (by default the ones shared by the whole process)
+        '''
+        return self._settings or dcat_settings()
+
     def _datasets(self):
         '''
         Generator that returns all DCAT datasets on the graph
@@ -89,9 +121,36 @@ class RDFProfile(object):
         Yields rdflib.term.URIRef objects that can be used on graph lookups
         and queries
         '''
-        for distribution in self.g.objects(dataset, DCAT.distribution):
+        for distribution in self._objects(dataset, DCAT.distribution):
             yield distribution
 
+    def _objects(self, subject, predicate):
+        '''
+        Returns all the objects for this subject and predicate
+
+        Both subject and predicate must be rdflib URIRef or BNode objects
+
+        While datasets are being parsed (see `RDFParser.datasets`), all the
+        predicates and objects of a subject are read from the graph at once
+        the first time it is queried, and kept for the following queries.
+        The graph should not be modified in the meantime.
+
+        Returns an iterable of rdflib nodes
+        '''
+        cache = self._subject_cache
+        if cache is None:
+            return self.g.objects(subject, predicate)
+
+        view = cache.get(subject)
+        if view is None:
+            if len(cache) >= SUBJECT_CACHE_MAX_ITEMS:
+                cache.clear()
+            view = {}
+            for p, o in self.g.predicate_objects(subject):
+                view.setdefault(p, []).append(o)
+            cache[subject] = view
+        return view.get(predicate, ())
+
     def _object(self, subject, predicate):
         '''
         Helper for returning the first object for this subject and predicate
@@ -100,7 +159,7 @@ class RDFProfile(object):
 
         Returns an rdflib reference (URIRef or BNode) or None if not found
         '''
-        for _object in self.g.objects(subject, predicate):
+        for _object in self._objects(subject, predicate):
             return _object
         return None
 
@@ -112,7 +171,7 @@ class RDFProfile(object):
 
         If found, the unicode representation is returned, else an empty string
         '''
-        for o in self.g.objects(subject, predicate):
+        for o in self._objects(subject, predicate):
             return unicode(o)
         return ''
 
@@ -142,7 +201,7 @@ class RDFProfile(object):
 
         If no values found, returns an empty string
         '''
-        return [unicode(o) for o in self.g.objects(subject, predicate)]
+        return [unicode(o) for o in self._objects(subject, predicate)]
 
     def _time_interval(self, subject, predicate):
         '''
@@ -162,7 +221,7 @@ class RDFProfile(object):
 
         start_date = end_date = None
 
-        for interval in self.g.objects(subject, predicate):
+        for interval in self._objects(subject, predicate):
             # Fist try the schema.org way
             start_date = self._object_value(interval, SCHEMA.startDate)
             end_date = self._object_value(interval, SCHEMA.endDate)
@@ -171,10 +230,10 @@ class RDFProfile(object):
                 return start_date, end_date
 
             # If no luck, try the w3 time way
-            start_nodes = [t for t in self.g.objects(interval,
-                                                     TIME.hasBeginning)]
-            end_nodes = [t for t in self.g.objects(interval,
-                                                   TIME.hasEnd)]
+            start_nodes = [t for t in self._objects(interval,
+                                                    TIME.hasBeginning)]
+            end_nodes = [t for t in self._objects(interval,
+                                                  TIME.hasEnd)]
             if start_nodes:
                 start_date = self._object_value(start_nodes[0],
                                                 TIME.inXSDDateTime)
@@ -184,6 +243,38 @@ class RDFProfile(object):
 
         return start_date, end_date
 
+    def _entity(self, kind, node, extract):
+        '''
+        Returns the value extracted by `extract(node)` for an entity shared
+        by many datasets (eg a publisher)
+
+        While datasets are being parsed, the value is only extracted the
+        first time the node is found and kept for the following datasets.
+        Blank nodes are only local to a graph, so the values extracted from
+        them are discarded when the graph of the profile changes (eg when
+        streaming). Values are shared, so callers should return copies of
+        mutable ones.
+        '''
+        cache = self._parse_cache
+        if cache is None:
+            return extract(node)
+
+        if isinstance(node, BNode):
+            entities = cache.get('bnode_entities')
+            if entities is None or entities[0] is not self.g:
+                entities = cache['bnode_entities'] = (self.g, {})
+            entities = entities[1]
+        else:
+            entities = cache.setdefault('entities', {})
+
+        key = (kind, node)
+        if key in entities:
+            return entities[key]
+        if len(entities) >= ENTITY_CACHE_MAX_ITEMS:
+            entities.clear()
+        value = entities[key] = extract(node)
+        return value
+
     def _publisher(self, subject, predicate):
         '''
         Returns a dict with details about a dct:publisher entity, a foaf:Agent
@@ -221,20 +312,21 @@ class RDFProfile(object):
 
         publisher = {}
 
-        for agent in self.g.objects(subject, predicate):
-
-            publisher['uri'] = (unicode(agent) if isinstance(agent,
-                                rdflib.term.URIRef) else '')
+        for agent in self._objects(subject, predicate):
+            publisher = self._entity('publisher', agent, self._agent_details)
 
-            publisher['name'] = self._object_value(agent, FOAF.name)
+        return dict(publisher)
 
-            publisher['email'] = self._object_value(agent, FOAF.mbox)
+    def _agent_details(self, agent):
 
-            publisher['url'] = self._object_value(agent, FOAF.homepage)
-
-            publisher['type'] = self._object_value(agent, DCT.type)
-
-        return publisher
+        return {
+            'uri': (unicode(agent) if isinstance(agent, rdflib.term.URIRef)
+                    else ''),
+            'name': self._object_value(agent, FOAF.name),
+            'email': self._object_value(agent, FOAF.mbox),
+            'url': self._object_value(agent, FOAF.homepage),
+            'type': self._object_value(agent, DCT.type),
+        }
 
     def _contact_details(self, subject, predicate):
         '''
@@ -248,16 +340,19 @@ class RDFProfile(object):
 
         contact = {}
 
-        for agent in self.g.objects(subject, predicate):
+        for agent in self._objects(subject, predicate):
+            contact = self._entity('contact', agent, self._vcard_details)
 
-            contact['uri'] = (unicode(agent) if isinstance(agent,
-                              rdflib.term.URIRef) else '')
+        return dict(contact)
 
-            contact['name'] = self._object_value(agent, VCARD.fn)
+    def _vcard_details(self, agent):
 
-            contact['email'] = self._object_value(agent, VCARD.hasEmail)
-
-        return contact
+        return {
+            'uri': (unicode(agent) if isinstance(agent, rdflib.term.URIRef)
+                    else ''),
+            'name': self._object_value(agent, VCARD.fn),
+            'email': self._object_value(agent, VCARD.hasEmail),
+        }
 
     def _spatial(self, subject, predicate):
         '''
@@ -280,32 +375,19 @@ class RDFProfile(object):
         text = None
         geom = None
 
-        for spatial in self.g.objects(subject, predicate):
-
-            if isinstance(spatial, URIRef):
-                uri = unicode(spatial)
-
-            if isinstance(spatial, Literal):
-                text = unicode(spatial)
-
-            if (spatial, RDF.type, DCT.Location) in self.g:
-                for geometry in self.g.objects(spatial, LOCN.geometry):
-                    if (geometry.datatype == URIRef(GEOJSON_IMT) or
-                            not geometry.datatype):
-                        try:
-                            json.loads(unicode(geometry))
-                            geom = unicode(geometry)
-                        except (ValueError, TypeError):
-                            pass
-                    if not geom and geometry.datatype == GSP.wktLiteral:
-                        try:
-                            geom = json.dumps(wkt.loads(unicode(geometry)))
-                        except (ValueError, TypeError):
-                            pass
-                for label in self.g.objects(spatial, SKOS.prefLabel):
-                    text = unicode(label)
-                for label in self.g.objects(spatial, RDFS.label):
-                    text = unicode(label)
+        for spatial in self._objects(subject, predicate):
+
+            (spatial_uri, spatial_text, spatial_geom,
+                from_wkt) = self._entity('spatial', spatial,
+                                         self._location_details)
+
+            if spatial_uri is not None:
+                uri = spatial_uri
+            if spatial_text is not None:
+                text = spatial_text
+            # WKT geometries are only used if no GeoJSON one was found
+            if spatial_geom and not (from_wkt and geom):
+                geom = spatial_geom
 
         return {
             'uri': uri,
@@ -313,6 +395,45 @@ class RDFProfile(object):
             'geom': geom,
         }
 
+    def _location_details(self, spatial):
+        '''
+        Returns a tuple with the uri, text and geometry of a single spatial
+        node, and whether the geometry was transformed from WKT
+        '''
+        uri = None
+        text = None
+        geom = None
+        from_wkt = False
+
+        if isinstance(spatial, URIRef):
+            uri = unicode(spatial)
+
+        if isinstance(spatial, Literal):
+            text = unicode(spatial)
+
+        if DCT.Location in self._objects(spatial, RDF.type):
+            for geometry in self._objects(spatial, LOCN.geometry):
+                if (geometry.datatype == URIRef(GEOJSON_IMT) or
+                        not geometry.datatype):
+                    try:
+                        json.loads(unicode(geometry))
+                        geom = unicode(geometry)
+                        from_wkt = False
+                    except (ValueError, TypeError):
+                        pass
+                if not geom and geometry.datatype == GSP.wktLiteral:
+                    try:
+                        geom = json.dumps(wkt.loads(unicode(geometry)))
+                        from_wkt = True
+                    except (ValueError, TypeError):
+                        pass
+            for label in self._objects(spatial, SKOS.prefLabel):
+                text = unicode(label)
+            for label in self._objects(spatial, RDFS.label):
+                text = unicode(label)
+
+        return uri, text, geom, from_wkt
+
     def _license(self, dataset_ref):
         '''
         Returns a license identifier if one of the distributions license is
@@ -323,29 +444,38 @@ class RDFProfile(object):
         that if distributions have different licenses we'll only get the first
         one.
         '''
-        if self._licenceregister_cache is not None:
-            license_uri2id, license_title2id = self._licenceregister_cache
-        else:
-            license_uri2id = {}
-            license_title2id = {}
-            for license_id, license in LicenseRegister().items():
-                license_uri2id[license.url] = license_id
-                license_title2id[license.title] = license_id
-            self._licenceregister_cache = license_uri2id, license_title2id
-
         for distribution in self._distributions(dataset_ref):
             # If distribution has a license, attach it to the dataset
             license = self._object(distribution, DCT.license)
             if license:
-                # Try to find a matching license comparing URIs, then titles
-                license_id = license_uri2id.get(license.toPython())
-                if not license_id:
-                    license_id = license_title2id.get(
-                        self._object_value(license, DCT.title))
+                license_id = self._entity('license', license,
+                                          self._license_id)
                 if license_id:
                     return license_id
         return ''
 
+    def _license_id(self, license):
+        '''
+        Returns the identifier of the license in the CKAN license registry
+        matching a dct:license node, or None if there is none
+        '''
+        if self._licenceregister_cache is not None:
+            license_uri2id, license_title2id = self._licenceregister_cache
+        else:
+            license_uri2id = {}
+            license_title2id = {}
+            for license_id, license_ in LicenseRegister().items():
+                license_uri2id[license_.url] = license_id
+                license_title2id[license_.title] = license_id
+            self._licenceregister_cache = license_uri2id, license_title2id
+
+        # Try to find a matching license comparing URIs, then titles
+        license_id = license_uri2id.get(license.toPython())
+        if not license_id:
+            license_id = license_title2id.get(
+                self._object_value(license, DCT.title))
+        return license_id
+
     def _distribution_format(self, distribution, normalize_ckan_format=True):
         '''
         Returns the Internet Media Type and format label for a distribution
@@ -372,7 +502,8 @@ class RDFProfile(object):
         If `normalize_ckan_format` is True and using CKAN>=2.3, the label will
         be tried to match against the standard list of formats that is included
         with CKAN core
-        (https://github.com/ckan/ckan/blob/master/ckan/config/resource_formats.json)
+        (https://github.com/ckan/ckan/blob/master/ckan/config/resource_formats.json),
+        ignoring case (see `ckanext.dcat.utils.ResourceFormatIndex`).
         This allows for instance to populate the CKAN resource format field
         with a format that view plugins, etc will understand (`csv`, `xml`,
         etc.)
@@ -395,20 +526,12 @@ class RDFProfile(object):
         elif isinstance(_format, (BNode, URIRef)):
             if self._object(_format, RDF.type) == DCT.IMT:
                 if not imt:
-                    imt = unicode(self.g.value(_format, default=None))
-                label = unicode(self.g.label(_format, default=None))
+                    imt = unicode(self._object(_format, RDF.value))
+                label = unicode(self._object(_format, RDFS.label))
 
-        if ((imt or label) and normalize_ckan_format and
-                toolkit.check_ckan_version(min_version='2.3')):
-            import ckan.config
-            from ckan.lib import helpers
-
-            format_registry = helpers.resource_formats()
-
-            if imt in format_registry:
-                label = format_registry[imt][1]
-            elif label in format_registry:
-                label = format_registry[label][1]
+        if (imt or label) and normalize_ckan_format:
+            formats = resource_format_index()
+            label = formats.label(imt) or formats.label(label) or label
 
         return imt, label
 
@@ -426,12 +549,29 @@ class RDFProfile(object):
         if key in _dict:
             return _dict[key]
 
+        index = self._extras_index
+        if index is not None and index.source_dict is _dict:
+            return index.get(key, default, legacy=True)
+
         for extra in _dict.get('extras', []):
             if extra['key'] == key or extra['key'] == 'dcat_' + key:
                 return extra['value']
 
         return default
 
+    def _extras(self, _dict):
+        '''
+        Returns an `ExtrasIndex` with the extras of a CKAN dict
+
+        The index of the dataset being serialized is created once by the
+        serializer and shared by all profiles. For other dicts a new one is
+        created.
+        '''
+        index = self._extras_index
+        if index is not None and index.source_dict is _dict:
+            return index
+        return ExtrasIndex(_dict)
+
     def _get_dataset_value(self, dataset_dict, key, default=None):
         '''
         Returns the value for the given key on a CKAN dict
@@ -533,18 +673,15 @@ class RDFProfile(object):
         '''
         Adds a new triple with a date object
 
-        Dates are parsed using dateutil, and if the date obtained is correct,
-        added to the graph as an XSD.dateTime value.
+        Dates are parsed using `isoformat_date`, and if the date obtained is
+        correct, added to the graph as an XSD.dateTime value.
 
         If there are parsing errors, the literal string value is added.
         '''
         if not value:
             return
         try:
-            default_datetime = datetime.datetime(1, 1, 1, 0, 0, 0)
-            _date = parse_date(value, default=default_datetime)
-
-            self.g.add((subject, predicate, _type(_date.isoformat(),
+            self.g.add((subject, predicate, _type(isoformat_date(value),
                                                   datatype=XSD.dateTime)))
         except ValueError:
             self.g.add((subject, predicate, _type(value)))
@@ -554,22 +691,12 @@ class RDFProfile(object):
         Returns the date and time the catalog was last modified
 
         To be more precise, the most recent value for `metadata_modified` on a
-        dataset.
+        dataset. See `ckanext.dcat.utils.last_catalog_modification`.
 
         Returns a dateTime string in ISO format, or None if it could not be
         found.
         '''
-        context = {
-            'user': toolkit.get_action('get_site_user')(
-                {'ignore_auth': True})['name']
-        }
-        result = toolkit.get_action('package_search')(context, {
-            'sort': 'metadata_modified desc',
-            'rows': 1,
-        })
-        if result and result.get('results'):
-            return result['results'][0]['metadata_modified']
-        return None
+        return last_catalog_modification()
 
     def _get_source_catalog(self, dataset_ref):
         '''
@@ -582,14 +709,15 @@ class RDFProfile(object):
         This will not be used if ckanext.dcat.expose_subcatalogs
         configuration option is set to False.
         '''
-        if not toolkit.asbool(config.get(DCAT_EXPOSE_SUBCATALOGS, False)):
+        if not self.settings.expose_subcatalogs:
             return
-        catalogs = set(self.g.subjects(DCAT.dataset, dataset_ref))
-        root = self._get_root_catalog_ref()
-        try:
-            catalogs.remove(root)
-        except KeyError:
-            pass
+        if self._parse_cache is None:
+            root = self._get_root_catalog_ref()
+            catalogs = set(self.g.subjects(DCAT.dataset, dataset_ref))
+            catalogs.discard(root)
+        else:
+            root, dataset_catalogs = self._catalog_index()
+            catalogs = set(dataset_catalogs.get(dataset_ref, ()))
         assert len(catalogs) in (0, 1,), "len %s" %catalogs
         if catalogs:
             return catalogs.pop()
@@ -601,8 +729,85 @@ class RDFProfile(object):
             roots = list(self.g.subjects(RDF.type, DCAT.Catalog))
         return roots[0]
 
+    def _catalog_index(self):
+        '''
+        Returns a tuple with the root catalog of the graph and a dict with the
+        other catalogs that link to each dataset
+
+        While datasets are being parsed, the index is built once per graph,
+        instead of looking for the root catalog for each dataset.
+        '''
+        cache = self._parse_cache
+        index = cache.get('catalog_index')
+        if index is None or index[0] is not self.g:
+            root = self._get_root_catalog_ref()
+            dataset_catalogs = {}
+            for catalog, dataset in self.g.subject_objects(DCAT.dataset):
+                if catalog != root:
+                    dataset_catalogs.setdefault(dataset, set()).add(catalog)
+            index = cache['catalog_index'] = (self.g, root, dataset_catalogs)
+        return index[1], index[2]
+
+    def _emitted_node(self, kind, key):
+        '''
+        Returns the node of an entity shared by many datasets (eg a
+        publisher) that has already been added to the catalog being
+        serialized, or None if it has not been added yet
+
+        `key` should contain the node URI (if any) and all the values used to
+        describe the entity, so the node is only reused if it would get the
+        same triples. Blank nodes are only reused on the same graph.
+        '''
+        entities = self._emitted_entities
+        if entities is None or not key:
+            return None
+        try:
+            emitted = entities.get((kind, key))
+        except TypeError:
+            # Unhashable values (eg lists) are not tracked
+            return None
+        if emitted is None:
+            return None
+        graph, node = emitted
+        if isinstance(node, BNode) and graph is not self.g:
+            return None
+        return node
+
+    def _emit_node(self, kind, key, node):
+        '''
+        Records that the triples describing an entity have been added to the
+        catalog being serialized, see `_emitted_node()`
+        '''
+        if self._emitted_entities is not None and key:
+            try:
+                self._emitted_entities[(kind, key)] = (self.g, node)
+            except TypeError:
+                pass
+
+    def _dict_values(self, _dict, keys):
+        '''
+        Returns a tuple with the values of the provided keys on a CKAN dict,
+        to be used as the key of `_emitted_node()`
+        '''
+        return tuple(self._get_dict_value(_dict, key) for key in keys)
+
     # Public methods for profiles to implement
 
+    def reset_dataset_state(self):
+        '''
+        Clears any state stored on the profile for the previous dataset
+
+        Parsers and serializers create a single instance of each profile and
+        reuse it for all the datasets they process. This method is called
+        before each dataset is parsed or serialized, so profiles that store
+        values specific to a dataset on the instance should override it to
+        clear them.
+
+        Caches that are valid for all datasets (eg the license register
+        mappings used in `_license_id()`) should not be cleared here.
+        '''
+        pass
+
     def parse_dataset(self, dataset_dict, dataset_ref):
         '''
         Creates a CKAN dataset dict from the RDF graph
@@ -620,7 +825,21 @@ class RDFProfile(object):
     def _extract_catalog_dict(self, catalog_ref):
         '''
         Returns list of key/value dictionaries with catalog
+
+        While datasets are being parsed, the values of each catalog are only
+        extracted once.
         '''
+        if self._parse_cache is None:
+            return self._catalog_extras(catalog_ref)
+
+        catalogs = self._parse_cache.setdefault('catalog_extras', {})
+        extras = catalogs.get(catalog_ref)
+        if extras is None:
+            extras = catalogs[catalog_ref] = self._catalog_extras(catalog_ref)
+        # Datasets get their own copies, which can be modified
+        return [dict(extra) for extra in extras]
+
+    def _catalog_extras(self, catalog_ref):
 
         out = []
         sources = (('source_catalog_title', DCT.title,),
@@ -706,7 +925,7 @@ class EuropeanDCATAPProfile(RDFProfile):
             keywords.extend([k.strip() for k in keyword.split(',')])
 
         # replace munge_tag to noop if there's no need to clean tags
-        do_clean = toolkit.asbool(config.get(DCAT_CLEAN_TAGS, False))
+        do_clean = self.settings.clean_tags
         tags_val = [munge_tag(tag) if do_clean else tag for tag in keywords]
         tags = [{'name': tag} for tag in tags_val]
         dataset_dict['tags'] = tags
@@ -795,7 +1014,7 @@ class EuropeanDCATAPProfile(RDFProfile):
             dataset_dict['license_id'] = self._license(dataset_ref)
 
         # Source Catalog
-        if toolkit.asbool(config.get(DCAT_EXPOSE_SUBCATALOGS, False)):
+        if self.settings.expose_subcatalogs:
             catalog_src = self._get_source_catalog(dataset_ref)
             if catalog_src is not None:
                 src_data = self._extract_catalog_dict(catalog_src)
@@ -836,10 +1055,8 @@ class EuropeanDCATAPProfile(RDFProfile):
                     resource_dict[key] = json.dumps(values)
 
             # Format and media type
-            normalize_ckan_format = config.get(
-                'ckanext.dcat.normalize_ckan_format', True)
-            imt, label = self._distribution_format(distribution,
-                                                   normalize_ckan_format)
+            imt, label = self._distribution_format(
+                distribution, self.settings.normalize_ckan_format)
 
             if imt:
                 resource_dict['mimetype'] = imt
@@ -855,7 +1072,7 @@ class EuropeanDCATAPProfile(RDFProfile):
                 resource_dict['size'] = size
 
             # Checksum
-            for checksum in self.g.objects(distribution, SPDX.checksum):
+            for checksum in self._objects(distribution, SPDX.checksum):
                 algorithm = self._object_value(checksum, SPDX.algorithm)
                 checksum_value = self._object_value(checksum, SPDX.checksumValue)
                 if algorithm:
@@ -953,16 +1170,24 @@ class EuropeanDCATAPProfile(RDFProfile):
             else:
                 contact_details = BNode()
 
-            g.add((contact_details, RDF.type, VCARD.Organization))
             g.add((dataset_ref, DCAT.contactPoint, contact_details))
 
-            items = [
-                ('contact_name', VCARD.fn, ['maintainer', 'author'], Literal),
-                ('contact_email', VCARD.hasEmail, ['maintainer_email',
-                                                   'author_email'], Literal),
-            ]
+            contact_key = contact_uri and self._dict_values(
+                dataset_dict, ['contact_uri', 'contact_name', 'contact_email',
+                               'maintainer', 'maintainer_email',
+                               'author', 'author_email'])
+            if not self._emitted_node('contact', contact_key):
+                g.add((contact_details, RDF.type, VCARD.Organization))
 
-            self._add_triples_from_dict(dataset_dict, contact_details, items)
+                items = [
+                    ('contact_name', VCARD.fn, ['maintainer', 'author'], Literal),
+                    ('contact_email', VCARD.hasEmail, ['maintainer_email',
+                                                       'author_email'], Literal),
+                ]
+
+                self._add_triples_from_dict(dataset_dict, contact_details, items)
+                if contact_key:
+                    self._emit_node('contact', contact_key, contact_details)
 
         # Publisher
         if any([
@@ -971,32 +1196,41 @@ class EuropeanDCATAPProfile(RDFProfile):
             dataset_dict.get('organization'),
         ]):
 
-            publisher_uri = publisher_uri_from_dataset_dict(dataset_dict)
+            publisher_uri = publisher_uri_from_dataset_dict(
+                dataset_dict, self._extras(dataset_dict))
             if publisher_uri:
                 publisher_details = URIRef(publisher_uri)
             else:
                 # No organization nor publisher_uri
                 publisher_details = BNode()
 
-            g.add((publisher_details, RDF.type, FOAF.Organization))
             g.add((dataset_ref, DCT.publisher, publisher_details))
 
             publisher_name = self._get_dataset_value(dataset_dict, 'publisher_name')
             if not publisher_name and dataset_dict.get('organization'):
                 publisher_name = dataset_dict['organization']['title']
 
-            g.add((publisher_details, FOAF.name, Literal(publisher_name)))
-            # TODO: It would make sense to fallback these to organization
-            # fields but they are not in the default schema and the
-            # `organization` object in the dataset_dict does not include
-            # custom fields
-            items = [
-                ('publisher_email', FOAF.mbox, None, Literal),
-                ('publisher_url', FOAF.homepage, None, URIRef),
-                ('publisher_type', DCT.type, None, Literal),
-            ]
-
-            self._add_triples_from_dict(dataset_dict, publisher_details, items)
+            publisher_key = publisher_uri and (
+                (publisher_uri, publisher_name) + self._dict_values(
+                    dataset_dict, ['publisher_email', 'publisher_url',
+                                   'publisher_type']))
+            if not self._emitted_node('publisher', publisher_key):
+                g.add((publisher_details, RDF.type, FOAF.Organization))
+                g.add((publisher_details, FOAF.name, Literal(publisher_name)))
+                # TODO: It would make sense to fallback these to organization
+                # fields but they are not in the default schema and the
+                # `organization` object in the dataset_dict does not include
+                # custom fields
+                items = [
+                    ('publisher_email', FOAF.mbox, None, Literal),
+                    ('publisher_url', FOAF.homepage, None, URIRef),
+                    ('publisher_type', DCT.type, None, Literal),
+                ]
+
+                self._add_triples_from_dict(dataset_dict, publisher_details, items)
+                if publisher_key:
+                    self._emit_node('publisher', publisher_key,
+                                    publisher_details)
 
         # Temporal
         start = self._get_dataset_value(dataset_dict, 'temporal_start')
@@ -1022,26 +1256,32 @@ class EuropeanDCATAPProfile(RDFProfile):
             else:
                 spatial_ref = BNode()
 
-            g.add((spatial_ref, RDF.type, DCT.Location))
             g.add((dataset_ref, DCT.spatial, spatial_ref))
 
-            if spatial_text:
-                g.add((spatial_ref, SKOS.prefLabel, Literal(spatial_text)))
+            spatial_key = spatial_uri and (spatial_uri, spatial_text,
+                                           spatial_geom)
+            if not self._emitted_node('spatial', spatial_key):
+                g.add((spatial_ref, RDF.type, DCT.Location))
 
-            if spatial_geom:
-                # GeoJSON
-                g.add((spatial_ref,
-                       LOCN.geometry,
-                       Literal(spatial_geom, datatype=GEOJSON_IMT)))
-                # WKT, because GeoDCAT-AP says so
-                try:
+                if spatial_text:
+                    g.add((spatial_ref, SKOS.prefLabel, Literal(spatial_text)))
+
+                if spatial_geom:
+                    # GeoJSON
                     g.add((spatial_ref,
                            LOCN.geometry,
-                           Literal(wkt.dumps(json.loads(spatial_geom),
-                                             decimals=4),
-                                   datatype=GSP.wktLiteral)))
-                except (TypeError, ValueError, InvalidGeoJSONException):
-                    pass
+                           Literal(spatial_geom, datatype=GEOJSON_IMT)))
+                    # WKT, because GeoDCAT-AP says so
+                    try:
+                        g.add((spatial_ref,
+                               LOCN.geometry,
+                               Literal(wkt.dumps(json.loads(spatial_geom),
+                                                 decimals=4),
+                                       datatype=GSP.wktLiteral)))
+                    except (TypeError, ValueError, InvalidGeoJSONException):
+                        pass
+                if spatial_key:
+                    self._emit_node('spatial', spatial_key, spatial_ref)
 
         # Resources
         for resource_dict in dataset_dict.get('resources', []):
@@ -1132,6 +1372,28 @@ class EuropeanDCATAPProfile(RDFProfile):
         for prefix, namespace in namespaces.iteritems():
             g.bind(prefix, namespace)
 
+        # The triples for the default catalog only change when the config
+        # does or when datasets are modified, so they are cached
+        cache = catalog_cache()
+        key = (type(self), 'graph_from_catalog', catalog_ref)
+        triples = None if catalog_dict else cache.get(key)
+        if triples is None:
+            self.g = rdflib.Graph()
+            try:
+                self._catalog_graph(catalog_dict, catalog_ref)
+                triples = list(self.g)
+            finally:
+                self.g = g
+            if not catalog_dict:
+                cache.set(key, triples)
+
+        for triple in triples:
+            g.add(triple)
+
+    def _catalog_graph(self, catalog_dict, catalog_ref):
+
+        g = self.g
+
         g.add((catalog_ref, RDF.type, DCAT.Catalog))
 
         # Basic fields
@@ -1202,18 +1464,15 @@ class SchemaOrgProfile(RDFProfile):
         '''
         Adds a new triple with a date object
 
-        Dates are parsed using dateutil, and if the date obtained is correct,
-        added to the graph as an SCHEMA.DateTime value.
+        Dates are parsed using `isoformat_date`, and if the date obtained is
+        correct, added to the graph as an SCHEMA.DateTime value.
 
         If there are parsing errors, the literal string value is added.
         '''
         if not value:
             return
         try:
-            default_datetime = datetime.datetime(1, 1, 1, 0, 0, 0)
-            _date = parse_date(value, default=default_datetime)
-
-            self.g.add((subject, predicate, _type(_date.isoformat())))
+            self.g.add((subject, predicate, _type(isoformat_date(value))))
         except ValueError:
             self.g.add((subject, predicate, _type(value)))
 
@@ -1256,20 +1515,35 @@ class SchemaOrgProfile(RDFProfile):
             dataset_dict.get('organization'),
         ]):
 
-            publisher_uri = publisher_uri_from_dataset_dict(dataset_dict)
+            publisher_uri = publisher_uri_from_dataset_dict(
+                dataset_dict, self._extras(dataset_dict))
             if publisher_uri:
                 publisher_details = URIRef(publisher_uri)
             else:
                 # No organization nor publisher_uri
                 publisher_details = BNode()
 
-            self.g.add((publisher_details, RDF.type, SCHEMA.Organization))
             self.g.add((dataset_ref, SCHEMA.publisher, publisher_details))
 
 
             publisher_name = self._get_dataset_value(dataset_dict, 'publisher_name')
             if not publisher_name and dataset_dict.get('organization'):
                 publisher_name = dataset_dict['organization']['title']
+
+            publisher_url = self._get_dataset_value(dataset_dict, 'publisher_url')
+            if not publisher_url and dataset_dict.get('organization'):
+                publisher_url = dataset_dict['organization'].get('url') or config.get('ckan.site_url')
+
+            # Datasets of the same publisher share its contact point
+            publisher_key = publisher_uri and (
+                (publisher_uri, publisher_name, publisher_url) +
+                self._dict_values(dataset_dict, [
+                    'publisher_email', 'contact_email', 'maintainer_email',
+                    'author_email', 'contact_name', 'maintainer', 'author']))
+            if self._emitted_node('publisher', publisher_key):
+                return
+
+            self.g.add((publisher_details, RDF.type, SCHEMA.Organization))
             self.g.add((publisher_details, SCHEMA.name, Literal(publisher_name)))
 
             contact_point = BNode()
@@ -1278,10 +1552,6 @@ class SchemaOrgProfile(RDFProfile):
 
             self.g.add((contact_point, SCHEMA.contactType, Literal('customer service')))
 
-            publisher_url = self._get_dataset_value(dataset_dict, 'publisher_url')
-            if not publisher_url and dataset_dict.get('organization'):
-                publisher_url = dataset_dict['organization'].get('url') or config.get('ckan.site_url')
-
             self.g.add((contact_point, SCHEMA.url, Literal(publisher_url)))
             items = [
                 ('publisher_email', SCHEMA.email, ['contact_email', 'maintainer_email', 'author_email'], Literal),
@@ -1289,6 +1559,8 @@ class SchemaOrgProfile(RDFProfile):
             ]
 
             self._add_triples_from_dict(dataset_dict, contact_point, items)
+            if publisher_key:
+                self._emit_node('publisher', publisher_key, contact_point)
 
     def _temporal_graph(self, dataset_ref, dataset_dict):
         start = self._get_dataset_value(dataset_dict, 'temporal_start')
@@ -1312,9 +1584,17 @@ class SchemaOrgProfile(RDFProfile):
             else:
                 spatial_ref = BNode()
 
-            self.g.add((spatial_ref, RDF.type, SCHEMA.Place))
             self.g.add((dataset_ref, SCHEMA.spatialCoverage, spatial_ref))
 
+            spatial_key = spatial_uri and (spatial_uri, spatial_text,
+                                           spatial_geom)
+            if self._emitted_node('spatial', spatial_key):
+                return
+            if spatial_key:
+                self._emit_node('spatial', spatial_key, spatial_ref)
+
+            self.g.add((spatial_ref, RDF.type, SCHEMA.Place))
+
             if spatial_text:
                 self.g.add((spatial_ref, SCHEMA.description, Literal(spatial_text)))
 
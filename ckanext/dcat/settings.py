@@ -0,0 +1,155 @@
+'''
+Settings of the extension
+
+The `ckanext.dcat.*` config options used while processing requests and
+harvesting are parsed once into a `DCATSettings` object (see
+`dcat_settings()`), instead of reading and converting them from the config
+every time they are needed.
+'''
+from collections import namedtuple
+
+from ckantoolkit import config
+from ckan.plugins import toolkit
+
+from ckanext.dcat.utils import (DCAT_EXPOSE_SUBCATALOGS, DCAT_CLEAN_TAGS,
+                                DCAT_STREAM_CATALOG)
+
+
+RDF_PROFILES_CONFIG_OPTION = 'ckanext.dcat.rdf.profiles'
+COMPAT_MODE_CONFIG_OPTION = 'ckanext.dcat.compatibility_mode'
+NORMALIZE_CKAN_FORMAT_CONFIG = 'ckanext.dcat.normalize_ckan_format'
+DATASETS_PER_PAGE_CONFIG = 'ckanext.dcat.datasets_per_page'
+CUSTOM_ENDPOINT_CONFIG = 'ckanext.dcat.catalog_endpoint'
+JSON_ENDPOINT_CONFIG = 'ckanext.dcat.json_endpoint'
+ENABLE_RDF_ENDPOINTS_CONFIG = 'ckanext.dcat.enable_rdf_endpoints'
+ENABLE_CONTENT_NEGOTIATION_CONFIG = 'ckanext.dcat.enable_content_negotiation'
+TRANSLATE_KEYS_CONFIG = 'ckanext.dcat.translate_keys'
+
+DEFAULT_RDF_PROFILES = ['euro_dcat_ap']
+DEFAULT_CATALOG_ENDPOINT = '/catalog.{_format}'
+DEFAULT_JSON_ENDPOINT = '/dcat.json'
+DATASETS_PER_PAGE = 100
+
+
+class DCATSettingsError(Exception):
+    pass
+
+
+_FIELDS = (
+    'profiles',
+    'compatibility_mode',
+    'expose_subcatalogs',
+    'clean_tags',
+    'normalize_ckan_format',
+    'datasets_per_page',
+    'stream_catalog',
+    'catalog_endpoint',
+    'json_endpoint',
+    'enable_rdf_endpoints',
+    'enable_content_negotiation',
+    'translate_keys',
+)
+
+
+class DCATSettings(namedtuple('DCATSettings', _FIELDS)):
+    '''
+    Parsed values of the config options of the extension
+
+    Instances are immutable. Use `DCATSettings.from_config()` to create one
+    from the current config, or `dcat_settings()` to get the one shared by
+    the whole process.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, _config=None):
+        '''
+        Creates an instance from the provided config object (by default the
+        CKAN one)
+
+        Raises `DCATSettingsError` if an option has an invalid value.
+        '''
+        if _config is None:
+            _config = config
+
+        def _bool(key, default):
+            try:
+                return toolkit.asbool(_config.get(key, default))
+            except ValueError:
+                raise DCATSettingsError(
+                    '"{0}" should be a boolean, got "{1}"'.format(
+                        key, _config.get(key)))
+
+        profiles = _config.get(RDF_PROFILES_CONFIG_OPTION, None)
+        if profiles:
+            profiles = tuple(profiles.split(' '))
+        else:
+            profiles = tuple(DEFAULT_RDF_PROFILES)
+
+        try:
+            datasets_per_page = int(_config.get(DATASETS_PER_PAGE_CONFIG,
+                                                DATASETS_PER_PAGE))
+        except ValueError:
+            datasets_per_page = 0
+        if datasets_per_page < 1:
+            raise DCATSettingsError(
+                '"{0}" should be a positive integer, got "{1}"'.format(
+                    DATASETS_PER_PAGE_CONFIG,
+                    _config.get(DATASETS_PER_PAGE_CONFIG)))
+
+        catalog_endpoint = (_config.get(CUSTOM_ENDPOINT_CONFIG) or
+                            DEFAULT_CATALOG_ENDPOINT)
+        if not catalog_endpoint[:1] == '/':
+            raise DCATSettingsError(
+                '"{0}" should start with a backslash (/)'.format(
+                    CUSTOM_ENDPOINT_CONFIG))
+        if '{_format}' not in catalog_endpoint:
+            raise DCATSettingsError(
+                '"{0}" should contain {{_format}}'.format(
+                    CUSTOM_ENDPOINT_CONFIG))
+
+        return cls(
+            profiles=profiles,
+            compatibility_mode=_bool(COMPAT_MODE_CONFIG_OPTION, False),
+            expose_subcatalogs=_bool(DCAT_EXPOSE_SUBCATALOGS, False),
+            clean_tags=_bool(DCAT_CLEAN_TAGS, False),
+            normalize_ckan_format=_bool(NORMALIZE_CKAN_FORMAT_CONFIG, True),
+            datasets_per_page=datasets_per_page,
+            stream_catalog=_bool(DCAT_STREAM_CATALOG, False),
+            catalog_endpoint=catalog_endpoint,
+            json_endpoint=_config.get(JSON_ENDPOINT_CONFIG,
+                                      DEFAULT_JSON_ENDPOINT),
+            enable_rdf_endpoints=_bool(ENABLE_RDF_ENDPOINTS_CONFIG, True),
+            enable_content_negotiation=_bool(
+                ENABLE_CONTENT_NEGOTIATION_CONFIG, False),
+            translate_keys=_bool(TRANSLATE_KEYS_CONFIG, True),
+        )
+
+
+_settings = None
+
+
+def dcat_settings():
+    '''
+    Returns the `DCATSettings` shared by the whole process
+
+    They are parsed on startup by the `dcat` plugin (or on first use).
+    Changes to the config after that are not taken into account until
+    `reload_dcat_settings()` is called.
+    '''
+    global _settings
+    if _settings is None:
+        _settings = DCATSettings.from_config()
+    return _settings
+
+
+def reload_dcat_settings():
+    '''
+    Parses the settings again from the current config (eg after changing it
+    on tests)
+
+    Returns the new settings.
+    '''
+    global _settings
+    _settings = DCATSettings.from_config()
+    return _settings
@@ -0,0 +1,481 @@
+'''
+Streaming parsing of large RDF documents
+
+Instead of loading a whole document into a single graph, its triples are
+read in document order and grouped into one small graph per DCAT dataset,
+which can be passed to the profiles as if it was the whole document. See
+`DatasetSubgraphs`.
+'''
+import codecs
+import logging
+import xml.sax.xmlreader
+from cStringIO import StringIO
+from collections import defaultdict, OrderedDict
+
+import rdflib
+from rdflib import BNode, Literal
+from rdflib.namespace import Namespace, RDF
+from rdflib.plugins.parsers.ntriples import NTriplesParser, ParseError
+from rdflib.plugins.parsers.nquads import NQuadsParser
+from rdflib.plugins.parsers.rdfxml import create_parser
+
+from ckanext.dcat.profiles import DCAT, DCT, FOAF
+
+
+log = logging.getLogger(__name__)
+
+HYDRA = Namespace('http://www.w3.org/ns/hydra/core#')
+
+# rdflib format names of the serializations that can be read in a stream
+STREAMING_PARSER_FORMATS = ('nt', 'nquads', 'xml')
+
+# Media types of those serializations (the harvesters pass the Content-Type
+# of the remote document as format), and their rdflib format names
+STREAMING_PARSER_MEDIA_TYPES = {
+    'application/rdf+xml': 'xml',
+    'application/n-triples': 'nt',
+    'application/n-quads': 'nquads',
+}
+
+# Size of the chunks fed to the RDF/XML parser
+XML_CHUNK_SIZE = 1024 * 64
+
+
+class _TripleSink(object):
+    '''
+    Collects the triples produced by the rdflib parsers
+
+    It implements the parts of the graph API used by the N-Triples, N-Quads
+    and RDF/XML parsers. The graph of each quad is ignored.
+    '''
+
+    def __init__(self):
+        self.triples = []
+
+    def triple(self, s, p, o):
+        self.triples.append((s, p, o))
+
+    def add(self, triple):
+        self.triples.append(triple)
+
+    def get_context(self, identifier):
+        return self
+
+    def bind(self, prefix, namespace, override=True):
+        pass
+
+    def flush(self):
+        triples, self.triples = self.triples, []
+        return triples
+
+
+def iter_triples(data, _format):
+    '''
+    Generator that returns the triples of an RDF serialization in document
+    order
+
+    Only the triples of the line (or chunk of RDF/XML) being parsed are kept
+    in memory. `_format` must be one of `STREAMING_PARSER_FORMATS`.
+    '''
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+
+    sink = _TripleSink()
+
+    if _format == 'xml':
+        parser = create_parser(xml.sax.xmlreader.InputSource(), sink)
+        # The SAX reader provides the current position in the document
+        parser.getContentHandler().setDocumentLocator(parser)
+        # At least one chunk is fed, so empty documents are reported
+        for start in xrange(0, len(data) or 1, XML_CHUNK_SIZE):
+            parser.feed(data[start:start + XML_CHUNK_SIZE])
+            for triple in sink.flush():
+                yield triple
+        parser.close()
+    elif _format in ('nt', 'nquads'):
+        parser_class = NQuadsParser if _format == 'nquads' else NTriplesParser
+        parser = parser_class(sink)
+        parser.sink = sink
+        # Blank node labels are local to each document
+        parser._bnode_ids = {}
+        parser.file = codecs.getreader('utf-8')(StringIO(data))
+        parser.buffer = ''
+        while True:
+            line = parser.line = parser.readline()
+            if line is None:
+                break
+            try:
+                parser.parseline()
+            except ParseError, e:
+                raise ParseError('Invalid line ({0}): {1!r}'.format(e, line))
+            for triple in sink.flush():
+                yield triple
+    else:
+        raise ValueError(
+            'Format not supported for streaming: {0}'.format(_format))
+
+    for triple in sink.flush():
+        yield triple
+
+
+class _NodeKeys(object):
+    '''
+    Returns keys that identify nodes across different parses of a document
+
+    The parsers create new blank nodes every time a document is parsed, so
+    blank nodes are identified by the order in which they first appear.
+    Other nodes are their own key.
+    '''
+
+    def __init__(self):
+        self.bnodes = {}
+
+    def __call__(self, node):
+        if isinstance(node, BNode):
+            key = self.bnodes.get(node)
+            if key is None:
+                key = self.bnodes[node] = len(self.bnodes)
+            return key
+        return node
+
+
+def _is_bnode_key(node):
+    return isinstance(node, (int, long))
+
+
+def _reachable(starts, links, counts, exclude, blank_only=False):
+    '''
+    Returns the nodes that can be reached from the `starts` ones following
+    `links`, without going through the ones in any of the `exclude` sets
+
+    Nodes without triples of their own are ignored, and so are nodes other
+    than blank nodes if `blank_only` is True.
+    '''
+    seen = set(starts)
+    stack = list(starts)
+    while stack:
+        for node in links.get(stack.pop(), ()):
+            if (node not in seen and node in counts and
+                    (not blank_only or _is_bnode_key(node)) and
+                    not any(node in nodes for nodes in exclude)):
+                seen.add(node)
+                stack.append(node)
+    return seen
+
+
+class DatasetSubgraphs(object):
+    '''
+    Splits an RDF document into one graph per DCAT dataset
+
+    The document is parsed twice, and a graph with all its triples is never
+    built.
+
+    The first pass, done on creation, records the structure of the
+    document: which nodes are datasets and catalogs, the links between
+    nodes and the number of triples of each subject. Nodes that can be
+    reached from a dataset (its distributions, publisher, contact point,
+    etc) without going through another dataset or a catalog belong to that
+    dataset. So do its catalog record (linked to it with
+    `foaf:primaryTopic`) and the subcatalog that lists it, along with the
+    triples linking the root catalogs to them. The context shared by all
+    datasets is limited to the triples of the root catalogs (other than the
+    ones linking them to the nodes of the datasets) and of the blank nodes
+    they describe, so it does not grow with the number of datasets. Triples
+    about any other node are ignored.
+
+    Iterating over the object reads the context first, up to its last
+    triple, and then parses the document again, sending each triple to the
+    graph of the dataset it belongs to. Once all the triples of a dataset
+    have been read, its graph is returned along with the dataset node, with
+    the context triples added. Nodes that belong to more than one dataset
+    (eg a publisher shared by all of them) are kept until the graphs of all
+    of them have been returned (see `_count_distinct`).
+
+    Datasets are returned in the order in which they are completed. If the
+    triples read for a dataset never reach the expected number, it is
+    returned with the ones read once the whole document has been parsed,
+    and a warning is logged. If the catalog description is at the end of
+    the document, reading the context takes another pass.
+
+    The document itself is kept in memory, as it is parsed several times,
+    and so is the structure recorded on the first pass, which has a few
+    entries for each node of the document. What is saved is the graph: the
+    only triples kept are the ones of the datasets not returned yet, which
+    as long as the triples of each dataset are close to each other (as in
+    documents serialized one dataset at a time) are the ones of a few
+    datasets, rather than all the triples of the document.
+
+    The URL of the next page, if the document is a page of a paginated
+    catalog, is available as `next_page`.
+    '''
+
+    def __init__(self, data, _format):
+        self.data = data
+        self.format = _format
+        self._scan()
+
+    def _scan(self):
+        key = _NodeKeys()
+        interned = {}
+
+        counts = defaultdict(int)
+        last = {}
+        links = defaultdict(list)
+        catalog_links = defaultdict(list)
+        topics = defaultdict(list)
+        parts = defaultdict(list)
+        datasets, catalogs, paged = set(), set(), set()
+        next_pages = {}
+
+        for index, (s, p, o) in enumerate(
+                iter_triples(self.data, self.format)):
+            s, o = key(s), key(o)
+            s = interned.setdefault(s, s)
+            counts[s] += 1
+            last[s] = index
+
+            if p == RDF.type:
+                if o == DCAT.Dataset:
+                    datasets.add(s)
+                elif o == DCAT.Catalog:
+                    catalogs.add(s)
+                elif o == HYDRA.PagedCollection:
+                    paged.add(s)
+            elif p == HYDRA.nextPage:
+                next_pages.setdefault(s, o)
+            elif not isinstance(o, Literal):
+                o = interned.setdefault(o, o)
+                if p == DCAT.dataset:
+                    catalog_links[o].append(s)
+                else:
+                    links[s].append(o)
+                    if p == FOAF.primaryTopic:
+                        topics[s].append(o)
+                    elif p == DCT.hasPart:
+                        parts[s].append(o)
+
+        self.next_page = None
+        for s, o in next_pages.iteritems():
+            if s in paged:
+                self.next_page = unicode(o)
+                break
+
+        subcatalogs = set(o for s, objects in parts.iteritems()
+                          if s in catalogs for o in objects if o in catalogs)
+        roots = catalogs - subcatalogs
+
+        # Catalog records and subcatalogs belong to the datasets they
+        # describe or list
+        attached = defaultdict(list)
+        for s, objects in topics.iteritems():
+            if s not in catalogs and s not in datasets:
+                for o in objects:
+                    if o in datasets:
+                        attached[o].append(s)
+
+        # Triples linking a catalog to its datasets belong to the dataset
+        expected = defaultdict(int)
+        routed = defaultdict(int)
+        for o, subjects in catalog_links.iteritems():
+            for s in subjects:
+                if s in catalogs and o in datasets:
+                    expected[o] += 1
+                    routed[s] += 1
+                    if s in subcatalogs:
+                        attached[o].append(s)
+                else:
+                    links[s].append(o)
+
+        attached_nodes = set(node for nodes in attached.itervalues()
+                             for node in nodes)
+        context = _reachable(roots, links, counts,
+                             [datasets, attached_nodes], blank_only=True)
+
+        owner = {}
+        shared = {}
+        for dataset in datasets:
+            for node in _reachable([dataset] + attached.get(dataset, []),
+                                   links, counts, [datasets, context]):
+                if node in shared:
+                    shared[node].append(dataset)
+                elif node in owner:
+                    shared[node] = [owner.pop(node), dataset]
+                else:
+                    owner[node] = dataset
+
+        for node, dataset in owner.iteritems():
+            expected[dataset] += counts[node] - routed[node]
+
+        # Triples linking the context to the nodes of a dataset
+        for node in context:
+            for o in links.get(node, ()):
+                if o in owner:
+                    expected[owner[o]] += 1
+
+        shared_nodes = defaultdict(list)
+        for node, owners in shared.iteritems():
+            for dataset in owners:
+                shared_nodes[dataset].append(node)
+
+        self._datasets = datasets
+        self._catalogs = catalogs
+        self._context = context
+        self._context_end = max([last[node] for node in context] or [-1])
+        self._owner = owner
+        self._shared = shared
+        self._shared_expected = self._count_distinct(shared)
+        self._shared_nodes = shared_nodes
+        self._expected = expected
+
+    def _route(self, s, p, o):
+        '''
+        Returns the node a triple is stored with, and a key that identifies
+        the triple among the ones of that node, or None if the triple does
+        not belong to any node of a dataset
+
+        That node is the subject of the triple, except for the triples
+        linking the context (eg a root catalog) to a node of a dataset,
+        which are stored with their object. `s` and `o` are node keys.
+        '''
+        if s in self._context:
+            if o in self._owner or o in self._shared:
+                return o, (s, p)
+            return None
+        return s, (p, o)
+
+    def _is_dataset_link(self, s, p, o):
+        return (p == DCAT.dataset and s in self._catalogs and
+                o in self._datasets)
+
+    def _count_distinct(self, nodes):
+        '''
+        Returns the number of distinct triples of each of the provided nodes
+
+        Nodes shared by several datasets are often described again along
+        with each one of them, so they are complete once all their distinct
+        triples have been read, rather than all of their occurrences. This
+        needs another pass over the document, only done if there are shared
+        nodes.
+        '''
+        if not nodes:
+            return {}
+        key = _NodeKeys()
+        distinct = defaultdict(set)
+        for s, p, o in iter_triples(self.data, self.format):
+            s, o = key(s), key(o)
+            if self._is_dataset_link(s, p, o):
+                continue
+            route = self._route(s, p, o)
+            if route and route[0] in nodes:
+                distinct[route[0]].add(route[1])
+        return dict((node, len(triples))
+                    for node, triples in distinct.iteritems())
+
+    def _read_context(self):
+        '''
+        Returns the context triples, and the blank nodes used in them
+        indexed by their key
+
+        The document is only parsed up to the last triple of the context.
+        '''
+        key = _NodeKeys()
+        context = []
+        bnodes = {}
+        if self._context_end < 0:
+            return context, bnodes
+        for index, (s, p, o) in enumerate(
+                iter_triples(self.data, self.format)):
+            s_key, o_key = key(s), key(o)
+            if (s_key in self._context and
+                    not self._is_dataset_link(s_key, p, o_key) and
+                    not self._route(s_key, p, o_key)):
+                context.append((s, p, o))
+                for node, node_key in ((s, s_key), (o, o_key)):
+                    if isinstance(node, BNode):
+                        bnodes[node_key] = node
+            if index == self._context_end:
+                break
+        return context, bnodes
+
+    def __iter__(self):
+        context, context_bnodes = self._read_context()
+
+        key = _NodeKeys()
+
+        refs = OrderedDict()
+        triples = defaultdict(list)
+        received = defaultdict(int)
+        pending_shared = dict((dataset, len(nodes)) for dataset, nodes
+                              in self._shared_nodes.iteritems())
+        shared_triples = defaultdict(dict)
+        shared_done = set()
+        shared_refcount = dict((node, len(owners)) for node, owners
+                               in self._shared.iteritems())
+        completed = []
+        returned = set()
+
+        def _graph(dataset):
+            graph = rdflib.Graph()
+            for t in triples.pop(dataset, ()):
+                graph.add(t)
+            for t in context:
+                graph.add(t)
+            for node in self._shared_nodes.get(dataset, ()):
+                for t in shared_triples.get(node, {}).itervalues():
+                    graph.add(t)
+                shared_refcount[node] -= 1
+                if not shared_refcount[node]:
+                    shared_triples.pop(node, None)
+            return graph
+
+        def _check(dataset):
+            if (received[dataset] == self._expected[dataset] and
+                    not pending_shared.get(dataset)):
+                completed.append(dataset)
+
+        for triple in iter_triples(self.data, self.format):
+            s, p, o = triple
+            s_key, o_key = key(s), key(o)
+
+            if s_key in self._datasets and s_key not in returned:
+                refs[s_key] = s
+
+            # Blank nodes of the context are the ones of its triples
+            if s_key in context_bnodes or o_key in context_bnodes:
+                triple = (context_bnodes.get(s_key, s), p,
+                          context_bnodes.get(o_key, o))
+
+            if self._is_dataset_link(s_key, p, o_key):
+                triples[o_key].append(triple)
+                received[o_key] += 1
+                _check(o_key)
+            else:
+                route = self._route(s_key, p, o_key)
+                if route is None:
+                    continue
+                node, triple_key = route
+                if node in self._owner:
+                    dataset = self._owner[node]
+                    triples[dataset].append(triple)
+                    received[dataset] += 1
+                    _check(dataset)
+                elif node in self._shared and node not in shared_done:
+                    node_triples = shared_triples[node]
+                    node_triples[triple_key] = triple
+                    if len(node_triples) == self._shared_expected[node]:
+                        shared_done.add(node)
+                        for dataset in self._shared[node]:
+                            pending_shared[dataset] -= 1
+                            _check(dataset)
+
+            for dataset in completed:
+                returned.add(dataset)
+                yield refs.pop(dataset), _graph(dataset)
+            del completed[:]
+
+        if refs:
+            log.warning('Triples missing for %s datasets at the end of the '
+                        'document, returning the ones read: %s', len(refs),
+                        ', '.join(unicode(ref) for ref in refs.itervalues()))
+        for dataset, ref in refs.items():
+            yield ref, _graph(dataset)
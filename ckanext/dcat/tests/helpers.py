@@ -0,0 +1,28 @@
+import functools
+
+from ckantoolkit.tests import helpers
+
+from ckanext.dcat.settings import reload_dcat_settings
+
+
+def change_config(key, value):
+    '''
+    Same as `ckantoolkit.tests.helpers.change_config`, but the DCAT settings
+    are parsed again with the changed config, and once it is restored
+    '''
+    def decorator(func):
+
+        @helpers.change_config(key, value)
+        def reload_and_call(*args, **kwargs):
+            reload_dcat_settings()
+            return func(*args, **kwargs)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return reload_and_call(*args, **kwargs)
+            finally:
+                reload_dcat_settings()
+
+        return wrapper
+    return decorator
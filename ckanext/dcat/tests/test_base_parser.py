@@ -1,22 +1,27 @@
 import nose
 
+from mock import patch
+
 from ckantoolkit import config
 
-from rdflib import Graph, URIRef, Literal
+from rdflib import Graph, URIRef, BNode, Literal
 from rdflib.namespace import Namespace, RDF
 
 from ckanext.dcat.processors import (
     RDFParser,
     RDFParserException,
     RDFProfileException,
-    DEFAULT_RDF_PROFILES,
-    RDF_PROFILES_CONFIG_OPTION
 )
 
 from ckanext.dcat.profiles import RDFProfile
+from ckanext.dcat.streaming import DatasetSubgraphs
+from ckanext.dcat.settings import (reload_dcat_settings,
+                                   DEFAULT_RDF_PROFILES,
+                                   RDF_PROFILES_CONFIG_OPTION)
 
 DCT = Namespace("http://purl.org/dc/terms/")
 DCAT = Namespace("http://www.w3.org/ns/dcat#")
+FOAF = Namespace("http://xmlns.com/foaf/0.1/")
 
 eq_ = nose.tools.eq_
 
@@ -70,6 +75,87 @@ class MockRDFProfile2(RDFProfile):
         return dataset_dict
 
 
+class MockRDFProfileInstances(RDFProfile):
+
+    instances = []
+    resets = 0
+
+    def __init__(self, *args, **kwargs):
+        super(MockRDFProfileInstances, self).__init__(*args, **kwargs)
+        MockRDFProfileInstances.instances.append(self)
+
+    def reset_dataset_state(self):
+        MockRDFProfileInstances.resets += 1
+
+    def parse_dataset(self, dataset_dict, dataset_ref):
+
+        dataset_dict['graph'] = self.g
+
+        return dataset_dict
+
+
+class MockRDFProfileSubjects(RDFProfile):
+
+    def parse_dataset(self, dataset_dict, dataset_ref):
+
+        dataset_dict['uri'] = unicode(dataset_ref)
+        dataset_dict['subjects'] = sorted(
+            unicode(s) for s in set(self.g.subjects())
+            if isinstance(s, URIRef))
+        dataset_dict['bnodes'] = len(
+            [s for s in set(self.g.subjects()) if isinstance(s, BNode)])
+
+        return dataset_dict
+
+
+_streaming_nt = '''
+<http://example.org/catalog> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Catalog> .
+<http://example.org/catalog> <http://purl.org/dc/terms/title> "Catalog" .
+<http://example.org/catalog> <http://purl.org/dc/terms/publisher> <http://example.org/org/catalog> .
+<http://example.org/org/catalog> <http://xmlns.com/foaf/0.1/name> "Catalog publisher" .
+<http://example.org/catalog> <http://www.w3.org/ns/dcat#dataset> <http://example.org/datasets/1> .
+<http://example.org/catalog> <http://www.w3.org/ns/dcat#dataset> <http://example.org/datasets/2> .
+<http://example.org/datasets/1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://example.org/datasets/1> <http://purl.org/dc/terms/title> "Dataset 1" .
+<http://example.org/datasets/1> <http://purl.org/dc/terms/publisher> <http://example.org/org/1> .
+<http://example.org/datasets/1> <http://www.w3.org/ns/dcat#contactPoint> _:contact1 .
+_:contact1 <http://www.w3.org/2006/vcard/ns#fn> "Contact 1" .
+<http://example.org/datasets/1> <http://www.w3.org/ns/dcat#distribution> <http://example.org/datasets/1/ds/1> .
+<http://example.org/datasets/1/ds/1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Distribution> .
+<http://example.org/datasets/1/ds/1> <http://purl.org/dc/terms/title> "Distribution 1" .
+<http://example.org/datasets/2> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://example.org/datasets/2> <http://purl.org/dc/terms/title> "Dataset 2" .
+<http://example.org/datasets/2> <http://purl.org/dc/terms/publisher> <http://example.org/org/1> .
+<http://example.org/datasets/2> <http://purl.org/dc/terms/relation> <http://example.org/datasets/1> .
+<http://example.org/org/1> <http://xmlns.com/foaf/0.1/name> "Shared publisher" .
+<http://example.org/page> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/hydra/core#PagedCollection> .
+<http://example.org/page> <http://www.w3.org/ns/hydra/core#nextPage> "http://example.org/catalog?page=2" .
+'''
+
+# Catalog records and a subcatalog, with the catalog description at the end
+_streaming_records_nt = '''
+<http://example.org/datasets/1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://example.org/datasets/1> <http://purl.org/dc/terms/publisher> _:publisher .
+<http://example.org/records/1> <http://xmlns.com/foaf/0.1/primaryTopic> <http://example.org/datasets/1> .
+<http://example.org/records/1> <http://purl.org/dc/terms/modified> "2018-01-01" .
+<http://example.org/datasets/2> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://example.org/records/2> <http://xmlns.com/foaf/0.1/primaryTopic> <http://example.org/datasets/2> .
+<http://example.org/datasets/3> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://example.org/subcatalog> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Catalog> .
+<http://example.org/subcatalog> <http://purl.org/dc/terms/title> "Subcatalog" .
+<http://example.org/subcatalog> <http://www.w3.org/ns/dcat#dataset> <http://example.org/datasets/3> .
+<http://example.org/catalog> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Catalog> .
+<http://example.org/catalog> <http://purl.org/dc/terms/title> "Catalog" .
+<http://example.org/catalog> <http://purl.org/dc/terms/publisher> _:publisher .
+_:publisher <http://xmlns.com/foaf/0.1/name> "Publisher" .
+<http://example.org/catalog> <http://www.w3.org/ns/dcat#dataset> <http://example.org/datasets/1> .
+<http://example.org/catalog> <http://www.w3.org/ns/dcat#dataset> <http://example.org/datasets/2> .
+<http://example.org/catalog> <http://www.w3.org/ns/dcat#record> <http://example.org/records/1> .
+<http://example.org/catalog> <http://www.w3.org/ns/dcat#record> <http://example.org/records/2> .
+<http://example.org/catalog> <http://purl.org/dc/terms/hasPart> <http://example.org/subcatalog> .
+'''
+
+
 class TestRDFParser(object):
 
     def test_default_profile(self):
@@ -84,6 +170,7 @@ class TestRDFParser(object):
         original_config = config.copy()
 
         config[RDF_PROFILES_CONFIG_OPTION] = 'profile_conf_1 profile_conf_2'
+        reload_dcat_settings()
         try:
             RDFParser()
         except RDFProfileException as e:
@@ -92,6 +179,7 @@ class TestRDFParser(object):
 
         config.clear()
         config.update(original_config)
+        reload_dcat_settings()
 
     def test_no_profile_provided(self):
         try:
@@ -119,6 +207,50 @@ class TestRDFParser(object):
             assert dataset['profile_1']
             assert dataset['profile_2']
 
+    def test_profile_instances_are_reused(self):
+
+        MockRDFProfileInstances.instances = []
+        MockRDFProfileInstances.resets = 0
+
+        p = RDFParser()
+
+        p._profiles = [MockRDFProfileInstances]
+
+        p.g = _default_graph()
+
+        datasets = [d for d in p.datasets()]
+
+        eq_(len(datasets), 3)
+        eq_(len(MockRDFProfileInstances.instances), 1)
+        eq_(MockRDFProfileInstances.resets, 3)
+
+        # Instances follow the processor graph
+        p.g = _default_graph()
+
+        for dataset in p.datasets():
+            assert dataset['graph'] is p.g
+
+        eq_(len(MockRDFProfileInstances.instances), 1)
+
+    def test_datasets_subject_cache(self):
+
+        p = RDFParser()
+        p._profiles = [MockRDFProfileInstances]
+        p.g = _default_graph()
+
+        caches = []
+        for dataset in p.datasets():
+            profile = p._profile_instances[0]
+            profile._object_value(URIRef('http://example.org/datasets/1'),
+                                  DCT.title)
+            caches.append(profile._subject_cache)
+
+        # The cache is shared by all datasets and cleared at the end
+        eq_(len(caches), 3)
+        assert all(cache is caches[0] for cache in caches)
+        eq_(caches[0].keys(), [URIRef('http://example.org/datasets/1')])
+        eq_(p._profile_instances[0]._subject_cache, None)
+
     def test_parse_data(self):
 
         data = '''<?xml version="1.0" encoding="utf-8" ?>
@@ -234,6 +366,144 @@ class TestRDFParser(object):
         nose.tools.assert_raises(RDFParserException, p.parse, data,
                                  _format='n3',)
 
+    def test_parse_streaming(self):
+
+        p = RDFParser()
+        p._profiles = [MockRDFProfileSubjects]
+
+        p.parse(_streaming_nt, _format='nt', streaming=True)
+
+        # The graph is not built
+        eq_(len(p.g), 0)
+        eq_(p.next_page(), 'http://example.org/catalog?page=2')
+
+        datasets = dict((d['uri'], d) for d in p.datasets())
+
+        # Only the catalog triples are added, not the ones of its publisher
+        catalog = ['http://example.org/catalog']
+
+        eq_(sorted(datasets.keys()),
+            ['http://example.org/datasets/1', 'http://example.org/datasets/2'])
+        eq_(datasets['http://example.org/datasets/1']['subjects'],
+            sorted(catalog + ['http://example.org/datasets/1',
+                              'http://example.org/datasets/1/ds/1',
+                              'http://example.org/org/1']))
+        eq_(datasets['http://example.org/datasets/1']['bnodes'], 1)
+        eq_(datasets['http://example.org/datasets/2']['subjects'],
+            sorted(catalog + ['http://example.org/datasets/2',
+                              'http://example.org/org/1']))
+        eq_(datasets['http://example.org/datasets/2']['bnodes'], 0)
+
+    def test_parse_streaming_same_as_graph(self):
+
+        data = Graph().parse(data=_streaming_nt, format='nt').serialize(
+            format='xml')
+
+        for _format, streaming in (('nt', False), ('nt', True),
+                                   ('xml', False), ('xml', True)):
+            p = RDFParser()
+            p._profiles = [MockRDFProfile1]
+            content = _streaming_nt if _format == 'nt' else data
+            p.parse(content, _format=_format, streaming=streaming)
+
+            eq_(len([d for d in p.datasets()]), 2)
+            eq_(p.next_page(), 'http://example.org/catalog?page=2')
+
+    def test_parse_streaming_media_type(self):
+
+        p = RDFParser()
+        p._profiles = [MockRDFProfile1]
+
+        # Harvesters pass the Content-Type of the document as format
+        p.parse(_streaming_nt, _format='application/n-triples',
+                streaming=True)
+
+        eq_(len(p.g), 0)
+        eq_(len([d for d in p.datasets()]), 2)
+
+    def test_parse_streaming_catalog_records_and_subcatalogs(self):
+
+        catalog = URIRef('http://example.org/catalog')
+        subcatalog = URIRef('http://example.org/subcatalog')
+        records = [URIRef('http://example.org/records/1'),
+                   URIRef('http://example.org/records/2')]
+
+        graphs = dict((unicode(ref), graph) for ref, graph
+                      in DatasetSubgraphs(_streaming_records_nt, 'nt'))
+
+        eq_(sorted(graphs.keys()),
+            ['http://example.org/datasets/1', 'http://example.org/datasets/2',
+             'http://example.org/datasets/3'])
+
+        for graph in graphs.values():
+            eq_(unicode(graph.value(catalog, DCT.title)), 'Catalog')
+            publisher = graph.value(catalog, DCT.publisher)
+            eq_(unicode(graph.value(publisher, FOAF.name)), 'Publisher')
+
+        # Each record is only added to the graph of its dataset
+        for index, record in enumerate(records):
+            graph = graphs['http://example.org/datasets/{0}'.format(index + 1)]
+            eq_(list(graph.objects(catalog, DCAT.record)), [record])
+            eq_(len(list(graph.predicate_objects(record))), 2 - index)
+        graph = graphs['http://example.org/datasets/1']
+        eq_(graph.value(URIRef('http://example.org/datasets/1'),
+                        DCT.publisher),
+            graph.value(catalog, DCT.publisher))
+
+        # And so is the subcatalog
+        graph = graphs['http://example.org/datasets/3']
+        eq_(list(graph.objects(catalog, DCAT.record)), [])
+        eq_(list(graph.objects(catalog, DCT.hasPart)), [subcatalog])
+        eq_(unicode(graph.value(subcatalog, DCT.title)), 'Subcatalog')
+        for dataset in ('1', '2'):
+            graph = graphs['http://example.org/datasets/' + dataset]
+            eq_(list(graph.predicate_objects(subcatalog)), [])
+
+    @patch('ckanext.dcat.streaming.log')
+    def test_parse_streaming_incomplete_datasets(self, mock_log):
+
+        subgraphs = DatasetSubgraphs(_streaming_nt, 'nt')
+        # Expect a triple that is not on the document
+        subgraphs._expected[URIRef('http://example.org/datasets/1')] += 1
+
+        graphs = list(subgraphs)
+
+        eq_([unicode(ref) for ref, graph in graphs],
+            ['http://example.org/datasets/2', 'http://example.org/datasets/1'])
+        graph = graphs[1][1]
+        eq_(unicode(graph.value(URIRef('http://example.org/datasets/1'),
+                                DCT.title)), 'Dataset 1')
+        eq_(unicode(graph.value(URIRef('http://example.org/org/1'),
+                                FOAF.name)), 'Shared publisher')
+        assert mock_log.warning.called
+        assert ('http://example.org/datasets/1' in
+                mock_log.warning.call_args[0])
+
+    def test_parse_streaming_other_formats(self):
+
+        data = Graph().parse(data=_streaming_nt, format='nt').serialize(
+            format='turtle')
+
+        p = RDFParser()
+
+        p.parse(data, _format='turtle', streaming=True)
+
+        # Formats that can not be streamed are parsed into the graph
+        assert len(p.g) > 0
+
+    def test_parse_streaming_raises_on_parse_error(self):
+
+        p = RDFParser()
+
+        nose.tools.assert_raises(RDFParserException, p.parse, '',
+                                 streaming=True)
+
+        nose.tools.assert_raises(RDFParserException, p.parse, 'Wrong data',
+                                 streaming=True)
+
+        nose.tools.assert_raises(RDFParserException, p.parse, 'Wrong data',
+                                 _format='nt', streaming=True)
+
     def test__datasets(self):
 
         p = RDFParser()
@@ -1,9 +1,10 @@
 import nose
 
-from rdflib import Graph, URIRef, Literal
+from rdflib import Graph, URIRef, Literal, BNode
 from rdflib.namespace import Namespace
 
 from ckanext.dcat.profiles import RDFProfile
+from ckanext.dcat.utils import ExtrasIndex
 
 from ckanext.dcat.tests.test_base_parser import _default_graph
 
@@ -14,6 +15,7 @@ DCT = Namespace("http://purl.org/dc/terms/")
 TEST = Namespace("http://test.org/")
 DCAT = Namespace("http://www.w3.org/ns/dcat#")
 ADMS = Namespace("http://www.w3.org/ns/adms#")
+FOAF = Namespace("http://xmlns.com/foaf/0.1/")
 
 
 class TestBaseRDFProfile(object):
@@ -61,6 +63,30 @@ class TestBaseRDFProfile(object):
 
         eq_(_object, None)
 
+    def test_objects_subject_cache(self):
+
+        g = _default_graph()
+        p = RDFProfile(g)
+        p._subject_cache = {}
+
+        dataset = URIRef('http://example.org/datasets/1')
+
+        eq_(sorted(p._objects(dataset, DCAT.distribution)),
+            sorted(g.objects(dataset, DCAT.distribution)))
+        eq_(p._object_value(dataset, DCT.title), 'Test Dataset 1')
+        eq_(list(p._objects(dataset, DCT.unknown_property)), [])
+
+        # All predicates of the subject were read at once
+        eq_(p._subject_cache.keys(), [dataset])
+        eq_(len(p._subject_cache[dataset]), 3)
+
+        # Following queries don't use the graph
+        g.remove((dataset, DCT.title, None))
+        eq_(p._object_value(dataset, DCT.title), 'Test Dataset 1')
+
+        p._subject_cache = None
+        eq_(p._object_value(dataset, DCT.title), '')
+
     def test_object_value(self):
 
         p = RDFProfile(_default_graph())
@@ -301,3 +327,83 @@ class TestBaseRDFProfile(object):
 
         eq_(contact['name'], 'Point of Contact')
         eq_(contact['email'], 'mailto:contact@some.org')
+
+    def test_publisher_parse_cache(self):
+
+        data = '''
+        @prefix dct: <http://purl.org/dc/terms/> .
+        @prefix foaf: <http://xmlns.com/foaf/0.1/> .
+
+        <http://example.org/datasets/1> dct:publisher <http://orgs.vocab.org/some-org> .
+        <http://example.org/datasets/2> dct:publisher <http://orgs.vocab.org/some-org> .
+        <http://orgs.vocab.org/some-org> foaf:name "Some Org" .
+        '''
+
+        g = Graph()
+        g.parse(data=data, format='turtle')
+
+        p = RDFProfile(g)
+        p._parse_cache = {}
+
+        publisher = p._publisher(URIRef('http://example.org/datasets/1'),
+                                 DCT.publisher)
+        eq_(publisher['name'], 'Some Org')
+
+        # The publisher is not extracted again for the second dataset
+        g.remove((None, FOAF.name, None))
+        publisher['name'] = 'Modified'
+        eq_(p._publisher(URIRef('http://example.org/datasets/2'),
+                         DCT.publisher)['name'], 'Some Org')
+
+        p._parse_cache = None
+        eq_(p._publisher(URIRef('http://example.org/datasets/2'),
+                         DCT.publisher)['name'], '')
+
+    def test_entity_parse_cache_bnodes(self):
+
+        g = Graph()
+        agent = BNode()
+        g.add((URIRef('http://example.org'), DCT.publisher, agent))
+        g.add((agent, FOAF.name, Literal('Some Org')))
+
+        p = RDFProfile(g)
+        p._parse_cache = {}
+
+        eq_(p._publisher(URIRef('http://example.org'),
+                         DCT.publisher)['name'], 'Some Org')
+
+        # Blank nodes are only kept while the graph is the same
+        g2 = Graph()
+        g2.add((URIRef('http://example.org'), DCT.publisher, agent))
+        g2.add((agent, FOAF.name, Literal('Other Org')))
+        p.g = g2
+
+        eq_(p._publisher(URIRef('http://example.org'),
+                         DCT.publisher)['name'], 'Other Org')
+
+    def test_get_dict_value_extras_index(self):
+
+        dataset_dict = {
+            'title': 'Test',
+            'extras': [
+                {'key': 'dcat_version', 'value': '1.0'},
+                {'key': 'version', 'value': '2.0'},
+            ]
+        }
+        resource_dict = {
+            'extras': [{'key': 'version', 'value': '3.0'}]
+        }
+
+        p = RDFProfile(Graph())
+
+        eq_(p._get_dict_value(dataset_dict, 'version'), '1.0')
+
+        p._extras_index = ExtrasIndex(dataset_dict)
+
+        assert p._extras(dataset_dict) is p._extras_index
+        assert p._extras(resource_dict) is not p._extras_index
+
+        eq_(p._get_dict_value(dataset_dict, 'title'), 'Test')
+        eq_(p._get_dict_value(dataset_dict, 'version'), '1.0')
+        eq_(p._get_dict_value(dataset_dict, 'missing', 'x'), 'x')
+        eq_(p._get_dict_value(resource_dict, 'version'), '3.0')
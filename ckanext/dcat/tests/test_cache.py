@@ -0,0 +1,168 @@
+import nose
+
+import mock
+
+from ckanext.dcat.cache import LRUCache, ExpiringCache
+
+eq_ = nose.tools.eq_
+
+
+class TestLRUCache(object):
+
+    def test_get_set(self):
+
+        cache = LRUCache(10)
+
+        cache.set('a', 'value a')
+
+        eq_(cache.get('a'), 'value a')
+        eq_(cache.get('b'), None)
+        eq_(cache.get('b', 'default'), 'default')
+
+        stats = cache.stats()
+        eq_(stats['hits'], 1)
+        eq_(stats['misses'], 2)
+        eq_(stats['items'], 1)
+        eq_(stats['bytes'], len('value a'))
+
+    def test_disabled(self):
+
+        cache = LRUCache(0)
+
+        cache.set('a', 'value a')
+
+        assert not cache.enabled
+        eq_(cache.get('a'), None)
+        eq_(len(cache), 0)
+
+    def test_max_items_evicts_least_recently_used(self):
+
+        cache = LRUCache(2)
+
+        cache.set('a', '1')
+        cache.set('b', '2')
+
+        # Use a, so b is the least recently used
+        cache.get('a')
+
+        cache.set('c', '3')
+
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+        eq_(cache.stats()['evictions'], 1)
+
+    def test_max_bytes(self):
+
+        cache = LRUCache(10, max_bytes=10)
+
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('c', 'x' * 4)
+
+        assert 'a' not in cache
+        assert 'b' in cache
+        assert 'c' in cache
+        eq_(cache.stats()['bytes'], 8)
+
+    def test_value_bigger_than_max_bytes_not_stored(self):
+
+        cache = LRUCache(10, max_bytes=10)
+
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 11)
+
+        assert 'a' in cache
+        assert 'b' not in cache
+
+    def test_set_existing_key_replaces_value(self):
+
+        cache = LRUCache(10)
+
+        cache.set('a', 'xx')
+        cache.set('a', 'xxxx')
+
+        eq_(cache.get('a'), 'xxxx')
+        eq_(len(cache), 1)
+        eq_(cache.stats()['bytes'], 4)
+
+    def test_invalidate_group(self):
+
+        cache = LRUCache(10)
+
+        cache.set(('id1', 'xml'), 'a', group='id1')
+        cache.set(('id1', 'ttl'), 'b', group='id1')
+        cache.set(('id2', 'xml'), 'c', group='id2')
+
+        cache.invalidate('id1')
+
+        assert ('id1', 'xml') not in cache
+        assert ('id1', 'ttl') not in cache
+        assert ('id2', 'xml') in cache
+        eq_(cache.stats()['bytes'], 1)
+
+        # Unknown groups are ignored
+        cache.invalidate('id3')
+
+    def test_clear(self):
+
+        cache = LRUCache(10)
+
+        cache.set('a', 'xx', group='g')
+        cache.get('a')
+
+        cache.clear()
+
+        eq_(len(cache), 0)
+        eq_(cache.stats()['hits'], 0)
+        eq_(cache.stats()['bytes'], 0)
+
+
+class TestExpiringCache(object):
+
+    def test_get_set(self):
+
+        cache = ExpiringCache(60)
+
+        cache.set('a', 'x')
+        cache.set('b', None)
+
+        eq_(cache.get('a'), 'x')
+        eq_(cache.get('b', 'default'), None)
+        eq_(cache.get('c'), None)
+        eq_(cache.get('c', 'default'), 'default')
+
+    def test_disabled(self):
+
+        cache = ExpiringCache(0)
+
+        cache.set('a', 'x')
+
+        eq_(cache.get('a'), None)
+        eq_(len(cache), 0)
+
+    @mock.patch('ckanext.dcat.cache.time.time')
+    def test_expired(self, mock_time):
+
+        cache = ExpiringCache(60)
+
+        mock_time.return_value = 1000
+        cache.set('a', 'x')
+
+        mock_time.return_value = 1059
+        eq_(cache.get('a'), 'x')
+
+        mock_time.return_value = 1060
+        eq_(cache.get('a'), None)
+        eq_(len(cache), 0)
+
+    def test_clear(self):
+
+        cache = ExpiringCache(60)
+
+        cache.set('a', 'x')
+
+        cache.clear()
+
+        eq_(cache.get('a'), None)
+        eq_(len(cache), 0)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import time
 import nose
+import mock
 
 
 from ckan import plugins as p
@@ -15,6 +16,7 @@ from ckantoolkit.tests import helpers, factories
 from ckanext.dcat.processors import RDFParser
 from ckanext.dcat.profiles import RDF, DCAT
 from ckanext.dcat.processors import HYDRA
+from ckanext.dcat.tests.helpers import change_config
 
 eq_ = nose.tools.eq_
 assert_true = nose.tools.assert_true
@@ -204,6 +206,45 @@ class TestEndpoints(helpers.FunctionalTestBase):
         assert '"@type": "schema:Dataset"' in content
         assert '"schema:description": "%s"' % dataset['notes'] in content
 
+    def test_dataset_conditional_get(self):
+
+        dataset = factories.Dataset()
+
+        url = url_for('dcat_dataset', _id=dataset['id'], _format='ttl')
+
+        app = self._get_test_app()
+
+        response = app.get(url)
+
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        assert etag.startswith('"')
+
+        response = app.get(url, headers={'If-None-Match': etag}, status=304)
+        eq_(response.body, '')
+
+        app.get(url, headers={'If-Modified-Since': last_modified},
+                status=304)
+
+        # Different formats have different ETags
+        response = app.get(
+            url_for('dcat_dataset', _id=dataset['id'], _format='xml'),
+            headers={'If-None-Match': etag})
+        eq_(response.status_int, 200)
+        assert response.headers['ETag'] != etag
+
+        # Updating the dataset invalidates the ETag
+        time.sleep(1)
+        helpers.call_action('package_patch', id=dataset['id'],
+                            notes='Updated')
+
+        response = app.get(url, headers={'If-None-Match': etag})
+        eq_(response.status_int, 200)
+        assert response.headers['ETag'] != etag
+
+        response = app.get(url, headers={'If-Modified-Since': last_modified})
+        eq_(response.status_int, 200)
+
     def test_dataset_not_found(self):
         import uuid
 
@@ -211,7 +252,7 @@ class TestEndpoints(helpers.FunctionalTestBase):
         app = self._get_test_app()
         app.get(url, status=404)
 
-    @helpers.change_config('ckanext.dcat.enable_rdf_endpoints', False)
+    @change_config('ckanext.dcat.enable_rdf_endpoints', False)
     def test_dataset_endpoint_disabled(self):
         p.unload('dcat')
         p.load('dcat')
@@ -284,6 +325,97 @@ class TestEndpoints(helpers.FunctionalTestBase):
 
         eq_(len(dcat_datasets), 4)
 
+    @change_config('ckanext.dcat.stream_catalog', True)
+    def test_catalog_streamed(self):
+
+        for i in xrange(4):
+            factories.Dataset()
+
+        app = self._get_test_app()
+
+        # The body is read by the test app once the controller has returned
+        for _format, parse_format, content_type in (
+                ('rdf', 'xml', 'application/rdf+xml'),
+                ('xml', 'xml', 'application/rdf+xml'),
+                ('nt', 'nt', 'application/n-triples'),
+                ('ttl', 'turtle', 'text/turtle'),
+                ('n3', 'n3', 'text/n3'),
+                ('jsonld', 'json-ld', 'application/ld+json')):
+
+            url = url_for('dcat_catalog', _format=_format)
+
+            response = app.get(url)
+
+            eq_(response.headers['Content-Type'], content_type)
+
+            p = RDFParser()
+
+            p.parse(response.body, _format=parse_format)
+
+            dcat_datasets = [d for d in p.datasets()]
+
+            eq_(len(dcat_datasets), 4)
+
+    @change_config('ckanext.dcat.stream_catalog', True)
+    def test_catalog_streamed_wrong_date(self):
+
+        url = url_for('dcat_catalog',
+                      _format='ttl',
+                      modified_since='wrong_date')
+
+        app = self._get_test_app()
+
+        app.get(url, status=409)
+
+    def test_catalog_conditional_get(self):
+
+        for i in xrange(2):
+            factories.Dataset()
+
+        url = url_for('dcat_catalog', _format='ttl')
+
+        app = self._get_test_app()
+
+        response = app.get(url)
+
+        etag = response.headers['ETag']
+        assert response.headers['Last-Modified']
+
+        app.get(url, headers={'If-None-Match': etag}, status=304)
+
+        # Different query parameters have different ETags
+        response = app.get(url_for('dcat_catalog', _format='ttl', page=2),
+                           headers={'If-None-Match': etag})
+        eq_(response.status_int, 200)
+
+        # New datasets change the ETag
+        factories.Dataset()
+
+        response = app.get(url, headers={'If-None-Match': etag})
+        eq_(response.status_int, 200)
+        assert response.headers['ETag'] != etag
+
+    def test_catalog_validators_without_conditional_headers(self):
+
+        factories.Dataset()
+
+        url = url_for('dcat_catalog', _format='ttl')
+
+        app = self._get_test_app()
+
+        # The ETag is computed from the page search results, no other
+        # queries are needed
+        with mock.patch('ckanext.dcat.controllers.catalog_modification_info'
+                        ) as mock_info:
+            response = app.get(url)
+            eq_(mock_info.call_count, 0)
+
+        etag = response.headers['ETag']
+        assert response.headers['Last-Modified']
+
+        # And is the same one computed for conditional requests
+        app.get(url, headers={'If-None-Match': etag}, status=304)
+
     def test_catalog_modified_date(self):
 
         dataset1 = factories.Dataset(title='First dataset')
@@ -320,7 +452,7 @@ class TestEndpoints(helpers.FunctionalTestBase):
 
         app.get(url, status=409)
 
-    @helpers.change_config('ckanext.dcat.datasets_per_page', 10)
+    @change_config('ckanext.dcat.datasets_per_page', 10)
     def test_catalog_pagination(self):
 
         for i in xrange(12):
@@ -354,7 +486,7 @@ class TestEndpoints(helpers.FunctionalTestBase):
         eq_(self._object_value(g, pagination, HYDRA.lastPage),
             url_for('dcat_catalog', _format='rdf', page=2, host='test.ckan.net'))
 
-    @helpers.change_config('ckanext.dcat.enable_rdf_endpoints', False)
+    @change_config('ckanext.dcat.enable_rdf_endpoints', False)
     def test_catalog_endpoint_disabled(self):
         p.unload('dcat')
         p.load('dcat')
@@ -517,7 +649,7 @@ class TestTranslations(helpers.FunctionalTestBase):
 
         assert 'Notes de la versió' in response.body
 
-    @helpers.change_config('ckanext.dcat.translate_keys', True)
+    @change_config('ckanext.dcat.translate_keys', True)
     def test_labels_enable_by_config(self):
         dataset = factories.Dataset(extras=[
             {'key': 'version_notes', 'value': 'bla'}
@@ -532,7 +664,7 @@ class TestTranslations(helpers.FunctionalTestBase):
         assert 'Notes de la versió' in response.body
         assert not 'Version notes' in response.body
 
-    @helpers.change_config('ckanext.dcat.translate_keys', False)
+    @change_config('ckanext.dcat.translate_keys', False)
     def test_labels_disable_by_config(self):
         dataset = factories.Dataset(extras=[
             {'key': 'version_notes', 'value': 'bla'}
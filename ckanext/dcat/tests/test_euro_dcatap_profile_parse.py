@@ -10,12 +10,13 @@ from rdflib.namespace import RDF
 
 from ckan.plugins import toolkit
 
-from ckantoolkit.tests import helpers, factories
+from ckantoolkit.tests import factories
 
 from ckanext.dcat.processors import RDFParser, RDFSerializer
 from ckanext.dcat.profiles import (DCAT, DCT, ADMS, LOCN, SKOS, GSP, RDFS,
                                    GEOJSON_IMT)
 from ckanext.dcat.utils import DCAT_EXPOSE_SUBCATALOGS, DCAT_CLEAN_TAGS
+from ckanext.dcat.tests.helpers import change_config
 
 eq_ = nose.tools.eq_
 assert_true = nose.tools.assert_true
@@ -348,7 +349,7 @@ class TestEuroDCATAPProfileParsing(BaseParseTest):
         else:
             eq_(resource['format'], u'text/csv')
 
-    @helpers.change_config('ckanext.dcat.normalize_ckan_format', False)
+    @change_config('ckanext.dcat.normalize_ckan_format', False)
     def test_distribution_format_imt_only_normalize_false(self):
         g = Graph()
 
@@ -371,7 +372,7 @@ class TestEuroDCATAPProfileParsing(BaseParseTest):
         eq_(resource['format'], u'text/csv')
         eq_(resource['mimetype'], u'text/csv')
 
-    @helpers.change_config('ckanext.dcat.normalize_ckan_format', False)
+    @change_config('ckanext.dcat.normalize_ckan_format', False)
     def test_distribution_format_format_only_normalize_false(self):
         g = Graph()
 
@@ -512,6 +513,31 @@ class TestEuroDCATAPProfileParsing(BaseParseTest):
         eq_(len(dataset['resources']), 3)
         eq_(len(dataset['tags']), 2)
 
+    def test_catalog_xml_rdf_streaming(self):
+
+        contents = self._get_file_contents('catalog.rdf')
+
+        p = RDFParser(profiles=['euro_dcat_ap'])
+        p.parse(contents)
+        datasets = dict((d['title'], d) for d in p.datasets())
+
+        p = RDFParser(profiles=['euro_dcat_ap'])
+        p.parse(contents, streaming=True)
+        streamed_datasets = dict((d['title'], d) for d in p.datasets())
+
+        # Only the triples of the last dataset (plus the catalog ones) were
+        # loaded
+        assert_true(len(p.g) < len(Graph().parse(data=contents)))
+
+        eq_(sorted(streamed_datasets.keys()), sorted(datasets.keys()))
+        for title, dataset in datasets.iteritems():
+            streamed = streamed_datasets[title]
+            eq_(self._extras(streamed), self._extras(dataset))
+            eq_(sorted(r['uri'] for r in streamed['resources']),
+                sorted(r['uri'] for r in dataset['resources']))
+            eq_(sorted(t['name'] for t in streamed['tags']),
+                sorted(t['name'] for t in dataset['tags']))
+
     def test_dataset_turtle_1(self):
 
         contents = self._get_file_contents('dataset_deri.ttl')
@@ -587,7 +613,7 @@ class TestEuroDCATAPProfileParsing(BaseParseTest):
         eq_(_get_extra_value('dcat_publisher_email'), 'contact@some.org')
         eq_(_get_extra_value('language'), 'ca,en,es')
     
-    @helpers.change_config(DCAT_EXPOSE_SUBCATALOGS, 'true')
+    @change_config(DCAT_EXPOSE_SUBCATALOGS, 'true')
     def test_parse_subcatalog(self):
         publisher = {'name': 'Publisher',
                      'email': 'email@test.com',
@@ -648,6 +674,63 @@ class TestEuroDCATAPProfileParsing(BaseParseTest):
             # check if we had subcatalog in extras
             assert_true(has_subcat)
 
+    @change_config(DCAT_EXPOSE_SUBCATALOGS, 'true')
+    def test_parse_subcatalog_several_datasets(self):
+        data = '''
+        @prefix dcat: <http://www.w3.org/ns/dcat#> .
+        @prefix dct: <http://purl.org/dc/terms/> .
+        @prefix foaf: <http://xmlns.com/foaf/0.1/> .
+
+        <http://example.org> a dcat:Catalog ;
+            dct:title "Root catalog" ;
+            dct:hasPart <http://sub1.example>, <http://sub2.example> ;
+            dcat:dataset <http://example.org/datasets/1>,
+                         <http://example.org/datasets/2>,
+                         <http://example.org/datasets/3> .
+
+        <http://sub1.example> a dcat:Catalog ;
+            dct:title "Subcatalog 1" ;
+            foaf:homepage <http://sub1.example> ;
+            dct:publisher [ a foaf:Agent ; foaf:name "Publisher 1" ] ;
+            dcat:dataset <http://example.org/datasets/1>,
+                         <http://example.org/datasets/2> .
+
+        <http://sub2.example> a dcat:Catalog ;
+            dct:title "Subcatalog 2" ;
+            foaf:homepage <http://sub2.example> ;
+            dcat:dataset <http://example.org/datasets/3> .
+
+        <http://example.org/datasets/1> a dcat:Dataset ; dct:title "Dataset 1" .
+        <http://example.org/datasets/2> a dcat:Dataset ; dct:title "Dataset 2" .
+        <http://example.org/datasets/3> a dcat:Dataset ; dct:title "Dataset 3" .
+        '''
+
+        p = RDFParser(profiles=['euro_dcat_ap'])
+        p.parse(data, _format='turtle')
+
+        datasets = dict([(d['title'], d) for d in p.datasets()])
+        eq_(len(datasets), 3)
+
+        def _extras(dataset):
+            return dict((extra['key'], extra['value'])
+                        for extra in dataset['extras'])
+
+        for title, catalog in (('Dataset 1', '1'), ('Dataset 2', '1'),
+                               ('Dataset 3', '2')):
+            extras = _extras(datasets[title])
+            eq_(extras['source_catalog_title'], 'Subcatalog ' + catalog)
+            eq_(extras['source_catalog_homepage'],
+                'http://sub{0}.example'.format(catalog))
+
+        eq_(json.loads(_extras(datasets['Dataset 2'])
+                       ['source_catalog_publisher'])['name'], 'Publisher 1')
+
+        # Datasets in the same catalog do not share the extras dicts
+        extras1 = datasets['Dataset 1']['extras']
+        extras2 = datasets['Dataset 2']['extras']
+        for extra in extras1:
+            assert not any(extra is other for other in extras2)
+
 
 class TestEuroDCATAPProfileParsingSpatial(BaseParseTest):
 
@@ -896,7 +979,7 @@ class TestEuroDCATAPProfileParsingSpatial(BaseParseTest):
     INVALID_TAG = "Som`E-in.valid tag!;"
     VALID_TAG = {'name': 'some-invalid-tag'}
 
-    @helpers.change_config(DCAT_CLEAN_TAGS, 'true')
+    @change_config(DCAT_CLEAN_TAGS, 'true')
     def test_tags_with_commas_clean_tags_on(self):
         g = Graph()
 
@@ -913,7 +996,7 @@ class TestEuroDCATAPProfileParsingSpatial(BaseParseTest):
         assert_true(self.INVALID_TAG not in datasets[0]['tags'])
 
 
-    @helpers.change_config(DCAT_CLEAN_TAGS, 'false')
+    @change_config(DCAT_CLEAN_TAGS, 'false')
     def test_tags_with_commas_clean_tags_off(self):
         g = Graph()
 
@@ -1,11 +1,14 @@
 import json
+import re
 
+import mock
 import nose
 
 from ckantoolkit import config
 
 from dateutil.parser import parse as parse_date
-from rdflib import URIRef, BNode, Literal
+from rdflib import Graph, URIRef, BNode, Literal
+from rdflib.compare import isomorphic
 from rdflib.namespace import RDF
 
 from geomet import wkt
@@ -13,10 +16,12 @@ from geomet import wkt
 from ckantoolkit.tests import helpers, factories
 
 from ckanext.dcat import utils
-from ckanext.dcat.processors import RDFSerializer
+from ckanext.dcat.cache import catalog_cache, reset_catalog_cache
+from ckanext.dcat.processors import RDFSerializer, FRAGMENT_SEPARATORS
 from ckanext.dcat.profiles import (DCAT, DCT, ADMS, XSD, VCARD, FOAF, SCHEMA,
                                    SKOS, LOCN, GSP, OWL, SPDX, GEOJSON_IMT)
 from ckanext.dcat.utils import DCAT_EXPOSE_SUBCATALOGS
+from ckanext.dcat.tests.helpers import change_config
 
 eq_ = nose.tools.eq_
 assert_true = nose.tools.assert_true
@@ -850,7 +855,282 @@ class TestEuroDCATAPProfileSerializeCatalog(BaseSerializeTest):
 
         assert self._triple(g, catalog, DCT.modified, dataset['metadata_modified'], XSD.dateTime)
 
-    @helpers.change_config(DCAT_EXPOSE_SUBCATALOGS, 'true')
+    def test_graph_from_catalog_cached(self):
+
+        reset_catalog_cache()
+
+        dataset = factories.Dataset()
+
+        s = RDFSerializer()
+        catalog = s.graph_from_catalog()
+
+        assert len(catalog_cache())
+
+        s2 = RDFSerializer()
+        s2.graph_from_catalog()
+
+        assert isomorphic(s.g, s2.g)
+
+        # Creating or updating datasets invalidates the cache
+        dataset2 = factories.Dataset()
+
+        eq_(len(catalog_cache()), 0)
+
+        s3 = RDFSerializer()
+        s3.graph_from_catalog()
+
+        assert self._triple(s3.g, catalog, DCT.modified,
+                            dataset2['metadata_modified'], XSD.dateTime)
+
+        helpers.call_action('package_patch', id=dataset['id'],
+                            notes='Updated')
+
+        eq_(len(catalog_cache()), 0)
+
+        reset_catalog_cache()
+
+    @helpers.change_config('ckanext.dcat.catalog_cache.ttl', 0)
+    def test_graph_from_catalog_cache_disabled(self):
+
+        reset_catalog_cache()
+
+        s = RDFSerializer()
+        s.graph_from_catalog()
+
+        eq_(len(catalog_cache()), 0)
+
+        reset_catalog_cache()
+
+    def _catalog_datasets(self):
+        return [{
+            'id': '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd{0}'.format(i),
+            'name': 'test-dataset-{0}'.format(i),
+            'title': 'Test dataset {0}'.format(i),
+            'extras': [
+                {'key': 'contact_name', 'value': 'Contact {0}'.format(i)},
+            ],
+            'resources': [{
+                'id': 'c041c635-054f-4431-b647-f9186926d02{0}'.format(i),
+                'package_id': '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd{0}'.format(i),
+                'url': 'http://example.com/data/{0}.csv'.format(i),
+                'format': 'CSV',
+            }]
+        } for i in xrange(3)]
+
+    def test_serialize_catalog_iter_matches_serialize_catalog(self):
+
+        pagination_info = {
+            'count': 3,
+            'items_per_page': 100,
+            'current': 'http://example.com/catalog.ttl?page=1',
+        }
+
+        for _format, parse_format in (('nt', 'nt'),
+                                      ('ttl', 'turtle'),
+                                      ('jsonld', 'json-ld'),
+                                      ('xml', 'xml')):
+            s = RDFSerializer()
+            expected = s.serialize_catalog(
+                {}, self._catalog_datasets(), _format=_format,
+                pagination_info=pagination_info)
+
+            s = RDFSerializer()
+            chunks = [c for c in s.serialize_catalog_iter(
+                {}, self._catalog_datasets(), _format=_format,
+                pagination_info=pagination_info)]
+
+            # One chunk for the catalog, one per dataset (plus the enclosing
+            # brackets in JSON-LD)
+            assert_true(len(chunks) >= 4)
+
+            g_expected = Graph().parse(data=expected, format=parse_format)
+            g_streamed = Graph().parse(data=''.join(chunks),
+                                       format=parse_format)
+
+            assert_true(isomorphic(g_expected, g_streamed), _format)
+
+    def test_serialize_catalog_iter_non_streaming_format(self):
+
+        s = RDFSerializer()
+        chunks = [c for c in s.serialize_catalog_iter(
+            {}, self._catalog_datasets(), _format='n3')]
+
+        eq_(len(chunks), 1)
+
+        g = Graph().parse(data=chunks[0], format='n3')
+        eq_(len([d for d in g.subjects(RDF.type, DCAT.Dataset)]), 3)
+
+    def test_serialize_catalog_fragments_reassembled(self):
+
+        for _format, parse_format in (('nt', 'nt'),
+                                      ('ttl', 'turtle'),
+                                      ('jsonld', 'json-ld'),
+                                      ('xml', 'xml')):
+            s = RDFSerializer()
+            fragments = list(s.serialize_catalog_fragments(
+                {}, self._catalog_datasets(), _format=_format,
+                self_contained=True))
+
+            eq_(len(fragments), 4)
+            eq_(fragments[0][0], None)
+            eq_([f[0]['id'] for f in fragments[1:]],
+                [d['id'] for d in self._catalog_datasets()])
+
+            # Dataset fragments can be removed or reordered
+            separator = FRAGMENT_SEPARATORS.get(parse_format, '')
+            output = (s.catalog_fragments_start(_format) +
+                      separator.join([fragments[0][1],
+                                      fragments[3][1],
+                                      fragments[1][1]]) +
+                      s.catalog_fragments_end(_format))
+
+            g = Graph().parse(data=output, format=parse_format)
+            eq_(len([d for d in g.subjects(RDF.type, DCAT.Dataset)]), 2,
+                _format)
+
+    def test_serialize_catalog_fragments_turtle_prefixes(self):
+
+        s = RDFSerializer()
+        fragments = s.serialize_catalog_fragments({}, [], _format='ttl',
+                                                  self_contained=True)
+        output = [next(fragments)[1]]
+
+        # Namespaces not bound by the profiles
+        subject = URIRef('http://example.com/subject')
+        for namespace in ('http://example.com/a/', 'http://example.org/b/',
+                          'http://example.com/a/'):
+            s.g = Graph()
+            s.g.add((subject, URIRef(namespace + 'value'),
+                     Literal(namespace)))
+            output.append(s._serialize_fragment('turtle'))
+
+        output = ''.join(output)
+
+        # Every prefix is always bound to the same namespace
+        prefixes = {}
+        for line in output.splitlines():
+            if line.startswith('@prefix'):
+                prefix, namespace = line.split()[1:3]
+                eq_(prefixes.setdefault(prefix, namespace), namespace)
+
+        g = Graph().parse(data=output, format='turtle')
+        eq_(sorted(unicode(p) for p in g.predicates(subject, None)),
+            ['http://example.com/a/value', 'http://example.org/b/value'])
+
+    def test_serialize_catalog_fragments_xml_unsplittable_predicate(self):
+
+        s = RDFSerializer()
+        fragments = s.serialize_catalog_fragments({}, [], _format='xml')
+        catalog_fragment = next(fragments)[1]
+
+        subject = URIRef('http://example.com/subject')
+        s.g = Graph()
+        s.g.add((subject, DCT.title, Literal('Title')))
+        s.g.add((subject, URIRef('http://example.com/a/b1'), Literal('b1')))
+        # These can not be split into a namespace and a local name
+        s.g.add((subject, URIRef('http://example.com/123'), Literal('123')))
+        s.g.add((subject, URIRef('http://example.com/a/'), Literal('a')))
+
+        output = (s.catalog_fragments_start('xml') + catalog_fragment +
+                  s._serialize_fragment('xml') +
+                  s.catalog_fragments_end('xml'))
+
+        g = Graph().parse(data=output, format='xml')
+        eq_(sorted(unicode(o) for o in g.objects(subject, None)),
+            ['Title', 'b1'])
+
+    def test_serialize_catalog_fragments_xml_sorted(self):
+
+        s = RDFSerializer()
+        fragments = s.serialize_catalog_fragments({}, [], _format='xml')
+        next(fragments)
+
+        triples = [(URIRef('http://example.com/{0}'.format(i)),
+                    URIRef('http://example.com/a/{0}'.format(p)),
+                    Literal('{0}{1}'.format(i, p)))
+                   for i in range(10) for p in 'abc']
+
+        outputs = []
+        for ordered in (triples, list(reversed(triples))):
+            s.g = Graph()
+            for triple in ordered:
+                s.g.add(triple)
+            outputs.append(s._serialize_fragment('xml'))
+
+        # The same graph always gives the same output
+        eq_(outputs[0], outputs[1])
+        subjects = re.findall('rdf:about="([^"]+)"', outputs[0])
+        eq_(subjects, sorted(subjects))
+
+    def _shared_entities_datasets(self):
+        datasets = self._catalog_datasets()
+        for i, dataset in enumerate(datasets):
+            dataset['extras'] = [
+                {'key': 'publisher_uri', 'value': 'http://example.org/pub'},
+                {'key': 'publisher_name',
+                 'value': 'Publisher' if i < 2 else 'Renamed publisher'},
+                {'key': 'contact_uri', 'value': 'http://example.org/contact'},
+                {'key': 'contact_name', 'value': 'Contact'},
+                {'key': 'spatial_uri', 'value': 'http://example.org/place'},
+                {'key': 'spatial',
+                 'value': '{"type": "Point", "coordinates": [1.0, 2.0]}'},
+            ]
+        return datasets
+
+    def test_serialize_catalog_shared_entities(self):
+
+        datasets = self._shared_entities_datasets()
+
+        s = RDFSerializer()
+        with mock.patch('ckanext.dcat.profiles.wkt.dumps',
+                        wraps=wkt.dumps) as mock_dumps:
+            s.serialize_catalog({}, dataset_dicts=datasets)
+
+        # The location is only described for the first dataset
+        eq_(mock_dumps.call_count, 1)
+
+        # The output is the same as describing them for every dataset
+        expected = RDFSerializer()
+        catalog_ref = expected.graph_from_catalog({})
+        for dataset in datasets:
+            dataset_ref = expected.graph_from_dataset(dataset)
+            expected.g.add((catalog_ref, DCAT.dataset, dataset_ref))
+        assert_true(isomorphic(s.g, expected.g))
+
+        # Entities with different values are described again
+        names = s.g.objects(URIRef('http://example.org/pub'), FOAF.name)
+        eq_(sorted(unicode(name) for name in names),
+            ['Publisher', 'Renamed publisher'])
+
+        # Serializing a single dataset is not affected
+        s = RDFSerializer()
+        s.graph_from_dataset(datasets[0])
+        s.g = Graph()
+        s.graph_from_dataset(datasets[1])
+        assert_true(self._triple(s.g, URIRef('http://example.org/contact'),
+                                 VCARD.fn, 'Contact'))
+
+    def test_serialize_catalog_fragments_shared_entities(self):
+
+        for self_contained in (False, True):
+            s = RDFSerializer()
+            fragments = list(s.serialize_catalog_fragments(
+                {}, self._shared_entities_datasets(), _format='nt',
+                self_contained=self_contained))
+
+            g = Graph().parse(data=fragments[2][1], format='nt')
+            eq_(bool(self._triple(g, URIRef('http://example.org/place'),
+                                  RDF.type, DCT.Location)),
+                self_contained)
+            assert_true(self._triple(g, None, DCT.spatial,
+                                     URIRef('http://example.org/place')))
+
+            # The renamed publisher is described on the last one
+            g = Graph().parse(data=fragments[3][1], format='nt')
+            assert_true(self._triple(g, URIRef('http://example.org/pub'),
+                                     FOAF.name, 'Renamed publisher'))
+
+    @change_config(DCAT_EXPOSE_SUBCATALOGS, 'true')
     def test_subcatalog(self):
         publisher = {'name': 'Publisher',
                      'email': 'email@test.com',
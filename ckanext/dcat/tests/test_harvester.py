@@ -1,19 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import json
 from collections import defaultdict
 
 import nose
 import httpretty
-from mock import patch
+from mock import patch, Mock, call
+
+from ckantoolkit import config
+
+from ckan.lib.search.common import SearchIndexError
 
 import ckan.plugins as p
+import ckan.model as model
 import ckantoolkit.tests.helpers as h
 
 import ckanext.harvest.model as harvest_model
 from ckanext.harvest import queue
 
 from ckanext.dcat.harvesters import DCATRDFHarvester
+from ckanext.dcat.harvesters import guids
+from ckanext.dcat.harvesters.deletion import delete_packages
+from ckanext.dcat.harvesters.lookup import dataset_fingerprint
 from ckanext.dcat.interfaces import IDCATRDFHarvester
+from ckanext.dcat.streaming import DatasetSubgraphs
 import ckanext.dcat.harvesters.rdf
 
 
@@ -653,6 +663,125 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
             ['Example dataset 1', 'Example dataset 2',
              'Example dataset 3', 'Example dataset 4'])
 
+    def test_harvest_create_rdf_pagination_gather_workers(self):
+
+        # Mock the GET requests needed to get the file
+        httpretty.register_uri(httpretty.GET, self.rdf_mock_url_pagination_1,
+                               body=self.rdf_content_pagination_1,
+                               content_type=self.rdf_content_type)
+
+        httpretty.register_uri(httpretty.GET, self.rdf_mock_url_pagination_2,
+                               body=self.rdf_content_pagination_2,
+                               content_type=self.rdf_content_type)
+
+        # The harvester will try to do a HEAD request first so we need to mock
+        # them as well
+        httpretty.register_uri(httpretty.HEAD, self.rdf_mock_url_pagination_1,
+                               status=405,
+                               content_type=self.rdf_content_type)
+
+        httpretty.register_uri(httpretty.HEAD, self.rdf_mock_url_pagination_2,
+                               status=405,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(
+            self.rdf_mock_url_pagination_1,
+            config='{"gather_workers": 2, "gather_queue_depth": 2}')
+
+        self._run_full_job(harvest_source['id'], num_objects=4)
+
+        # Check that four datasets were created
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = h.call_action('package_search', {}, fq=fq)
+
+        eq_(results['count'], 4)
+        eq_(sorted([d['title'] for d in results['results']]),
+            ['Example dataset 1', 'Example dataset 2',
+             'Example dataset 3', 'Example dataset 4'])
+
+        # Harvest objects are created in the same order as the remote ones
+        HarvestObject = harvest_model.HarvestObject
+        objects = model.Session.query(HarvestObject) \
+            .filter(HarvestObject.harvest_source_id == harvest_source['id']) \
+            .order_by(HarvestObject.gathered) \
+            .all()
+        eq_([json.loads(o.content)['title'] for o in objects],
+            ['Example dataset 1', 'Example dataset 2',
+             'Example dataset 3', 'Example dataset 4'])
+
+    def test_harvest_create_rdf_pagination_streaming_parser(self):
+
+        # Mock the GET requests needed to get the file
+        httpretty.register_uri(httpretty.GET, self.rdf_mock_url_pagination_1,
+                               body=self.rdf_content_pagination_1,
+                               content_type=self.rdf_content_type)
+
+        httpretty.register_uri(httpretty.GET, self.rdf_mock_url_pagination_2,
+                               body=self.rdf_content_pagination_2,
+                               content_type=self.rdf_content_type)
+
+        # The harvester will try to do a HEAD request first so we need to mock
+        # them as well
+        httpretty.register_uri(httpretty.HEAD, self.rdf_mock_url_pagination_1,
+                               status=405,
+                               content_type=self.rdf_content_type)
+
+        httpretty.register_uri(httpretty.HEAD, self.rdf_mock_url_pagination_2,
+                               status=405,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(
+            self.rdf_mock_url_pagination_1,
+            config='{"streaming_parser": true}')
+
+        # The documents are split into one graph per dataset
+        with patch('ckanext.dcat.processors.DatasetSubgraphs',
+                   wraps=DatasetSubgraphs) as mock_subgraphs:
+            self._run_full_job(harvest_source['id'], num_objects=4)
+
+        eq_([c[0][1] for c in mock_subgraphs.call_args_list], ['xml', 'xml'])
+
+        # Check that four datasets were created
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = h.call_action('package_search', {}, fq=fq)
+
+        eq_(results['count'], 4)
+        eq_(sorted([d['title'] for d in results['results']]),
+            ['Example dataset 1', 'Example dataset 2',
+             'Example dataset 3', 'Example dataset 4'])
+
+    def test_harvest_create_rdf_pagination_skip_head_request(self):
+
+        # Mock the GET requests needed to get the file (they include a
+        # Content-Length header)
+        httpretty.register_uri(httpretty.GET, self.rdf_mock_url_pagination_1,
+                               body=self.rdf_content_pagination_1,
+                               content_type=self.rdf_content_type)
+
+        httpretty.register_uri(httpretty.GET, self.rdf_mock_url_pagination_2,
+                               body=self.rdf_content_pagination_2,
+                               content_type=self.rdf_content_type)
+
+        httpretty.register_uri(httpretty.HEAD, self.rdf_mock_url_pagination_1,
+                               status=405,
+                               content_type=self.rdf_content_type)
+
+        # The server already sent a Content-Length with the first page, so
+        # this should not be requested
+        httpretty.register_uri(httpretty.HEAD, self.rdf_mock_url_pagination_2,
+                               status=500,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(
+            self.rdf_mock_url_pagination_1,
+            config='{"skip_head_request": true}')
+
+        self._run_full_job(harvest_source['id'], num_objects=4)
+
+        methods = [r.method for r in httpretty.HTTPretty.latest_requests
+                   if r.path.startswith('/page/2')]
+        eq_(methods, ['GET'])
+
     def test_harvest_create_rdf_pagination_same_content(self):
 
         # Mock the GET requests needed to get the file. Two different URLs but
@@ -768,6 +897,151 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
         eq_(new['uri'], '')
         nose.tools.assert_is_not(new['id'], existing['id'])
 
+    def test_harvest_update_existing_datasets_lookup(self):
+        url = self.rdf_mock_url
+        content = self.rdf_content_with_distribution_uri
+
+        httpretty.register_uri(httpretty.GET, url, body=content,
+                               content_type=self.rdf_content_type)
+        httpretty.register_uri(httpretty.HEAD, url, status=405,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(url)
+
+        self._run_full_job(harvest_source['id'], num_objects=1)
+        self._run_jobs()
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        existing_dataset = h.call_action('package_search', {}, fq=fq)['results'][0]
+        previous_object = model.Session.query(harvest_model.HarvestObject) \
+            .filter(harvest_model.HarvestObject.current == True).one()
+
+        new_file = content.replace('Example resource 1',
+                                   'Example resource 1 (updated)')
+        httpretty.register_uri(httpretty.GET, url, body=new_file,
+                               content_type=self.rdf_content_type)
+
+        # The existing dataset is found on the lookup loaded for the job
+        with patch.object(DCATRDFHarvester, '_get_existing_dataset') as mock_get:
+            self._run_full_job(harvest_source['id'])
+            eq_(mock_get.call_count, 0)
+
+        new_dataset = h.call_action('package_search', {}, fq=fq)['results'][0]
+
+        eq_(new_dataset['id'], existing_dataset['id'])
+        eq_(new_dataset['name'], existing_dataset['name'])
+        eq_(new_dataset['resources'][0]['id'],
+            existing_dataset['resources'][0]['id'])
+        eq_(new_dataset['resources'][0]['name'], 'Example resource 1 (updated)')
+
+        # The previous object is not the current one anymore
+        current = model.Session.query(harvest_model.HarvestObject) \
+            .filter(harvest_model.HarvestObject.current == True).one()
+        assert current.id != previous_object.id
+        eq_(current.guid, previous_object.guid)
+
+    def test_harvest_update_unchanged_datasets(self):
+
+        first, second = self._test_harvest_unchanged()
+
+        # The datasets were not updated
+        eq_(second, first)
+
+        # The new objects are the current ones, with the same fingerprints
+        current = model.Session.query(harvest_model.HarvestObject) \
+            .filter(harvest_model.HarvestObject.current == True).all()
+        eq_(len(current), 2)
+        for harvest_object in current:
+            assert [e for e in harvest_object.extras if e.key == 'fingerprint']
+
+    def test_harvest_update_unchanged_datasets_registers_guids(self):
+        url = self.rdf_mock_url
+
+        httpretty.register_uri(httpretty.GET, url, body=self.rdf_content,
+                               content_type=self.rdf_content_type)
+        httpretty.register_uri(httpretty.HEAD, url, status=405,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+        self._run_jobs()
+
+        registered = guids.registered_guids(harvest_source['id'])
+        eq_(len(registered), 2)
+
+        # Datasets harvested before the guid registry existed
+        model.Session.execute(guids.guid_table.delete())
+        model.Session.commit()
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        first = h.call_action('package_search', {}, fq=fq)['results']
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        # The datasets are not updated, but their guids are registered
+        second = h.call_action('package_search', {}, fq=fq)['results']
+        eq_(sorted(r['metadata_modified'] for r in second),
+            sorted(r['metadata_modified'] for r in first))
+        eq_(guids.registered_guids(harvest_source['id']), registered)
+
+    def test_harvest_update_unchanged_datasets_force_update(self):
+
+        first, second = self._test_harvest_unchanged(
+            config='{"force_update": true}')
+
+        eq_(sorted(second.keys()), sorted(first.keys()))
+        for dataset_id in first:
+            assert second[dataset_id] > first[dataset_id]
+
+    def test_harvest_import_again_updates_datasets(self):
+
+        first, second = self._test_harvest_unchanged()
+
+        # Importing the current objects again (eg with `paster harvester
+        # import`) updates their datasets
+        current = model.Session.query(harvest_model.HarvestObject) \
+            .filter(harvest_model.HarvestObject.current == True).all()
+        harvester = DCATRDFHarvester()
+        for harvest_object in current:
+            eq_(harvester.import_stage(harvest_object), True)
+
+            # Without adding another fingerprint
+            eq_(len([e for e in harvest_object.extras
+                     if e.key == 'fingerprint']), 1)
+
+            dataset = h.call_action('package_show',
+                                    id=harvest_object.package_id)
+            assert (dataset['metadata_modified'] >
+                    second[harvest_object.package_id])
+
+    def _test_harvest_unchanged(self, **kwargs):
+        url = self.rdf_mock_url
+
+        httpretty.register_uri(httpretty.GET, url, body=self.rdf_content,
+                               content_type=self.rdf_content_type)
+        httpretty.register_uri(httpretty.HEAD, url, status=405,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(url, **kwargs)
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+
+        def _modified():
+            results = h.call_action('package_search', {}, fq=fq)['results']
+            return dict((r['id'], r['metadata_modified']) for r in results)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+        self._run_jobs()
+
+        first = _modified()
+        eq_(len(first), 2)
+
+        # Run a second job with the same remote file
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        return first, _modified()
+
     def _test_harvest_update_resources(self, url, content, content_type):
         # Mock the GET request to get the file
         httpretty.register_uri(httpretty.GET, url,
@@ -829,6 +1103,14 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
                                   self.ttl_remote_file_small,
                                   self.ttl_content_type)
 
+    @h.change_config('ckanext.dcat.harvest.bulk_delete', 'true')
+    def test_harvest_delete_rdf_bulk_delete(self):
+
+        self._test_harvest_delete(self.rdf_mock_url,
+                                  self.rdf_content,
+                                  self.rdf_remote_file_small,
+                                  self.rdf_content_type)
+
     def _test_harvest_delete(self, url, content, content_small, content_type):
 
         # Mock the GET request to get the file
@@ -863,6 +1145,81 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
 
         eq_(results['results'][0]['title'], 'Example dataset 1')
 
+        # The other one is still there, but deleted
+        deleted = model.Session.query(model.Package) \
+            .filter(model.Package.title == 'Example dataset 2').one()
+        eq_(deleted.state, 'deleted')
+
+    def test_harvest_guid_registry(self):
+        url = self.rdf_mock_url
+
+        httpretty.register_uri(httpretty.GET, url, body=self.rdf_content,
+                               content_type=self.rdf_content_type)
+        httpretty.register_uri(httpretty.HEAD, url, status=405,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+        self._run_jobs()
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = h.call_action('package_search', {}, fq=fq)
+        datasets = dict((r['title'], r['id']) for r in results['results'])
+
+        registered = guids.registered_guids(harvest_source['id'])
+        eq_(registered, {
+            'https://data.some.org/catalog/datasets/1': datasets['Example dataset 1'],
+            'https://data.some.org/catalog/datasets/2': datasets['Example dataset 2'],
+        })
+        eq_(guids.guid_package_ids('https://data.some.org/catalog/datasets/1'),
+            [datasets['Example dataset 1']])
+
+        # The registry can be rebuilt from the guid extras
+        model.Session.execute(guids.guid_table.delete())
+        eq_(guids.backfill(harvest_source['id']), 2)
+        eq_(guids.registered_guids(harvest_source['id']), registered)
+
+        # Deleted datasets are removed
+        httpretty.register_uri(httpretty.GET, url, body=self.rdf_remote_file_small,
+                               content_type=self.rdf_content_type)
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        eq_(guids.registered_guids(harvest_source['id']), {
+            'https://data.some.org/catalog/datasets/1': datasets['Example dataset 1'],
+        })
+
+    def test_harvest_guid_registry_register_twice(self):
+
+        guids.register_guid('http://example.com/guid', 'source-id', 'id-1')
+        guids.register_guid('http://example.com/guid', 'source-id', 'id-2')
+
+        eq_(guids.registered_guids('source-id'),
+            {'http://example.com/guid': 'id-2'})
+
+    def test_harvest_guid_fallback_until_backfilled(self):
+
+        guid = 'http://example.com/not-registered'
+        dataset = h.call_action('package_create', name='not-registered',
+                                extras=[{'key': 'guid', 'value': guid}])
+        harvester = DCATRDFHarvester()
+
+        try:
+            # Found on the dataset extras
+            eq_(harvester._get_existing_dataset(guid)['id'], dataset['id'])
+
+            # Not once all sources have been backfilled
+            guids.backfill()
+            assert guids.is_backfilled()
+            eq_(harvester._get_existing_dataset(guid), None)
+
+            # Unless forced on the config
+            config[ckanext.dcat.harvesters.rdf.GUID_FALLBACK_CONFIG] = 'true'
+            eq_(harvester._get_existing_dataset(guid)['id'], dataset['id'])
+        finally:
+            config.pop(ckanext.dcat.harvesters.rdf.GUID_FALLBACK_CONFIG, None)
+            guids._backfilled = False
+
     def test_harvest_bad_format_rdf(self):
 
         self._test_harvest_bad_format(self.rdf_mock_url,
@@ -1380,13 +1737,28 @@ class TestDCATRDFHarvester(object):
     def test_validates_correct_config(self):
         harvester = DCATRDFHarvester()
 
-        for config in ['{}', '{"rdf_format":"text/turtle"}']:
+        for config in ['{}', '{"rdf_format":"text/turtle"}',
+                       '{"gather_workers": 4, "gather_queue_depth": 2}',
+                       '{"streaming_parser": true}',
+                       '{"gather_batch_size": 500}',
+                       '{"force_update": true}',
+                       '{"skip_head_request": true}',
+                       '{"pool_connections": 2, "pool_maxsize": 4}']:
             eq_(config, harvester.validate_config(config))
 
     def test_does_not_validate_incorrect_config(self):
         harvester = DCATRDFHarvester()
 
-        for config in ['invalid', '{invalid}', '{rdf_format:invalid}']:
+        for config in ['invalid', '{invalid}', '{rdf_format:invalid}',
+                       '{"gather_workers": "4"}', '{"gather_workers": -1}',
+                       '{"gather_queue_depth": 0}',
+                       '{"streaming_parser": "yes"}',
+                       '{"gather_batch_size": 0}',
+                       '{"gather_batch_size": "10"}',
+                       '{"force_update": "yes"}',
+                       '{"skip_head_request": "yes"}',
+                       '{"pool_connections": 0}',
+                       '{"pool_maxsize": "4"}']:
             try:
                 harvester.validate_config(config)
                 assert False
@@ -1394,6 +1766,266 @@ class TestDCATRDFHarvester(object):
                 assert True
 
 
+class TestDCATHarvesterSession(object):
+
+    def _job(self, job_id, config=None):
+        return Mock(id=job_id, source=Mock(config=config))
+
+    def test_session_reused_for_the_same_job(self):
+        harvester = DCATRDFHarvester()
+
+        job = self._job('job-1')
+        session = harvester._get_session(job)
+
+        assert harvester._get_session(job) is session
+
+    def test_new_session_for_a_new_job(self):
+        harvester = DCATRDFHarvester()
+
+        session = harvester._get_session(self._job('job-1'))
+
+        assert harvester._get_session(self._job('job-2')) is not session
+
+    @h.change_config('ckanext.dcat.harvest.pool_maxsize', '25')
+    def test_session_pool_size(self):
+        harvester = DCATRDFHarvester()
+
+        session = harvester._get_session(self._job('job-1'))
+
+        eq_(session.get_adapter('http://example.com')._pool_maxsize, 25)
+
+    @h.change_config('ckanext.dcat.harvest.pool_maxsize', '25')
+    def test_session_pool_size_source_config(self):
+        harvester = DCATRDFHarvester()
+
+        session = harvester._get_session(
+            self._job('job-1', '{"pool_maxsize": 4}'))
+
+        eq_(session.get_adapter('http://example.com')._pool_maxsize, 4)
+
+    def test_skip_head_request_config(self):
+        harvester = DCATRDFHarvester()
+
+        harvester._get_session(self._job('job-1'))
+        eq_(harvester._skip_head_request, False)
+
+        harvester._get_session(
+            self._job('job-2', '{"skip_head_request": true}'))
+        eq_(harvester._skip_head_request, True)
+
+
+class TestDCATHarvesterGather(object):
+
+    def _job(self, job_id, config=None):
+        return Mock(id=job_id, source=Mock(id='source-1', config=config))
+
+    @patch('ckanext.dcat.harvesters.base.model.Package.get')
+    def test_source_owner_org_once_per_job(self, mock_get):
+        mock_get.return_value = Mock(owner_org='org-1')
+        harvester = DCATRDFHarvester()
+
+        job = self._job('job-1')
+        eq_(harvester._get_source_owner_org(job), 'org-1')
+        eq_(harvester._get_source_owner_org(job), 'org-1')
+        eq_(mock_get.call_count, 1)
+
+        harvester._get_source_owner_org(self._job('job-2'))
+        eq_(mock_get.call_count, 2)
+
+    @patch('ckanext.dcat.harvesters.base.model.Session')
+    def test_save_harvest_objects_in_batches(self, mock_session):
+        harvester = DCATRDFHarvester()
+        objects = [Mock(id='object-{0}'.format(i)) for i in xrange(5)]
+
+        ids = harvester._save_harvest_objects(
+            objects, self._job('job-1', '{"gather_batch_size": 2}'))
+
+        eq_(ids, ['object-{0}'.format(i) for i in xrange(5)])
+        eq_(mock_session.add_all.call_count, 3)
+        eq_(mock_session.flush.call_count, 3)
+        eq_(mock_session.commit.call_count, 1)
+
+    @patch.object(DCATRDFHarvester, '_get_content_and_type')
+    @patch('ckanext.dcat.harvesters.rdf.multiprocessing')
+    @patch('ckanext.dcat.harvesters.rdf.model')
+    def test_gather_workers_release_connections(self, mock_model,
+                                                mock_multiprocessing,
+                                                mock_get_content):
+        mock_get_content.return_value = (None, None)
+        calls = Mock()
+        calls.attach_mock(mock_model.Session.commit, 'commit')
+        calls.attach_mock(mock_model.meta.engine.dispose, 'dispose')
+        calls.attach_mock(mock_multiprocessing.Pool, 'Pool')
+        harvester = DCATRDFHarvester()
+
+        harvester.gather_stage(self._job('job-1', '{"gather_workers": 2}'))
+
+        # Connections are released before forking the worker processes
+        eq_([c[0] for c in calls.mock_calls[:3]],
+            ['commit', 'dispose', 'Pool'])
+
+
+class TestDatasetFingerprint(object):
+
+    def _dataset(self):
+        return {
+            'name': 'test-dataset',
+            'title': 'Test dataset',
+            'tags': [{'name': 'a'}, {'name': 'b'}],
+            'extras': [{'key': 'guid', 'value': 'guid-1'},
+                       {'key': 'issued', 'value': '2016-01-01'}],
+            'resources': [{'uri': 'http://example.com/1', 'format': 'CSV'},
+                          {'uri': 'http://example.com/2', 'format': 'JSON'}],
+        }
+
+    def test_same_fingerprint_in_any_order(self):
+        dataset = self._dataset()
+        fingerprint = dataset_fingerprint(dataset)
+
+        for key in ('tags', 'extras', 'resources'):
+            dataset[key].reverse()
+        dataset['resources'][0] = dict(
+            reversed(dataset['resources'][0].items()))
+
+        eq_(dataset_fingerprint(dataset), fingerprint)
+
+    def test_name_ignored(self):
+        dataset = self._dataset()
+        fingerprint = dataset_fingerprint(dataset)
+
+        dataset['name'] = 'test-dataset-1'
+
+        eq_(dataset_fingerprint(dataset), fingerprint)
+
+    def test_different_fingerprint_on_changes(self):
+        dataset = self._dataset()
+        fingerprint = dataset_fingerprint(dataset)
+
+        dataset['resources'][1]['format'] = 'XML'
+
+        assert dataset_fingerprint(dataset) != fingerprint
+
+
+class TestDCATHarvesterDelete(object):
+
+    def _object(self, package_id, job_id='job-1'):
+        return Mock(package_id=package_id, guid='guid-' + package_id,
+                    harvest_job_id=job_id)
+
+    @h.change_config('ckanext.dcat.harvest.bulk_delete', 'true')
+    @patch('ckanext.dcat.harvesters.base.delete_packages')
+    @patch('ckanext.dcat.harvesters.base.pending_package_ids')
+    def test_delete_package_in_chunks(self, mock_pending, mock_delete):
+        mock_pending.return_value = ['package-1', 'package-2']
+        harvester = DCATRDFHarvester()
+
+        harvester._delete_package(self._object('package-1'), {})
+        mock_delete.assert_called_once_with(['package-1', 'package-2'])
+
+        # Already deleted along with the first one
+        harvester._delete_package(self._object('package-2'), {})
+        eq_(mock_delete.call_count, 1)
+
+        mock_pending.return_value = []
+        harvester._delete_package(self._object('package-3'), {})
+        mock_delete.assert_called_with(['package-3'])
+
+    @h.change_config('ckanext.dcat.harvest.bulk_delete', 'true')
+    @patch('ckanext.dcat.harvesters.base.delete_packages')
+    @patch('ckanext.dcat.harvesters.base.pending_package_ids')
+    def test_delete_package_new_job(self, mock_pending, mock_delete):
+        mock_pending.return_value = ['package-1']
+        harvester = DCATRDFHarvester()
+
+        harvester._delete_package(self._object('package-1'), {})
+        harvester._delete_package(self._object('package-1', 'job-2'), {})
+        eq_(mock_delete.call_count, 2)
+
+    @h.change_config('ckanext.dcat.harvest.bulk_delete', 'true')
+    @patch('ckanext.dcat.harvesters.base.delete_packages')
+    @patch('ckanext.dcat.harvesters.base.pending_package_ids')
+    def test_delete_package_without_dataset(self, mock_pending, mock_delete):
+        mock_pending.return_value = ['package-1']
+        harvester = DCATRDFHarvester()
+
+        harvester._delete_package(Mock(package_id=None, guid='guid-1',
+                                       harvest_job_id='job-1'), {})
+        mock_delete.assert_called_once_with(['package-1'])
+
+        mock_pending.return_value = []
+        harvester._delete_package(Mock(package_id=None, guid='guid-2',
+                                       harvest_job_id='job-1'), {})
+        eq_(mock_delete.call_count, 1)
+
+    @h.change_config('ckanext.dcat.harvest.bulk_delete', 'true')
+    @patch('ckanext.dcat.harvesters.base.unregister_package')
+    @patch('ckanext.dcat.harvesters.base.model.Session')
+    @patch('ckanext.dcat.harvesters.base.p.toolkit.get_action')
+    @patch('ckanext.dcat.harvesters.base.delete_packages')
+    @patch('ckanext.dcat.harvesters.base.pending_package_ids')
+    def test_delete_package_search_index_error(self, mock_pending,
+                                               mock_delete, mock_get_action,
+                                               mock_session, mock_unregister):
+        mock_pending.return_value = ['package-1', 'package-2']
+        mock_delete.side_effect = SearchIndexError('Solr is down')
+        harvester = DCATRDFHarvester()
+
+        harvester._delete_package(self._object('package-1'), {})
+
+        # Only the dataset of the object is deleted, with package_delete
+        mock_get_action.return_value.assert_called_once_with(
+            {}, {'id': 'package-1'})
+        mock_unregister.assert_called_once_with('package-1')
+
+        # The other ones are not flagged as deleted
+        mock_delete.side_effect = None
+        harvester._delete_package(self._object('package-2'), {})
+        eq_(mock_delete.call_count, 2)
+
+    @patch('ckanext.dcat.harvesters.deletion.catalog_cache')
+    @patch('ckanext.dcat.harvesters.deletion.dataset_cache')
+    @patch('ckanext.dcat.harvesters.deletion._remove_from_index')
+    @patch('ckanext.dcat.harvesters.deletion.unregister_packages')
+    @patch('ckanext.dcat.harvesters.deletion.model.Session')
+    def test_delete_packages_invalidates_caches(self, mock_session,
+                                                mock_unregister, mock_remove,
+                                                mock_dataset_cache,
+                                                mock_catalog_cache):
+        delete_packages(['package-1', 'package-2'])
+
+        mock_session.commit.assert_called_once_with()
+        eq_(mock_dataset_cache.return_value.invalidate.call_args_list,
+            [call('package-1'), call('package-2')])
+        mock_catalog_cache.return_value.clear.assert_called_once_with()
+
+
+class TestDCATHarvesterReadContent(object):
+
+    def _response(self, body):
+        response = Mock(headers={})
+        response.iter_content.side_effect = lambda chunk_size: (
+            body[i:i + chunk_size] for i in range(0, len(body), chunk_size))
+        return response
+
+    @h.change_config('ckanext.dcat.harvest.chunk_size', '3')
+    def test_read_content(self):
+        harvester = DCATRDFHarvester()
+
+        eq_(harvester._read_content(self._response('0123456789'), None),
+            '0123456789')
+
+    def test_read_content_max_file_size(self):
+        harvester = DCATRDFHarvester()
+        harvester.MAX_FILE_SIZE = 10
+        harvester._save_gather_error = Mock()
+
+        eq_(harvester._read_content(self._response('0' * 10), None),
+            '0' * 10)
+
+        eq_(harvester._read_content(self._response('0' * 11), None), None)
+        eq_(harvester._save_gather_error.call_count, 1)
+
+
 class TestIDCATRDFHarvester(object):
 
     def test_before_download(self):
@@ -7,8 +7,10 @@ from ckan.plugins import toolkit
 
 from ckantoolkit.tests import helpers, factories
 
-from ckanext.dcat.logic import _pagination_info
+from ckanext.dcat.cache import dataset_cache, reset_dataset_cache
+from ckanext.dcat.logic import _pagination_info, dcat_catalog_stream
 from ckanext.dcat.processors import RDFParser
+from ckanext.dcat.tests.helpers import change_config
 
 eq_ = nose.tools.eq_
 assert_raises = nose.tools.assert_raises
@@ -16,7 +18,7 @@ assert_raises = nose.tools.assert_raises
 
 class TestPagination(object):
 
-    @helpers.change_config('ckanext.dcat.datasets_per_page', 10)
+    @change_config('ckanext.dcat.datasets_per_page', 10)
     @helpers.change_config('ckan.site_url', 'http://example.com')
     @mock.patch('ckan.plugins.toolkit.request')
     def test_pagination(self, mock_request):
@@ -105,7 +107,7 @@ class TestPagination(object):
         eq_(pagination['previous'], 'http://example.com?page=2')
         assert 'next' not in pagination
 
-    @helpers.change_config('ckanext.dcat.datasets_per_page', 100)
+    @change_config('ckanext.dcat.datasets_per_page', 100)
     @helpers.change_config('ckan.site_url', 'http://example.com')
     @mock.patch('ckan.plugins.toolkit.request')
     def test_pagination_less_results_than_page_size(self, mock_request):
@@ -134,7 +136,7 @@ class TestPagination(object):
         assert 'next' not in pagination
         assert 'previous' not in pagination
 
-    @helpers.change_config('ckanext.dcat.datasets_per_page', 10)
+    @change_config('ckanext.dcat.datasets_per_page', 10)
     @helpers.change_config('ckan.site_url', 'http://example.com')
     @mock.patch('ckan.plugins.toolkit.request')
     def test_pagination_same_results_than_page_size(self, mock_request):
@@ -163,7 +165,7 @@ class TestPagination(object):
         assert 'next' not in pagination
         assert 'previous' not in pagination
 
-    @helpers.change_config('ckanext.dcat.datasets_per_page', 10)
+    @change_config('ckanext.dcat.datasets_per_page', 10)
     @helpers.change_config('ckan.site_url', 'http://example.com')
     @mock.patch('ckan.plugins.toolkit.request')
     def test_pagination_keeps_params(self, mock_request):
@@ -192,7 +194,7 @@ class TestPagination(object):
         eq_(pagination['next'], 'http://example.com/feed/catalog.xml?a=1&b=2&page=2')
         assert 'previous' not in pagination
 
-    @helpers.change_config('ckanext.dcat.datasets_per_page', 10)
+    @change_config('ckanext.dcat.datasets_per_page', 10)
     @helpers.change_config('ckan.site_url', '')
     @mock.patch('ckan.plugins.toolkit.request')
     def test_pagination_without_site_url(self, mock_request):
@@ -259,6 +261,35 @@ class TestPagination(object):
                       _pagination_info, query, data_dict)
 
 
+class TestCatalogStream(object):
+
+    @mock.patch('ckanext.dcat.logic.RDFSerializer')
+    @mock.patch('ckanext.dcat.logic._pagination_info')
+    @mock.patch('ckanext.dcat.logic._search_ckan_datasets')
+    @mock.patch('ckanext.dcat.logic.toolkit.check_access')
+    def test_catalog_rendered_before_returning(self, mock_check_access,
+                                               mock_search, mock_pagination,
+                                               mock_serializer):
+        mock_search.return_value = {'count': 1, 'results': [{'id': 'a'}]}
+        mock_pagination.return_value = {}
+
+        rendered = []
+
+        def fragments(*args, **kwargs):
+            rendered.append('catalog')
+            yield 'catalog'
+            rendered.append('dataset')
+            yield 'dataset'
+
+        mock_serializer.return_value.serialize_catalog_iter = fragments
+
+        output = dcat_catalog_stream({}, {'format': 'ttl'})
+
+        # Only the datasets are serialized once the iterator is consumed
+        eq_(rendered, ['catalog'])
+        eq_(list(output), ['catalog', 'dataset'])
+
+
 class TestActions(helpers.FunctionalTestBase):
    def test_dataset_show_with_format(self):
         dataset = factories.Dataset(
@@ -301,3 +332,107 @@ class TestActions(helpers.FunctionalTestBase):
 
         eq_(dcat_dataset['title'], dataset['title'])
         eq_(dcat_dataset['notes'], dataset['notes'])
+
+
+class TestDatasetCache(helpers.FunctionalTestBase):
+
+    def setup(self):
+        super(TestDatasetCache, self).setup()
+        reset_dataset_cache()
+
+    def teardown(self):
+        reset_dataset_cache()
+
+    @helpers.change_config('ckanext.dcat.dataset_cache.max_items', 10)
+    def test_dataset_show_cached(self):
+        dataset = factories.Dataset(notes='Test dataset')
+
+        content1 = helpers.call_action('dcat_dataset_show',
+                                       id=dataset['id'], format='ttl')
+        content2 = helpers.call_action('dcat_dataset_show',
+                                       id=dataset['name'], format='ttl')
+
+        eq_(content1, content2)
+
+        stats = dataset_cache().stats()
+        eq_(stats['items'], 1)
+        eq_(stats['hits'], 1)
+        eq_(stats['misses'], 1)
+
+        # Other formats are cached separately
+        helpers.call_action('dcat_dataset_show',
+                            id=dataset['id'], format='xml')
+
+        eq_(dataset_cache().stats()['items'], 2)
+
+    @helpers.change_config('ckanext.dcat.dataset_cache.max_items', 10)
+    def test_dataset_show_cache_invalidated_on_update(self):
+        dataset = factories.Dataset(notes='Test dataset')
+
+        helpers.call_action('dcat_dataset_show',
+                            id=dataset['id'], format='ttl')
+
+        eq_(dataset_cache().stats()['items'], 1)
+
+        helpers.call_action('package_patch', id=dataset['id'],
+                            notes='Updated notes')
+
+        eq_(dataset_cache().stats()['items'], 0)
+
+        content = helpers.call_action('dcat_dataset_show',
+                                      id=dataset['id'], format='ttl')
+
+        p = RDFParser()
+        p.parse(content, _format='turtle')
+
+        eq_([d for d in p.datasets()][0]['notes'], 'Updated notes')
+
+    @helpers.change_config('ckanext.dcat.dataset_cache.max_items', 10)
+    def test_dataset_show_cache_invalidated_on_update_by_name(self):
+        dataset = factories.Dataset(notes='Test dataset')
+
+        helpers.call_action('dcat_dataset_show',
+                            id=dataset['id'], format='ttl')
+
+        eq_(dataset_cache().stats()['items'], 1)
+
+        dataset['id'] = dataset['name']
+        dataset['notes'] = 'Updated notes'
+        helpers.call_action('package_update', **dataset)
+
+        eq_(dataset_cache().stats()['items'], 0)
+
+    @helpers.change_config('ckanext.dcat.dataset_cache.max_items', 10)
+    def test_dataset_show_cache_invalidated_on_delete_by_name(self):
+        dataset = factories.Dataset(notes='Test dataset')
+
+        helpers.call_action('dcat_dataset_show',
+                            id=dataset['id'], format='ttl')
+
+        helpers.call_action('package_delete', id=dataset['name'])
+
+        eq_(dataset_cache().stats()['items'], 0)
+
+    @helpers.change_config('ckanext.dcat.dataset_cache.max_items', 10)
+    def test_dataset_show_cache_invalidated_on_delete(self):
+        dataset = factories.Dataset(notes='Test dataset')
+
+        helpers.call_action('dcat_dataset_show',
+                            id=dataset['id'], format='ttl')
+
+        helpers.call_action('package_delete', id=dataset['id'])
+
+        eq_(dataset_cache().stats()['items'], 0)
+
+    def test_dataset_show_cache_disabled_by_default(self):
+        dataset = factories.Dataset(notes='Test dataset')
+
+        helpers.call_action('dcat_dataset_show',
+                            id=dataset['id'], format='ttl')
+
+        eq_(dataset_cache().stats()['items'], 0)
+
+    def test_dataset_show_not_found(self):
+
+        assert_raises(toolkit.ObjectNotFound, helpers.call_action,
+                      'dcat_dataset_show', id='not-found')
@@ -149,6 +149,27 @@ class TestSchemaOrgProfileSerializeDataset(BaseSerializeTest):
         assert self._triple(g, publisher, RDF.type, SCHEMA.Organization)
         assert self._triple(g, publisher, SCHEMA.name, dataset['organization']['title'])
 
+    def test_publisher_contact_point_shared(self):
+        datasets = [{
+            'id': '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd{0}'.format(i),
+            'name': 'test-dataset-{0}'.format(i),
+            'organization': {
+                'id': '',
+                'name': 'publisher1',
+                'title': 'Example Publisher from Org',
+            }
+        } for i in xrange(3)]
+
+        s = RDFSerializer(profiles=['schemaorg'])
+        g = s.g
+
+        s.serialize_catalog({}, dataset_dicts=datasets)
+
+        publishers = set(g.objects(None, SCHEMA.publisher))
+        eq_(len(publishers), 1)
+        eq_(len(list(g.subjects(RDF.type, SCHEMA.ContactPoint))), 1)
+        eq_(len(list(g.objects(publishers.pop(), SCHEMA.contactPoint))), 1)
+
     def test_temporal_start_and_end(self):
         dataset = {
             'id': '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd6',
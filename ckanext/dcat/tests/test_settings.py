@@ -0,0 +1,74 @@
+import nose
+
+from ckanext.dcat.processors import RDFParser, RDFSerializer
+from ckanext.dcat.settings import (DCATSettings, DCATSettingsError,
+                                   dcat_settings, DEFAULT_RDF_PROFILES)
+
+eq_ = nose.tools.eq_
+assert_raises = nose.tools.assert_raises
+
+
+class TestDCATSettings(object):
+
+    def test_defaults(self):
+
+        settings = DCATSettings.from_config({})
+
+        eq_(settings.profiles, tuple(DEFAULT_RDF_PROFILES))
+        eq_(settings.compatibility_mode, False)
+        eq_(settings.expose_subcatalogs, False)
+        eq_(settings.clean_tags, False)
+        eq_(settings.normalize_ckan_format, True)
+        eq_(settings.datasets_per_page, 100)
+        eq_(settings.stream_catalog, False)
+        eq_(settings.catalog_endpoint, '/catalog.{_format}')
+        eq_(settings.json_endpoint, '/dcat.json')
+        eq_(settings.enable_rdf_endpoints, True)
+        eq_(settings.enable_content_negotiation, False)
+        eq_(settings.translate_keys, True)
+
+    def test_values(self):
+
+        settings = DCATSettings.from_config({
+            'ckanext.dcat.rdf.profiles': 'euro_dcat_ap schemaorg',
+            'ckanext.dcat.expose_subcatalogs': 'true',
+            'ckanext.dcat.normalize_ckan_format': 'false',
+            'ckanext.dcat.datasets_per_page': '20',
+            'ckanext.dcat.catalog_endpoint': '/dcat/catalog/{_format}',
+        })
+
+        eq_(settings.profiles, ('euro_dcat_ap', 'schemaorg'))
+        eq_(settings.expose_subcatalogs, True)
+        eq_(settings.normalize_ckan_format, False)
+        eq_(settings.datasets_per_page, 20)
+        eq_(settings.catalog_endpoint, '/dcat/catalog/{_format}')
+
+    def test_immutable(self):
+
+        settings = DCATSettings.from_config({})
+
+        assert_raises(AttributeError, setattr, settings, 'clean_tags', True)
+
+    def test_invalid_values(self):
+
+        for key, value in (
+                ('ckanext.dcat.clean_tags', 'maybe'),
+                ('ckanext.dcat.datasets_per_page', 'many'),
+                ('ckanext.dcat.datasets_per_page', '0'),
+                ('ckanext.dcat.catalog_endpoint', 'catalog.{_format}'),
+                ('ckanext.dcat.catalog_endpoint', '/catalog'),
+                ):
+            assert_raises(DCATSettingsError, DCATSettings.from_config,
+                          {key: value})
+
+    def test_processors_and_profiles_use_settings(self):
+
+        settings = dcat_settings()._replace(expose_subcatalogs=True)
+
+        for processor in (RDFParser(settings=settings),
+                          RDFSerializer(settings=settings)):
+            eq_(processor.settings, settings)
+            for profile in processor._get_profile_instances():
+                eq_(profile.settings, settings)
+
+        eq_(RDFParser().settings, dcat_settings())
@@ -1,6 +1,13 @@
 import nose
+import mock
 
-from ckanext.dcat.utils import parse_accept_header
+from ckanext.dcat import utils
+from ckanext.dcat.cache import catalog_cache, reset_catalog_cache
+from ckanext.dcat.utils import (parse_accept_header, ExtrasIndex,
+                                ResourceFormatIndex, isoformat_date,
+                                URIFactory)
+from ckan.plugins import toolkit
+from ckantoolkit.tests import helpers
 
 eq_ = nose.tools.eq_
 
@@ -126,3 +133,186 @@ class TestAcceptHeaders(object):
         _format = parse_accept_header(header)
 
         eq_(_format, None)
+
+
+class TestExtrasIndex(object):
+
+    def _dict(self):
+        return {
+            'extras': [
+                {'key': 'a', 'value': '1'},
+                {'key': 'a', 'value': '2'},
+                {'key': 'dcat_b', 'value': '3'},
+                {'key': 'b', 'value': '4'},
+            ]
+        }
+
+    def test_get(self):
+
+        extras = ExtrasIndex(self._dict())
+
+        eq_(extras.get('a'), '1')
+        eq_(extras.get('dcat_b'), '3')
+        eq_(extras.get('b'), '4')
+        eq_(extras.get('c'), None)
+        eq_(extras.get('c', 'x'), 'x')
+
+    def test_get_legacy(self):
+
+        extras = ExtrasIndex(self._dict())
+
+        # The first matching extra is returned, as when scanning the list
+        eq_(extras.get('b', legacy=True), '3')
+        eq_(extras.get('dcat_b', legacy=True), '3')
+        eq_(extras.get('a', legacy=True), '1')
+
+    def test_no_extras(self):
+
+        extras = ExtrasIndex({})
+
+        eq_(extras.get('a'), None)
+
+
+class TestResourceFormatIndex(object):
+
+    def test_label(self):
+
+        formats = ResourceFormatIndex()
+
+        if toolkit.check_ckan_version(min_version='2.3'):
+            eq_(formats.label('text/csv'), 'CSV')
+            eq_(formats.label('Text/CSV'), 'CSV')
+            eq_(formats.label('csv'), 'CSV')
+            eq_(formats.label('.csv'), 'CSV')
+            eq_(formats.label('Comma Separated Values File'), 'CSV')
+        eq_(formats.label('text/unknown-imt'), None)
+        eq_(formats.label(None), None)
+
+    def test_extension(self):
+
+        formats = ResourceFormatIndex()
+
+        eq_(formats.extension('text/csv'), 'csv')
+        eq_(formats.extension('text/unknown-imt'), None)
+        # Cached values are returned too
+        eq_(formats.extension('text/csv'), 'csv')
+        eq_(formats.extension('text/unknown-imt'), None)
+
+
+class TestIsoformatDate(object):
+
+    def test_ckan_dates(self):
+
+        eq_(isoformat_date('2016-01-05'), '2016-01-05T00:00:00')
+        eq_(isoformat_date('2016-01-05T10:18:09'), '2016-01-05T10:18:09')
+        eq_(isoformat_date('2016-01-05T10:18:09.123456'),
+            '2016-01-05T10:18:09.123456')
+        eq_(isoformat_date('2016-01-05T10:18:09.1'),
+            '2016-01-05T10:18:09.100000')
+        eq_(isoformat_date('2016-01-05T10:18:09.000000'),
+            '2016-01-05T10:18:09')
+
+    def test_other_dates(self):
+
+        eq_(isoformat_date('2016-01-05T10:18:09Z'),
+            '2016-01-05T10:18:09+00:00')
+        eq_(isoformat_date('5 January 2016'), '2016-01-05T00:00:00')
+        eq_(isoformat_date(' 2016-01-05 '), '2016-01-05T00:00:00')
+
+    def test_invalid_dates(self):
+
+        for value in ('2016-02-30', 'not a date'):
+            nose.tools.assert_raises(ValueError, isoformat_date, value)
+            # Also when the result is cached
+            nose.tools.assert_raises(ValueError, isoformat_date, value)
+
+
+class TestURIFactory(object):
+
+    def test_uris(self):
+
+        factory = URIFactory('http://example.com/')
+
+        eq_(factory.catalog_uri(), 'http://example.com/')
+        eq_(factory.dataset_uri({'id': 'd1'}), 'http://example.com/dataset/d1')
+        eq_(factory.resource_uri({'id': 'r1'}, 'd1'),
+            'http://example.com/dataset/d1/resource/r1')
+        eq_(factory.publisher_uri({'organization': {'id': 'o1'}}),
+            'http://example.com/organization/o1')
+        eq_(factory.publisher_uri({}), None)
+
+    def test_dataset_uri_random_id(self):
+
+        factory = URIFactory('http://example.com')
+
+        uri = factory.dataset_uri({})
+
+        assert uri.startswith('http://example.com/dataset/')
+        assert uri != factory.dataset_uri({})
+
+    def test_base_uri_with_braces(self):
+
+        factory = URIFactory('http://example.com/{x}')
+
+        eq_(factory.dataset_uri({'id': 'd1'}),
+            'http://example.com/{x}/dataset/d1')
+
+
+class TestURIHelpers(object):
+
+    def teardown(self):
+        # Use the original config again
+        utils.reset_uri_factory()
+
+    @helpers.change_config('ckanext.dcat.base_uri', 'http://base.example.com')
+    def test_uri_helpers_use_factory(self):
+
+        utils.reset_uri_factory()
+
+        eq_(utils.catalog_uri(), 'http://base.example.com')
+        eq_(utils.dataset_uri({'id': 'd1'}),
+            'http://base.example.com/dataset/d1')
+        eq_(utils.dataset_uri({'id': 'd1', 'uri': 'http://other/d1'}),
+            'http://other/d1')
+        eq_(utils.resource_uri({'id': 'r1', 'package_id': 'd1'}),
+            'http://base.example.com/dataset/d1/resource/r1')
+        eq_(utils.publisher_uri_from_dataset_dict(
+            {'organization': {'id': 'o1'}}),
+            'http://base.example.com/organization/o1')
+
+
+class TestLastCatalogModification(object):
+
+    def setup(self):
+        reset_catalog_cache()
+
+    def teardown(self):
+        reset_catalog_cache()
+
+    @helpers.change_config('ckanext.dcat.catalog_cache.ttl', 60)
+    @mock.patch('ckanext.dcat.utils.toolkit.get_action')
+    def test_refresh(self, mock_get_action):
+
+        modified = ['2017-01-01T00:00:00']
+
+        def get_action(name):
+            if name == 'get_site_user':
+                return lambda context, data_dict=None: {'name': 'site-user'}
+            return lambda context, data_dict: {
+                'results': [{'metadata_modified': modified[0]}]}
+
+        mock_get_action.side_effect = get_action
+
+        eq_(utils.last_catalog_modification(), '2017-01-01T00:00:00')
+        catalog_cache().set('catalog-triples', [])
+
+        # Modified on another process
+        modified[0] = '2017-01-02T00:00:00'
+
+        eq_(utils.last_catalog_modification(), '2017-01-01T00:00:00')
+        eq_(utils.last_catalog_modification(refresh=True),
+            '2017-01-02T00:00:00')
+        eq_(utils.last_catalog_modification(), '2017-01-02T00:00:00')
+
+        # Values depending on the old date are gone
+        eq_(catalog_cache().get('catalog-triples'), None)
@@ -1,6 +1,11 @@
+import re
 import logging
 import uuid
 import json
+import datetime
+import mimetypes
+
+from dateutil.parser import parse as parse_date
 
 from ckantoolkit import config, h
 
@@ -13,24 +18,43 @@ except ImportError:
         pass
 
 from ckan import model
+from ckan.plugins import PluginImplementations
 import ckan.plugins.toolkit as toolkit
 
+from ckanext.dcat.cache import catalog_cache
+from ckanext.dcat.interfaces import IDCATURIFactory
+
 _ = toolkit._
 
 log = logging.getLogger(__name__)
 
 DCAT_EXPOSE_SUBCATALOGS = 'ckanext.dcat.expose_subcatalogs'
+DCAT_STREAM_CATALOG = 'ckanext.dcat.stream_catalog'
 
 CONTENT_TYPES = {
     'rdf': 'application/rdf+xml',
     'xml': 'application/rdf+xml',
     'n3': 'text/n3',
     'ttl': 'text/turtle',
+    'nt': 'application/n-triples',
     'jsonld': 'application/ld+json',
 }
 
 DCAT_CLEAN_TAGS = 'ckanext.dcat.clean_tags'
 
+# Maximum number of media types whose file extension is remembered by
+# `ResourceFormatIndex`
+FORMAT_EXTENSIONS_MAX_ITEMS = 1000
+
+# Maximum number of values remembered by `isoformat_date`
+DATE_CACHE_MAX_ITEMS = 10000
+
+# Dates as stored by CKAN (eg `2016-01-05T10:18:09.123456`), which can be
+# parsed without dateutil
+ISO_DATE_RE = re.compile(
+    r'([1-9]\d{3})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?)?\Z')
+
 
 def field_labels():
     '''
@@ -122,8 +146,15 @@ def catalog_uri():
 
     A warning is emited if the third option is used.
 
+    The value is computed once, when the URI factory is created (see
+    `uri_factory()`).
+
     Returns a string with the catalog URI.
     '''
+    return uri_factory().catalog_uri()
+
+
+def _catalog_uri_from_config():
 
     uri = config.get('ckanext.dcat.base_uri')
     if not uri:
@@ -143,7 +174,179 @@ def catalog_uri():
     return uri
 
 
-def dataset_uri(dataset_dict):
+class URIFactory(object):
+    '''
+    Mints the URIs of the catalog and of the datasets, resources and
+    publishers that do not define their own
+
+    The URIs are built from the catalog URI (`base_uri`), using templates
+    computed on creation:
+
+        * Catalog: `base_uri`
+        * Dataset: `base_uri` + '/dataset/' + `id`
+        * Resource: `base_uri` + '/dataset/' + `dataset id` + '/resource/'
+          + `id`
+        * Publisher: `base_uri` + '/organization/' + `organization id`
+
+    Sites with a different URI scheme can provide their own factory (usually
+    a subclass of this one) implementing the `IDCATURIFactory` interface.
+    '''
+
+    def __init__(self, base_uri):
+        self.base_uri = base_uri
+
+        base = base_uri.rstrip('/').replace('{', '{{').replace('}', '}}')
+        self.dataset_template = base + '/dataset/{0}'
+        self.resource_template = base + '/dataset/{0}/resource/{1}'
+        self.publisher_template = base + '/organization/{0}'
+
+    def catalog_uri(self):
+        return self.base_uri
+
+    def dataset_uri(self, dataset_dict):
+        '''
+        Returns an URI for a dataset dict
+
+        If the dataset has no id a random one is used.
+        '''
+        dataset_id = dataset_dict.get('id')
+        if not dataset_id:
+            dataset_id = str(uuid.uuid4())
+            log.warning('Using a random id for dataset URI')
+        return self.dataset_template.format(dataset_id)
+
+    def resource_uri(self, resource_dict, dataset_id):
+        '''
+        Returns an URI for a resource dict, which belongs to the dataset with
+        id `dataset_id`
+        '''
+        return self.resource_template.format(dataset_id, resource_dict['id'])
+
+    def publisher_uri(self, dataset_dict):
+        '''
+        Returns an URI for the publisher of a dataset dict, or None if the
+        dataset does not belong to an organization
+        '''
+        if dataset_dict.get('organization'):
+            return self.publisher_template.format(
+                dataset_dict['organization']['id'])
+        return None
+
+
+_uri_factory = None
+
+
+def uri_factory():
+    '''
+    Returns the URI factory shared by the whole process
+
+    It is created on startup by the `dcat` plugin (or on first use), with
+    the catalog URI defined in the config. The first plugin implementing
+    `IDCATURIFactory` that returns a factory will replace the default
+    `URIFactory`.
+    '''
+    global _uri_factory
+    if _uri_factory is None:
+        _uri_factory = _build_uri_factory()
+    return _uri_factory
+
+
+def reset_uri_factory():
+    '''
+    Discards the current URI factory and creates it again with the current
+    config options and plugins
+
+    Returns the new factory.
+    '''
+    global _uri_factory
+    _uri_factory = _build_uri_factory()
+    return _uri_factory
+
+
+def _build_uri_factory():
+    base_uri = _catalog_uri_from_config()
+    for plugin in PluginImplementations(IDCATURIFactory):
+        factory = plugin.get_uri_factory(base_uri)
+        if factory is not None:
+            return factory
+    return URIFactory(base_uri)
+
+
+def last_catalog_modification(refresh=False):
+    '''
+    Returns the date and time the catalog was last modified
+
+    To be more precise, the most recent value for `metadata_modified` on a
+    dataset. The value is kept in the catalog cache (see
+    `ckanext.dcat.cache.catalog_cache`), so the search index is not queried
+    on every request.
+
+    If `refresh` is True the search index is always queried (eg to answer
+    conditional requests, which can not rely on a value that may be out of
+    date). If the value has changed, the rest of the catalog cache, which
+    may depend on it, is cleared.
+
+    Returns a dateTime string in ISO format, or None if it could not be
+    found.
+    '''
+    cache = catalog_cache()
+    key = 'last_catalog_modification'
+    cached = cache.get(key, cache)
+    if cached is not cache and not refresh:
+        return cached
+
+    context = {
+        'user': toolkit.get_action('get_site_user')(
+            {'ignore_auth': True})['name']
+    }
+    result = toolkit.get_action('package_search')(context, {
+        'sort': 'metadata_modified desc',
+        'rows': 1,
+        'fl': 'metadata_modified',
+    })
+    modified = None
+    if result and result.get('results'):
+        modified = result['results'][0]['metadata_modified']
+
+    if cached is not cache and cached != modified:
+        cache.clear()
+    cache.set(key, modified)
+    return modified
+
+
+class ExtrasIndex(object):
+    '''
+    Index of the extras of a CKAN dict, so they can be looked up by key
+    without scanning the whole list every time
+
+    As when scanning the list, if there are several extras with the same key
+    the first one is used. The dict the index was built from is available
+    as `source_dict`.
+    '''
+
+    def __init__(self, _dict):
+        self.source_dict = _dict
+        self._values = {}
+        self._legacy_values = {}
+        for extra in _dict.get('extras') or []:
+            key, value = extra['key'], extra['value']
+            self._values.setdefault(key, value)
+            self._legacy_values.setdefault(key, value)
+            if key.startswith('dcat_'):
+                self._legacy_values.setdefault(key[len('dcat_'):], value)
+
+    def get(self, key, default=None, legacy=False):
+        '''
+        Returns the value of the extra with the provided key
+
+        If `legacy` is True, extras with the key prefixed with `dcat_` are
+        also checked, to support legacy fields.
+        '''
+        values = self._legacy_values if legacy else self._values
+        return values.get(key, default)
+
+
+def dataset_uri(dataset_dict, extras=None):
     '''
     Returns an URI for the dataset
 
@@ -154,27 +357,26 @@ def dataset_uri(dataset_dict):
 
         1. The value of the `uri` field
         2. The value of an extra with key `uri`
-        3. `catalog_uri()` + '/dataset/' + `id` field
+        3. A URI minted by the URI factory (by default `catalog_uri()` +
+           '/dataset/' + `id` field)
 
     Check the documentation for `catalog_uri()` for the recommended ways of
     setting it.
 
+    `extras` is an optional `ExtrasIndex` for the dataset dict.
+
     Returns a string with the dataset URI.
     '''
 
     uri = dataset_dict.get('uri')
     if not uri:
-        for extra in dataset_dict.get('extras', []):
-            if extra['key'] == 'uri' and extra['value'] != 'None':
-                uri = extra['value']
-                break
-    if not uri and dataset_dict.get('id'):
-        uri = '{0}/dataset/{1}'.format(catalog_uri().rstrip('/'),
-                                       dataset_dict['id'])
+        if extras is None:
+            extras = ExtrasIndex(dataset_dict)
+        uri = extras.get('uri')
+        if uri == 'None':
+            uri = None
     if not uri:
-        uri = '{0}/dataset/{1}'.format(catalog_uri().rstrip('/'),
-                                       str(uuid.uuid4()))
-        log.warning('Using a random id for dataset URI')
+        uri = uri_factory().dataset_uri(dataset_dict)
 
     return uri
 
@@ -189,8 +391,8 @@ def resource_uri(resource_dict):
     The value will be the first found of:
 
         1. The value of the `uri` field
-        2. `catalog_uri()` + '/dataset/' + `package_id` + '/resource/'
-            + `id` field
+        2. A URI minted by the URI factory (by default `catalog_uri()` +
+           '/dataset/' + `package_id` + '/resource/' + `id` field)
 
     Check the documentation for `catalog_uri()` for the recommended ways of
     setting it.
@@ -202,14 +404,12 @@ def resource_uri(resource_dict):
     if not uri or uri == 'None':
         dataset_id = dataset_id_from_resource(resource_dict)
 
-        uri = '{0}/dataset/{1}/resource/{2}'.format(catalog_uri().rstrip('/'),
-                                                    dataset_id,
-                                                    resource_dict['id'])
+        uri = uri_factory().resource_uri(resource_dict, dataset_id)
 
     return uri
 
 
-def publisher_uri_from_dataset_dict(dataset_dict):
+def publisher_uri_from_dataset_dict(dataset_dict, extras=None):
     '''
     Returns an URI for a dataset's publisher
 
@@ -220,24 +420,25 @@ def publisher_uri_from_dataset_dict(dataset_dict):
 
         1. The value of the `publisher_uri` field
         2. The value of an extra with key `publisher_uri`
-        3. `catalog_uri()` + '/organization/' + `organization id` field
+        3. A URI minted by the URI factory (by default `catalog_uri()` +
+           '/organization/' + `organization id` field)
 
     Check the documentation for `catalog_uri()` for the recommended ways of
     setting it.
 
+    `extras` is an optional `ExtrasIndex` for the dataset dict.
+
     Returns a string with the publisher URI, or None if no URI could be
     generated.
     '''
 
     uri = dataset_dict.get('publisher_uri')
     if not uri:
-        for extra in dataset_dict.get('extras', []):
-            if extra['key'] == 'publisher_uri':
-                uri = extra['value']
-                break
-    if not uri and dataset_dict.get('organization'):
-        uri = '{0}/organization/{1}'.format(catalog_uri().rstrip('/'),
-                                            dataset_dict['organization']['id'])
+        if extras is None:
+            extras = ExtrasIndex(dataset_dict)
+        uri = extras.get('publisher_uri')
+    if not uri:
+        uri = uri_factory().publisher_uri(dataset_dict)
 
     return uri
 
@@ -256,6 +457,127 @@ def dataset_id_from_resource(resource_dict):
         return resource.get_package_id()
 
 
+class ResourceFormatIndex(object):
+    '''
+    Lookup table for resource formats
+
+    It maps the media types, labels and alternative names of the formats
+    known to CKAN (`ckan.lib.helpers.resource_formats`, CKAN>=2.3 only) to
+    the CKAN format label, ignoring case, and media types to their usual
+    file extension. The table is built the first time it is used. Use
+    `resource_format_index()` to get the instance shared by the whole
+    process.
+    '''
+
+    def __init__(self):
+        self._labels = None
+        self._extensions = {}
+
+    def _load_labels(self):
+        labels = {}
+        if toolkit.check_ckan_version(min_version='2.3'):
+            from ckan.lib import helpers
+            for key, line in helpers.resource_formats().iteritems():
+                labels.setdefault(key.lower(), line[1])
+        return labels
+
+    def label(self, value):
+        '''
+        Returns the CKAN format label for the provided media type, label,
+        alternative name or file extension (eg `text/csv`, `csv` or `.csv`
+        all return `CSV`), or None if the format is not known
+        '''
+        if not value:
+            return None
+        labels = self._labels
+        if labels is None:
+            labels = self._labels = self._load_labels()
+        key = value.strip().lower()
+        if key not in labels and key.startswith('.'):
+            key = key[1:]
+        return labels.get(key)
+
+    def extension(self, media_type):
+        '''
+        Returns the usual file extension (without the leading dot) for the
+        provided media type, or None if it is not known
+        '''
+        try:
+            return self._extensions[media_type]
+        except KeyError:
+            pass
+        extension = mimetypes.guess_extension(media_type)
+        if extension:
+            extension = extension[1:]
+        if len(self._extensions) >= FORMAT_EXTENSIONS_MAX_ITEMS:
+            self._extensions.clear()
+        self._extensions[media_type] = extension
+        return extension
+
+
+_resource_format_index = None
+
+
+def resource_format_index():
+    '''
+    Returns the `ResourceFormatIndex` shared by the whole process
+    '''
+    global _resource_format_index
+    if _resource_format_index is None:
+        _resource_format_index = ResourceFormatIndex()
+    return _resource_format_index
+
+
+_date_cache = {}
+
+
+def isoformat_date(value):
+    '''
+    Returns the ISO 8601 representation of a date string
+
+    The result is the same as parsing the value with dateutil, with any
+    missing parts set to their lowest value (eg `2016-01-05` returns
+    `2016-01-05T00:00:00`), and calling `isoformat()` on it. Dates in the
+    format stored by CKAN are parsed directly, and dateutil is only used
+    for other values. Results are cached.
+
+    Raises ValueError if the value can not be parsed.
+    '''
+    try:
+        result = _date_cache[value]
+    except (KeyError, TypeError):
+        result = _isoformat_date(value)
+        if isinstance(value, basestring):
+            if len(_date_cache) >= DATE_CACHE_MAX_ITEMS:
+                _date_cache.clear()
+            _date_cache[value] = result
+
+    if result is None:
+        raise ValueError('Unknown date format: {0!r}'.format(value))
+    return result
+
+
+def _isoformat_date(value):
+    if isinstance(value, basestring):
+        match = ISO_DATE_RE.match(value)
+        if match:
+            parts = match.groups()
+            microsecond = parts[6]
+            try:
+                return datetime.datetime(
+                    *[int(part or 0) for part in parts[:6]],
+                    microsecond=int(microsecond.ljust(6, '0'))
+                    if microsecond else 0).isoformat()
+            except ValueError:
+                # Let dateutil decide
+                pass
+    try:
+        default_datetime = datetime.datetime(1, 1, 1, 0, 0, 0)
+        return parse_date(value, default=default_datetime).isoformat()
+    except ValueError:
+        return None
+
+
 def url_to_rdflib_format(_format):
     '''
     Translates the RDF formats used on the endpoints to rdflib ones
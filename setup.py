@@ -46,6 +46,7 @@ setup(
 
     [paste.paster_command]
     generate_static = ckanext.dcat.commands:GenerateStaticDCATCommand
+    dcat_harvest_guids = ckanext.dcat.commands:DCATHarvestGuidsCommand
 
     [babel.extractors]
     ckan = ckan.lib.extract:extract_ckan